@@ -0,0 +1,47 @@
+"""currency_rates unique (base_currency, target_currency)
+
+Revision ID: 3b9d964add4a
+Revises: 4013dfde97b0
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9d964add4a'
+down_revision: Union[str, None] = '4013dfde97b0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # keep the most recently updated row of every duplicated pair
+    op.execute(sa.text("""
+        DELETE FROM currency_rates
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY base_currency, target_currency
+                    ORDER BY updated_at DESC, id DESC
+                ) AS rn
+                FROM currency_rates
+            ) ranked
+            WHERE rn > 1
+        )
+    """))
+    # the unique constraint's index also serves base_currency lookups of the snapshot
+    op.create_unique_constraint(
+        'uq_currency_rates_base_target',
+        'currency_rates',
+        ['base_currency', 'target_currency']
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_currency_rates_base_target', 'currency_rates', type_='unique')
@@ -0,0 +1,32 @@
+"""conversion_history (user_id, exchange_time desc, id) index
+
+Revision ID: 4013dfde97b0
+Revises: b54ac57848f7
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4013dfde97b0'
+down_revision: Union[str, None] = 'b54ac57848f7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_conversion_history_user_time_id',
+        'conversion_history',
+        ['user_id', sa.text('exchange_time DESC'), 'id']
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversion_history_user_time_id', table_name='conversion_history')
@@ -0,0 +1,50 @@
+"""conversion_rollups per user, pair and day
+
+Revision ID: a8709b776a68
+Revises: dc51d3badbf8
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8709b776a68'
+down_revision: Union[str, None] = 'dc51d3badbf8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(sa.text("""
+        CREATE TABLE conversion_rollups (
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            base_currency VARCHAR NOT NULL,
+            target_currency VARCHAR NOT NULL,
+            day DATE NOT NULL,
+            conversions INTEGER NOT NULL,
+            amount_total FLOAT NOT NULL,
+            converted_total FLOAT NOT NULL,
+            rate_total FLOAT NOT NULL,
+            rate_min FLOAT NOT NULL,
+            rate_max FLOAT NOT NULL,
+            PRIMARY KEY (user_id, base_currency, target_currency, day)
+        )
+    """))
+    # history written before this revision, later inserts keep the rollups current themselves
+    op.execute(sa.text("""
+        INSERT INTO conversion_rollups
+        SELECT user_id, base_currency, target_currency, (exchange_time AT TIME ZONE 'UTC')::date,
+               count(*), sum(amount), sum(converted_amount), sum(rate), min(rate), max(rate)
+        FROM conversion_history
+        GROUP BY user_id, base_currency, target_currency, (exchange_time AT TIME ZONE 'UTC')::date
+    """))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(sa.text("DROP TABLE conversion_rollups"))
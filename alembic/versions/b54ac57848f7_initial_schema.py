@@ -0,0 +1,61 @@
+"""initial schema
+
+Revision ID: b54ac57848f7
+Revises: 
+Create Date: 2025-06-20 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b54ac57848f7'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(), nullable=False),
+        sa.Column('hash_password', sa.String(), nullable=False),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('username')
+    )
+    op.create_table(
+        'currency_rates',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('base_currency', sa.String(), nullable=False),
+        sa.Column('target_currency', sa.String(), nullable=False),
+        sa.Column('rate', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'conversion_history',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('base_currency', sa.String(), nullable=False),
+        sa.Column('target_currency', sa.String(), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.Column('converted_amount', sa.Float(), nullable=False),
+        sa.Column('rate', sa.Float(), nullable=False),
+        sa.Column('exchange_time', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('conversion_history')
+    op.drop_table('currency_rates')
+    op.drop_table('users')
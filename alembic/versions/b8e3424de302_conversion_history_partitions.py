@@ -0,0 +1,124 @@
+"""conversion_history partitioned by month, conversion_history_archive
+
+Revision ID: b8e3424de302
+Revises: a8709b776a68
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e3424de302'
+down_revision: Union[str, None] = 'a8709b776a68'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = "id, user_id, base_currency, target_currency, amount, converted_amount, rate, exchange_time"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(sa.text("ALTER TABLE conversion_history RENAME TO conversion_history_unpartitioned"))
+    op.execute(sa.text("ALTER INDEX ix_conversion_history_user_time_id RENAME TO ix_conversion_history_unpartitioned"))
+    op.execute(sa.text(
+        "ALTER TABLE conversion_history_unpartitioned "
+        "RENAME CONSTRAINT conversion_history_pkey TO conversion_history_unpartitioned_pkey"
+    ))
+    # the partition key has to be part of the primary key, ids keep coming from the existing sequence
+    op.execute(sa.text("""
+        CREATE TABLE conversion_history (
+            id INTEGER NOT NULL DEFAULT nextval('conversion_history_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            base_currency VARCHAR NOT NULL,
+            target_currency VARCHAR NOT NULL,
+            amount FLOAT NOT NULL,
+            converted_amount FLOAT NOT NULL,
+            rate FLOAT NOT NULL,
+            exchange_time TIMESTAMP WITH TIME ZONE NOT NULL,
+            PRIMARY KEY (id, exchange_time)
+        ) PARTITION BY RANGE (exchange_time)
+    """))
+    op.execute(sa.text(
+        "CREATE INDEX ix_conversion_history_user_time_id ON conversion_history (user_id, exchange_time DESC, id)"
+    ))
+    # one partition per month from the oldest row on; later months are created by archive_conversion_history
+    op.execute(sa.text("""
+        DO $$
+        DECLARE
+            part_month date := date_trunc('month', coalesce(
+                (SELECT min(exchange_time) FROM conversion_history_unpartitioned), now()
+            ) AT TIME ZONE 'UTC')::date;
+            last_month date := (date_trunc('month', now() AT TIME ZONE 'UTC') + interval '2 months')::date;
+        BEGIN
+            WHILE part_month <= last_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE conversion_history_p%s PARTITION OF conversion_history '
+                    'FOR VALUES FROM (%L) TO (%L)',
+                    to_char(part_month, 'YYYYMM'),
+                    part_month || ' 00:00:00+00',
+                    (part_month + interval '1 month')::date || ' 00:00:00+00'
+                );
+                part_month := (part_month + interval '1 month')::date;
+            END LOOP;
+        END $$
+    """))
+    op.execute(sa.text(
+        f"INSERT INTO conversion_history ({COLUMNS}) SELECT {COLUMNS} FROM conversion_history_unpartitioned"
+    ))
+    op.execute(sa.text("ALTER SEQUENCE conversion_history_id_seq OWNED BY conversion_history.id"))
+    op.execute(sa.text("DROP TABLE conversion_history_unpartitioned"))
+
+    # compact and unpartitioned: old months are only read by exports and deep history pages
+    op.execute(sa.text("""
+        CREATE TABLE conversion_history_archive (
+            id INTEGER NOT NULL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            base_currency VARCHAR NOT NULL,
+            target_currency VARCHAR NOT NULL,
+            amount FLOAT NOT NULL,
+            converted_amount FLOAT NOT NULL,
+            rate FLOAT NOT NULL,
+            exchange_time TIMESTAMP WITH TIME ZONE NOT NULL
+        )
+    """))
+    op.execute(sa.text(
+        "CREATE INDEX ix_conversion_history_archive_user_time "
+        "ON conversion_history_archive (user_id, exchange_time DESC, id)"
+    ))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(sa.text("ALTER TABLE conversion_history RENAME TO conversion_history_partitioned"))
+    op.execute(sa.text("ALTER INDEX ix_conversion_history_user_time_id RENAME TO ix_conversion_history_partitioned"))
+    op.execute(sa.text(
+        "ALTER TABLE conversion_history_partitioned "
+        "RENAME CONSTRAINT conversion_history_pkey TO conversion_history_partitioned_pkey"
+    ))
+    op.execute(sa.text("""
+        CREATE TABLE conversion_history (
+            id INTEGER NOT NULL DEFAULT nextval('conversion_history_id_seq') PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            base_currency VARCHAR NOT NULL,
+            target_currency VARCHAR NOT NULL,
+            amount FLOAT NOT NULL,
+            converted_amount FLOAT NOT NULL,
+            rate FLOAT NOT NULL,
+            exchange_time TIMESTAMP WITH TIME ZONE NOT NULL
+        )
+    """))
+    op.execute(sa.text(
+        f"INSERT INTO conversion_history ({COLUMNS}) "
+        f"SELECT {COLUMNS} FROM conversion_history_archive "
+        f"UNION ALL SELECT {COLUMNS} FROM conversion_history_partitioned"
+    ))
+    op.execute(sa.text("ALTER SEQUENCE conversion_history_id_seq OWNED BY conversion_history.id"))
+    op.execute(sa.text("DROP TABLE conversion_history_partitioned"))
+    op.execute(sa.text("DROP TABLE conversion_history_archive"))
+    op.execute(sa.text(
+        "CREATE INDEX ix_conversion_history_user_time_id ON conversion_history (user_id, exchange_time DESC, id)"
+    ))
@@ -0,0 +1,34 @@
+"""conversion_history.buffer_id for idempotent write-behind flushes
+
+Revision ID: c41f7a9e2d06
+Revises: b8e3424de302
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41f7a9e2d06'
+down_revision: Union[str, None] = 'b8e3424de302'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(sa.text("ALTER TABLE conversion_history ADD COLUMN buffer_id VARCHAR"))
+    # rows written directly keep buffer_id NULL, NULLs never conflict
+    op.execute(sa.text(
+        "ALTER TABLE conversion_history "
+        "ADD CONSTRAINT uq_conversion_history_buffer_id UNIQUE (buffer_id, exchange_time)"
+    ))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(sa.text("ALTER TABLE conversion_history DROP CONSTRAINT uq_conversion_history_buffer_id"))
+    op.execute(sa.text("ALTER TABLE conversion_history DROP COLUMN buffer_id"))
@@ -0,0 +1,45 @@
+"""rate_snapshots partitioned by day
+
+Revision ID: dc51d3badbf8
+Revises: 3b9d964add4a
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'dc51d3badbf8'
+down_revision: Union[str, None] = '3b9d964add4a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the primary key (base, target, taken_at) is the index behind point-in-time lookups
+    op.execute(sa.text("""
+        CREATE TABLE rate_snapshots (
+            base_currency VARCHAR NOT NULL,
+            target_currency VARCHAR NOT NULL,
+            taken_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            rate FLOAT NOT NULL,
+            PRIMARY KEY (base_currency, target_currency, taken_at)
+        ) PARTITION BY RANGE (taken_at)
+    """))
+    # later days are created by update_currency_rates before it writes
+    today = datetime.now(timezone.utc).date()
+    for day in (today, today + timedelta(days=1)):
+        op.execute(sa.text(
+            f"CREATE TABLE rate_snapshots_p{day:%Y%m%d} PARTITION OF rate_snapshots "
+            f"FOR VALUES FROM ('{day} 00:00:00+00') TO ('{day + timedelta(days=1)} 00:00:00+00')"
+        ))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(sa.text("DROP TABLE rate_snapshots"))
@@ -1,23 +1,45 @@
 from typing import Annotated, List
+from datetime import date, datetime
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Response, WebSocket
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.security import get_current_user
-from app.api.schemas.currency import DefinitelyCurrencyIn, DefinitelyCurrencyOut, CurrencyListOut, AmountExchange, AmountExchangeOut, CurrencyHistory
+from app.core.security import get_current_user, oauth2_scheme
+from app.core.cache import get_cache_stats
+from app.core.responses import RawJSONResponse
+from app.api.schemas.currency import DefinitelyCurrencyIn, DefinitelyCurrencyOut, CurrencyListOut, AmountExchange, AmountExchangeOut, CurrencyHistory, AmountExchangeBatchIn, RateAtOut
+from app.api.schemas.currency import PortfolioValueIn, PortfolioValueOut, HistoryStatsOut
 from app.db.database import get_async_session
 from app.api.schemas.users import UserOut
-from app.services.currency import (definitely_currency, list_currencies, amount_exchange, history_of_user, export_history)
+from app.services.currency import (definitely_currency, list_currencies_body, amount_exchange, amount_exchange_batch,
+                                   history_page, export_history, rate_at, pair_rates, portfolio_value_body,
+                                   history_stats, HISTORY_PAGE_SIZE)
+from app.services.rate_stream import rate_event_stream, websocket_rate_stream
 
 currency_router = APIRouter(prefix="/currency", tags=["currency"], dependencies=[Depends(get_current_user)])
+# WebSocket clients cannot send the Authorization header, the endpoint checks the token itself
+currency_ws_router = APIRouter(prefix="/currency", tags=["currency"])
 
-@currency_router.post('/definitely')
+@currency_router.post('/definitely', response_model_exclude_none=True)
 async def get_definitely_currency(current_currency: DefinitelyCurrencyIn) -> DefinitelyCurrencyOut:
     return await definitely_currency(current_currency)
 
-@currency_router.get('/list')
-async def get_list_currencies(currency_from: str) -> CurrencyListOut:
-    return await list_currencies(currency_from)
+@currency_router.get('/list', response_model=CurrencyListOut, response_class=RawJSONResponse)
+async def get_list_currencies(currency_from: str):
+    return RawJSONResponse(await list_currencies_body(currency_from))
+
+@currency_router.get('/rates', response_model_exclude_none=True)
+async def get_pair_rates(pairs: str) -> List[DefinitelyCurrencyOut]:
+    return await pair_rates(pairs)
+
+@currency_router.get('/rate-at')
+async def get_rate_at(
+    currency_from: Annotated[str, Query(alias="from")],
+    currency_to: Annotated[str, Query(alias="to")],
+    ts: datetime,
+    db: Annotated[AsyncSession, Depends(get_async_session)]
+) -> RateAtOut:
+    return await rate_at(db, currency_from, currency_to, ts)
 
 @currency_router.post('/amount')
 async def get_amount_exchange(
@@ -25,19 +47,69 @@ async def get_amount_exchange(
     current_user: Annotated[UserOut, Depends(get_current_user)],
     db: Annotated[AsyncSession, Depends(get_async_session)]
 ) -> AmountExchangeOut:
-    return await amount_exchange(exchange, current_user, db)
+    return await amount_exchange(exchange, current_user.id, db)
+
+@currency_router.post('/amount/batch')
+async def get_amount_exchange_batch(
+    batch: AmountExchangeBatchIn,
+    current_user: Annotated[UserOut, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_async_session)]
+) -> List[AmountExchangeOut]:
+    return await amount_exchange_batch(batch, current_user.id, db)
+
+@currency_router.get('/stream')
+async def get_rate_stream(
+    token: Annotated[str, Depends(oauth2_scheme)],
+    pairs: str | None = None,
+    bases: str | None = None
+):
+    return rate_event_stream(token, pairs, bases)
+
+@currency_ws_router.websocket('/stream/ws')
+async def rate_stream_ws(websocket: WebSocket, pairs: str | None = None, bases: str | None = None):
+    await websocket_rate_stream(websocket, pairs, bases)
+
+@currency_router.post('/portfolio/value', response_model=PortfolioValueOut, response_class=RawJSONResponse)
+async def get_portfolio_value(portfolio: PortfolioValueIn):
+    return RawJSONResponse(portfolio_value_body(portfolio))
 
 @currency_router.get("/history")
 async def get_history_exchange(
     db: Annotated[AsyncSession, Depends(get_async_session)],
-    current_user: Annotated[UserOut, Depends(get_current_user)]
+    current_user: Annotated[UserOut, Depends(get_current_user)],
+    response: Response,
+    limit: Annotated[int, Query(ge=1, le=500)] = HISTORY_PAGE_SIZE,
+    cursor: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    currency_from: str | None = None,
+    currency_to: str | None = None
 ) -> List[CurrencyHistory]:
-    return await history_of_user(db, current_user)
+    history, next_cursor = await history_page(
+        db, current_user.id, limit, cursor, date_from, date_to, currency_from, currency_to
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return history
+
+@currency_router.get("/history/stats", response_model_exclude_none=True)
+async def get_history_stats(
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    current_user: Annotated[UserOut, Depends(get_current_user)],
+    date_from: date | None = None,
+    date_to: date | None = None,
+    per_day: bool = True
+) -> List[HistoryStatsOut]:
+    return await history_stats(db, current_user.id, date_from, date_to, per_day)
 
 @currency_router.get('/history/export')
 async def get_history_export(
-    db: Annotated[AsyncSession, Depends(get_async_session)],
     current_user: Annotated[UserOut, Depends(get_current_user)],
-    format: str
+    format: str,
+    gzip: bool = False
 ):
-    return await export_history(format, db, current_user)
\ No newline at end of file
+    return await export_history(format, current_user.id, gzip)
+
+@currency_router.get('/cache/stats')
+async def get_currency_cache_stats() -> dict[str, dict[str, int]]:
+    return get_cache_stats()
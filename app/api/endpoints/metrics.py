@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.services.metrics import collect_metrics
+
+metrics_router = APIRouter(tags=["metrics"])
+
+@metrics_router.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(await collect_metrics(), media_type="text/plain; version=0.0.4")
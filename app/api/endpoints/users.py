@@ -23,7 +23,10 @@ async def register_user(user_data: UserIn, db: Annotated[AsyncSession, Depends(g
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
                                  db: Annotated[AsyncSession, Depends(get_async_session)]) -> Token:
     user = await authenticate_user(form_data.username, form_data.password, db)
-    access_token = await create_access_token({"sub": user.username}, expires_time=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    access_token = await create_access_token(
+        {"sub": user.username, "uid": user.id, "email": user.email},
+        expires_time=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
     return Token(access_token=access_token, token_type="bearer")
 
 @users_router.get("/users_me")
@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+from typing import List
+from datetime import date, datetime
+
+from pydantic import BaseModel, Field
 
 class Currency(BaseModel):
     currency_from: str
@@ -9,10 +12,17 @@ class DefinitelyCurrencyIn(Currency):
 
 class DefinitelyCurrencyOut(Currency):
     conversion_rate: float
+    # when the rate was fetched from the provider
+    as_of: datetime | None = None
 
 class CurrencyListOut(BaseModel):
     currency_from: str
     conversion_rates: dict[str, float | str]
+    as_of: datetime | None = None
+
+class RateAtOut(Currency):
+    conversion_rate: float
+    snapshot_time: datetime
 
 class AmountExchange(Currency):
     amount: float
@@ -20,6 +30,24 @@ class AmountExchange(Currency):
 class AmountExchangeOut(Currency):
     converted_amount: float
 
+class AmountExchangeBatchIn(BaseModel):
+    items: List[AmountExchange] = Field(min_length=1, max_length=1000)
+
+class PortfolioPosition(BaseModel):
+    currency: str
+    amount: float
+
+class PortfolioValueIn(BaseModel):
+    currency_to: str
+    positions: List[PortfolioPosition] = Field(min_length=1, max_length=50000)
+
+class PortfolioValueOut(BaseModel):
+    currency_to: str
+    total: float
+    # one value per position, in the order they were sent
+    values: List[float]
+    as_of: datetime | None = None
+
 class CurrencyHistory(BaseModel):
     base_currency: str
     target_currency: str
@@ -28,3 +56,15 @@ class CurrencyHistory(BaseModel):
     converted_amount: float
     exchange_time: str
 
+
+class HistoryStatsOut(BaseModel):
+    base_currency: str
+    target_currency: str
+    # None when the stats cover the whole period
+    day: date | None = None
+    conversions: int
+    amount_total: float
+    converted_total: float
+    avg_rate: float
+    min_rate: float
+    max_rate: float
@@ -6,5 +6,6 @@ class UserIn(BaseModel):
     email: str
 
 class UserOut(BaseModel):
+    id: int
     username: str
     email: str
\ No newline at end of file
@@ -2,7 +2,13 @@ from celery import Celery
 from celery.schedules import crontab
 
 
-celery_app = Celery("currency_app", broker="redis://redis:6379/0", backend="redis://redis:6379/1")
+celery_app = Celery(
+    "currency_app",
+    broker="redis://redis:6379/0",
+    backend="redis://redis:6379/1",
+    # loaded when a worker starts, not whenever app.celery_app is imported
+    include=["app.tasks.currency", "app.tasks.history"]
+)
 
 celery_app.conf.update(
     task_serializer='json',
@@ -14,8 +20,11 @@ celery_app.conf.beat_schedule = {
     "update-every-hour": {
         "task": "update_currency_rates",
         "schedule": crontab(minute=0, hour='*')
+    },
+    "archive-history-daily": {
+        "task": "archive_conversion_history",
+        "schedule": crontab(minute=30, hour=3)
     }
 }
 
-celery_app.conf.timezone = "UTC"
-from app.tasks import currency
\ No newline at end of file
+celery_app.conf.timezone = "UTC"
\ No newline at end of file
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import random
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, NamedTuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+FETCHED_AT_FIELD = "@fetched_at"
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float, timer: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= self._timer():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        self._data[key] = (self._timer() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+local_cache = TTLCache(settings.L1_CACHE_MAXSIZE, settings.L1_CACHE_TTL)
+cache_stats: defaultdict[str, dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0})
+_in_flight: dict[str, asyncio.Task] = {}
+# strong references, so a pending background refresh is not garbage collected
+_revalidations: set[asyncio.Task] = set()
+# keys whose last background refresh failed, they keep serving the stale value until the entry expires
+revalidation_backoff = TTLCache(settings.L1_CACHE_MAXSIZE, settings.UPSTREAM_RESET_SECONDS)
+
+
+def record_lookup(tier: str, hit: bool) -> None:
+    cache_stats[tier]["hits" if hit else "misses"] += 1
+
+
+def get_cache_stats() -> dict[str, dict[str, int]]:
+    return {tier: dict(counters) for tier, counters in cache_stats.items()}
+
+
+def jittered_ttl(ttl: int | None = None) -> int:
+    ttl = settings.CACHE_TTL if ttl is None else ttl
+    return ttl + random.randint(0, int(ttl * settings.CACHE_TTL_JITTER))
+
+
+def max_jittered_ttl(ttl: int | None = None) -> int:
+    ttl = settings.CACHE_TTL if ttl is None else ttl
+    return ttl + int(ttl * settings.CACHE_TTL_JITTER)
+
+
+async def single_flight(key: str, load: Callable[[], Awaitable[Any]]) -> Any:
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(load())
+        _in_flight[key] = task
+
+        def forget(done: asyncio.Task):
+            if _in_flight.get(key) is done:
+                del _in_flight[key]
+
+        task.add_done_callback(forget)
+    # shield: a cancelled caller must not cancel the fetch other callers wait for
+    return await asyncio.shield(task)
+
+
+class Cached(NamedTuple):
+    value: Any
+    # epoch seconds of the upstream fetch, None when the stored value does not say
+    fetched_at: float | None = None
+
+    @property
+    def as_of(self) -> datetime | None:
+        return datetime.fromtimestamp(self.fetched_at, timezone.utc) if self.fetched_at is not None else None
+
+    def is_stale(self) -> bool:
+        return self.fetched_at is not None and time.time() - self.fetched_at > settings.CACHE_SOFT_TTL
+
+
+def encode_rate(rate: float, fetched_at: float | None, expires_at: float | None = None) -> str:
+    value = f"{rate}|{'' if fetched_at is None else fetched_at}"
+    return value if expires_at is None else f"{value}|{expires_at}"
+
+
+def decode_rate(value: str) -> Cached | None:
+    # fields of one hash expire on their own deadlines, a field past it reads as a miss
+    rate, _, value = value.partition("|")
+    fetched_at, _, expires_at = value.partition("|")
+    if expires_at and float(expires_at) <= time.time():
+        return None
+    return Cached(float(rate), float(fetched_at) if fetched_at else None)
+
+
+async def tiered_get_or_load(
+    redis,
+    key: str,
+    read: Callable[[], Awaitable[Cached | None]],
+    write: Callable[[Cached], Awaitable[None]],
+    load: Callable[[], Awaitable[Any]]
+) -> Cached:
+    cached = local_cache.get(key, _MISSING)
+    record_lookup("l1", cached is not _MISSING)
+    if cached is _MISSING:
+        cached = await read()
+        record_lookup("redis", cached is not None)
+        if cached is None:
+            cached = await single_flight(key, lambda: _load_locked(redis, key, read, write, load))
+        local_cache.set(key, cached)
+    if cached.is_stale():
+        # past the soft TTL: answer with the stale value now, refresh it in the background
+        revalidate(redis, key, read, write, load)
+    return cached
+
+
+def revalidate(redis, key, read, write, load) -> None:
+    # while the upstream is failing every stale read would otherwise pay for a lock round trip and a warning
+    if key in _in_flight or revalidation_backoff.get(key) is not None:
+        return
+
+    async def refresh():
+        cached = await _load_locked(redis, key, read, write, load, wait=False)
+        if cached is not None:
+            local_cache.set(key, cached)
+        return cached
+
+    def done(task: asyncio.Task) -> None:
+        _revalidations.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            revalidation_backoff.set(key, True)
+            logger.warning("Background refresh of %s failed, keeping the stale value: %r", key, task.exception())
+
+    task = asyncio.ensure_future(single_flight(key, refresh))
+    _revalidations.add(task)
+    task.add_done_callback(done)
+
+
+async def hash_field_get_or_load(redis, key: str, field: str, load: Callable[[], Awaitable[float]]) -> Cached:
+    async def read():
+        cached = await redis.hget(key, field)
+        return decode_rate(cached) if cached is not None else None
+
+    async def write(cached):
+        pipe = redis.pipeline(transaction=False)
+        pipe.hset(key, field, encode_rate(cached.value, cached.fetched_at, time.time() + jittered_ttl()))
+        # the hash outlives every field deadline, it only goes once no field is written for a full TTL
+        pipe.expire(key, max_jittered_ttl())
+        await pipe.execute()
+
+    return await tiered_get_or_load(redis, f"{key}:{field}", read, write, load)
+
+
+async def hash_get_or_load(redis, key: str, load: Callable[[], Awaitable[dict[str, float]]]) -> Cached:
+    async def read():
+        cached = await redis.hgetall(key)
+        fetched_at = cached.pop(FETCHED_AT_FIELD, None)
+        if not cached:
+            return None
+        return Cached({field: float(value) for field, value in cached.items()}, fetched_at and float(fetched_at))
+
+    async def write(cached):
+        if not cached.value:
+            return
+        pipe = redis.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping={**cached.value, FETCHED_AT_FIELD: cached.fetched_at})
+        pipe.expire(key, jittered_ttl())
+        await pipe.execute()
+
+    return await tiered_get_or_load(redis, key, read, write, load)
+
+
+async def _load_locked(redis, key, read, write, load, wait: bool = True):
+    lock_key = f"lock:{key}"
+    token = uuid.uuid4().hex
+    if not await redis.set(lock_key, token, nx=True, px=settings.CACHE_LOCK_MS):
+        if not wait:
+            return None
+        # another worker is fetching this key, wait for it to fill the cache
+        for _ in range(settings.CACHE_LOCK_MS // 50):
+            await asyncio.sleep(0.05)
+            cached = await read()
+            if cached is not None:
+                return cached
+    try:
+        cached = Cached(await load(), time.time())
+        await write(cached)
+        return cached
+    finally:
+        if await redis.get(lock_key) == token:
+            await redis.delete(lock_key)
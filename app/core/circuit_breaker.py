@@ -0,0 +1,55 @@
+import time
+from typing import Callable
+
+
+class CircuitBreaker:
+    """Closed until `failure_threshold` failures in a row, then open for `reset_timeout` seconds.
+
+    After that one trial call is let through (half-open): success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, timer: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._timer = timer
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self._timer() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def would_allow(self) -> bool:
+        # allow() without claiming the half-open trial, for checks ahead of the actual call
+        state = self.state
+        return state == "closed" or (state == "half-open" and not self._trial_running)
+
+    def release_trial(self) -> None:
+        # the trial call was abandoned (cancelled), the next caller gets to run it
+        self._trial_running = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_running or self.failures >= self.failure_threshold:
+            self.opened_at = self._timer()
+        self._trial_running = False
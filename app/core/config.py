@@ -1,9 +1,13 @@
-from dotenv import find_dotenv
+from pathlib import Path
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+# the project root .env, the same file find_dotenv() located without walking the call stack
+ENV_FILE = Path(__file__).resolve().parents[2] / ".env"
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
-        env_file=find_dotenv()
+        env_file=ENV_FILE
     )
 
     DB_HOST: str
@@ -15,6 +19,41 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str
     REDIS_URL: str
+    RATE_MATRIX_REFRESH_SECONDS: int = 300
+    UPSTREAM_FALLBACK: bool = True
+    CACHE_TTL: int = 3600
+    CACHE_SOFT_TTL: int = 600
+    CACHE_TTL_JITTER: float = 0.1
+    CACHE_LOCK_MS: int = 5000
+    L1_CACHE_MAXSIZE: int = 1024
+    L1_CACHE_TTL: float = 300.0
+    RATES_CACHE_TTL: int = 7200
+    REFRESH_BASE_CURRENCIES: list[str] = ["USD"]
+    LEGACY_RATE_KEYS: bool = True
+    RATES_CHANNEL: str = "currency:rates"
+    PRINCIPAL_CACHE_MAXSIZE: int = 10000
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_CONCURRENCY: int = 4
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_TIMEOUT: float = 10.0
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP2: bool = False
+    UPSTREAM_FAILURE_THRESHOLD: int = 5
+    UPSTREAM_RESET_SECONDS: float = 30.0
+    UPSTREAM_QUOTA_PER_DAY: int = 1000
+    UPSTREAM_QUOTA_BURST: int = 100
+    UPSTREAM_QUOTA_RESERVE: int = 10
+    HISTORY_WRITE_BEHIND: bool = False
+    HISTORY_FLUSH_SIZE: int = 500
+    HISTORY_FLUSH_INTERVAL: float = 1.0
+    HISTORY_BUFFER_MAX: int = 10000
+    HISTORY_CLAIM_IDLE_MS: int = 30000
+    HISTORY_MAX_DELIVERIES: int = 5
+    HISTORY_HOT_MONTHS: int = 12
+    HISTORY_PARTITIONS_AHEAD: int = 2
+    STREAM_KEEPALIVE_SECONDS: float = 15.0
 
     @property
     def ASYNC_DATABASE_URL(self):
@@ -0,0 +1,165 @@
+import time
+from contextlib import contextmanager
+from typing import Iterable
+
+from app.core.cache import cache_stats
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REFRESH_METRICS_KEY = "metrics:rates_refresh"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{format_labels(dict(zip(self.labelnames, key)))} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> (per-bucket counts, sum, count)
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (bucket_counts, total, count) in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': format_value(bound)})} {bucket_count}")
+            lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+def gauge(name: str, documentation: str, samples: Iterable[tuple[dict[str, str], float]]) -> list[str]:
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in samples)
+    return lines
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route.", ("method", "route", "status")
+)
+upstream_request_duration = Histogram(
+    "upstream_request_duration_seconds", "exchangerate-api request latency.", ("endpoint",)
+)
+upstream_errors = Counter("upstream_errors_total", "Failed exchangerate-api requests.", ("endpoint", "reason"))
+
+
+@contextmanager
+def upstream_timer(endpoint: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        # API errors carry the error-type from the response, a small fixed set
+        upstream_errors.inc(endpoint=endpoint, reason=getattr(e, "detail", None) or type(e).__name__)
+        raise
+    finally:
+        upstream_request_duration.observe(time.perf_counter() - started, endpoint=endpoint)
+
+
+def cache_lines() -> list[str]:
+    stats = {tier: dict(counters) for tier, counters in cache_stats.items()}
+    lookups = Counter("cache_lookups_total", "Rate lookups per cache tier.", ("tier", "result"))
+    for tier, counters in stats.items():
+        lookups.inc(counters["hits"], tier=tier, result="hit")
+        lookups.inc(counters["misses"], tier=tier, result="miss")
+    ratios = [
+        ({"tier": tier}, counters["hits"] / (counters["hits"] + counters["misses"]))
+        for tier, counters in stats.items() if counters["hits"] + counters["misses"]
+    ]
+    return lookups.render() + gauge("cache_hit_ratio", "Hits over lookups per cache tier.", ratios)
+
+
+def pool_lines(pool_status: dict[str, int] | None) -> list[str]:
+    if not pool_status:
+        return []
+    return gauge(
+        "db_pool_connections", "Database pool connections by state.",
+        (({"state": state}, value) for state, value in pool_status.items())
+    )
+
+
+def refresh_lines(refresh: dict[str, str]) -> list[str]:
+    finished_at = refresh.pop("finished_at", None)
+    lines = gauge(
+        "rates_refresh_stage_seconds", "Duration of each stage of the last rates refresh.",
+        (({"stage": stage}, float(seconds)) for stage, seconds in refresh.items())
+    )
+    if finished_at is not None:
+        lines += gauge(
+            "rates_refresh_last_success_timestamp_seconds", "When the last rates refresh was persisted.",
+            [({}, float(finished_at))]
+        )
+    return lines
+
+
+def quota_lines(quota: dict | None) -> list[str]:
+    if not quota:
+        return []
+    requests = Counter(
+        "upstream_quota_requests_total", "Upstream calls granted or denied by the shared quota.", ("consumer", "result")
+    )
+    for field, value in quota["usage"].items():
+        consumer, result = field.rsplit(":", 1)
+        requests.inc(value, consumer=consumer, result=result)
+    return requests.render() + gauge(
+        "upstream_quota_tokens", "Upstream calls left in the shared quota bucket.", [({}, float(quota["tokens"]))]
+    )
+
+
+def render_metrics(
+    pool_status: dict[str, int] | None = None,
+    refresh: dict[str, str] | None = None,
+    quota: dict | None = None
+) -> str:
+    lines = []
+    for metric in (http_request_duration, upstream_request_duration, upstream_errors):
+        lines += metric.render()
+    lines += cache_lines()
+    lines += pool_lines(pool_status)
+    lines += refresh_lines(dict(refresh or {}))
+    lines += quota_lines(quota)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,102 @@
+import logging
+import time
+
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+QUOTA_KEY = "quota:exchangerate-api"
+QUOTA_USAGE_KEY = "quota:exchangerate-api:usage"
+
+# KEYS: bucket, usage counters
+# ARGV: now, refill per second, capacity, cost, floor, consumer
+# The floor keeps the last tokens of the bucket for consumers allowed to go lower (the refresh task).
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local floor = tonumber(ARGV[5])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens - cost >= floor then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+redis.call('HINCRBY', KEYS[2], ARGV[6] .. (allowed == 1 and ':granted' or ':denied'), cost)
+return {allowed, tostring(tokens)}
+"""
+
+
+def run_token_bucket(bucket: dict, usage: dict, now, rate, capacity, cost, floor, consumer) -> list:
+    # TOKEN_BUCKET_SCRIPT over plain dicts, the one stand-in for Redis fakes that cannot run Lua
+    tokens = float(capacity)
+    if bucket:
+        tokens = min(float(capacity), float(bucket["tokens"]) + max(0.0, now - float(bucket["ts"])) * rate)
+    allowed = int(tokens - cost >= floor)
+    if allowed:
+        tokens -= cost
+    bucket.update({"tokens": str(tokens), "ts": str(now)})
+    field = f"{consumer}:{'granted' if allowed else 'denied'}"
+    usage[field] = str(int(usage.get(field, 0)) + cost)
+    return [allowed, str(tokens)]
+
+
+class UpstreamQuotaExhausted(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="upstream-quota-exhausted")
+
+
+def refill_rate() -> float:
+    return settings.UPSTREAM_QUOTA_PER_DAY / 86400
+
+
+def refill(tokens: float, ts: float, now: float) -> float:
+    return min(settings.UPSTREAM_QUOTA_BURST, tokens + max(0.0, now - ts) * refill_rate())
+
+
+def bucket_args(cost: int, consumer: str) -> list:
+    # API workers stop at the reserve, the refresh task may spend the bucket down to zero
+    floor = 0 if consumer == "worker" else settings.UPSTREAM_QUOTA_RESERVE
+    return [
+        TOKEN_BUCKET_SCRIPT, 2, QUOTA_KEY, QUOTA_USAGE_KEY,
+        time.time(), refill_rate(), settings.UPSTREAM_QUOTA_BURST, cost, floor, consumer
+    ]
+
+
+async def acquire_upstream_quota(redis, cost: int = 1, consumer: str = "api") -> None:
+    try:
+        allowed, _ = await redis.eval(*bucket_args(cost, consumer))
+    except RedisError:
+        # without Redis there is no shared budget, the circuit breaker still limits the damage
+        logger.warning("Upstream quota unavailable, letting the request through")
+        return
+    if not allowed:
+        raise UpstreamQuotaExhausted()
+
+
+def acquire_upstream_quota_sync(redis, cost: int = 1, consumer: str = "worker") -> None:
+    try:
+        allowed, _ = redis.eval(*bucket_args(cost, consumer))
+    except RedisError:
+        logger.warning("Upstream quota unavailable, letting the request through")
+        return
+    if not allowed:
+        raise UpstreamQuotaExhausted()
+
+
+async def quota_status(redis) -> dict:
+    state = await redis.hgetall(QUOTA_KEY)
+    usage = await redis.hgetall(QUOTA_USAGE_KEY)
+    tokens = settings.UPSTREAM_QUOTA_BURST
+    if state:
+        tokens = refill(float(state["tokens"]), float(state["ts"]), time.time())
+    return {"tokens": tokens, "usage": {field: int(value) for field, value in usage.items()}}
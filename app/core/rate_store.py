@@ -0,0 +1,142 @@
+import json
+import time
+
+from app.core.cache import local_cache, Cached, decode_rate, encode_rate, max_jittered_ttl, FETCHED_AT_FIELD
+from app.core.config import settings
+
+RATES_VERSION_KEY = "rates:version"
+
+
+def rates_key(version, base_currency: str) -> str:
+    return f"rates:v{version}:{base_currency}"
+
+
+def upstream_rates_key(base_currency: str) -> str:
+    return f"rates:upstream:{base_currency}"
+
+
+def upstream_pairs_key(base_currency: str) -> str:
+    return f"rates:upstream:{base_currency}:pairs"
+
+
+def legacy_pair_key(currency_from: str, currency_to: str) -> str:
+    return f"{currency_from}->{currency_to}"
+
+
+def legacy_rates_key(base_currency: str) -> str:
+    return f"{base_currency}->conversion_rates"
+
+
+def cross_rate_tables(usd_rates: dict[str, float]) -> dict[str, dict[str, float]]:
+    return {
+        base: {target: rate / base_rate for target, rate in usd_rates.items()}
+        for base, base_rate in usd_rates.items() if base_rate
+    }
+
+
+def write_rate_tables(redis, usd_rates: dict[str, float], version: int, ttl: int) -> None:
+    tables = cross_rate_tables(usd_rates)
+    pipe = redis.pipeline(transaction=False)
+    for base, row in tables.items():
+        key = rates_key(version, base)
+        pipe.hset(key, mapping=row)
+        pipe.expire(key, ttl)
+    pipe.execute()
+
+    # readers only follow the pointer, so the flip and the cleanup are one MULTI/EXEC
+    previous = redis.get(RATES_VERSION_KEY)
+    pipe = redis.pipeline(transaction=True)
+    pipe.set(RATES_VERSION_KEY, version, ex=ttl)
+    if previous is not None and str(previous) != str(version):
+        pipe.unlink(*(rates_key(previous, base) for base in tables))
+    pipe.execute()
+
+
+async def current_rates_version(redis) -> str | None:
+    version = local_cache.get(RATES_VERSION_KEY)
+    if version is None:
+        version = await redis.get(RATES_VERSION_KEY)
+        if version is not None:
+            # dropped together with the rest of the L1 cache when new rates are published
+            local_cache.set(RATES_VERSION_KEY, version)
+    return version
+
+
+def version_fetched_at(version) -> float:
+    # versions are the refresh time in microseconds
+    return int(version) / 1_000_000
+
+
+async def read_rate(redis, base_currency: str, target_currency: str) -> Cached | None:
+    version = await current_rates_version(redis)
+    if version is None:
+        return None
+    rate = await redis.hget(rates_key(version, base_currency), target_currency)
+    return Cached(float(rate), version_fetched_at(version)) if rate is not None else None
+
+
+async def read_rate_table(redis, base_currency: str) -> Cached | None:
+    version = await current_rates_version(redis)
+    if version is None:
+        return None
+    row = await redis.hgetall(rates_key(version, base_currency))
+    if not row:
+        return None
+    return Cached({target: float(rate) for target, rate in row.items()}, version_fetched_at(version))
+
+
+async def read_rates(redis, pairs: list[tuple[str, str]]) -> dict[tuple[str, str], Cached | None]:
+    version = await current_rates_version(redis)
+    targets: dict[str, list[str]] = {}
+    for currency_from, currency_to in pairs:
+        targets.setdefault(currency_from, []).append(currency_to)
+
+    pipe = redis.pipeline(transaction=False)
+    for base, base_targets in targets.items():
+        if version is not None:
+            pipe.hmget(rates_key(version, base), base_targets)
+        pipe.hmget(upstream_rates_key(base), [*base_targets, FETCHED_AT_FIELD])
+        pipe.hmget(upstream_pairs_key(base), base_targets)
+    replies = iter(await pipe.execute())
+
+    rates = {}
+    for base, base_targets in targets.items():
+        # candidates for one base are ordered by preference, the first hash holding a target wins
+        candidates = []
+        if version is not None:
+            fetched_at = version_fetched_at(version)
+            candidates.append([Cached(float(rate), fetched_at) if rate is not None else None for rate in next(replies)])
+        *table, fetched_at = next(replies)
+        fetched_at = float(fetched_at) if fetched_at is not None else None
+        candidates.append([Cached(float(rate), fetched_at) if rate is not None else None for rate in table])
+        candidates.append([decode_rate(rate) if rate is not None else None for rate in next(replies)])
+        for target, values in zip(base_targets, zip(*candidates)):
+            rates[(base, target)] = next((value for value in values if value is not None), None)
+    return rates
+
+
+def migrate_legacy_rate_keys(redis) -> int:
+    migrated = 0
+    for key in redis.scan_iter(match="*->*", count=1000):
+        if key.startswith("lock:"):
+            continue
+        value = redis.get(key)
+        if value is None:
+            continue
+        ttl = redis.ttl(key)
+        ttl = ttl if ttl > 0 else settings.CACHE_TTL
+        base_currency, target = key.split("->", 1)
+        pipe = redis.pipeline(transaction=True)
+        if target == "conversion_rates":
+            # an upstream table already written in the new layout is newer than the legacy copy
+            rates = json.loads(value)
+            if rates and not redis.exists(upstream_rates_key(base_currency)):
+                pipe.hset(upstream_rates_key(base_currency), mapping=rates)
+                pipe.expire(upstream_rates_key(base_currency), ttl)
+        else:
+            pipe.hsetnx(upstream_pairs_key(base_currency), target, encode_rate(float(value), None, time.time() + ttl))
+            pipe.expire(upstream_pairs_key(base_currency), max(ttl, max_jittered_ttl()))
+        pipe.delete(key)
+        pipe.execute()
+        migrated += 1
+    return migrated
@@ -1,11 +1,26 @@
+import redis
 from redis import asyncio as aioredis
 
 from app.core.config import settings
 
 _redis = None
+_sync_redis = None
 
 async def get_redis():
     global _redis
     if _redis is None:
         _redis = await aioredis.from_url(settings.REDIS_URL, decode_responses=True)
-    return _redis
\ No newline at end of file
+    return _redis
+
+def get_sync_redis():
+    global _sync_redis
+    if _sync_redis is None:
+        _sync_redis = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _sync_redis
+
+
+async def close_redis():
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
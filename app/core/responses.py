@@ -0,0 +1,21 @@
+import json
+from typing import Any
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    # optional, the stdlib encoder produces the same compact JSON, only slower
+    orjson = None
+
+
+def dumps_json(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class RawJSONResponse(Response):
+    # body is already serialized JSON bytes, nothing is validated or encoded again
+    media_type = "application/json"
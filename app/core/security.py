@@ -1,5 +1,8 @@
-from typing import Annotated
+from typing import Annotated, Any, Callable
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime, timezone
+import asyncio
+import time
 
 import jwt
 from jwt.exceptions import InvalidTokenError
@@ -11,6 +14,7 @@ from passlib.context import CryptContext
 
 from app.db.database import get_async_session
 from app.db.models import User
+from app.core.cache import TTLCache
 from app.core.config import settings
 from app.api.schemas.users import UserOut
 
@@ -19,11 +23,27 @@ SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = settings.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto")
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+# bcrypt holds a core for ~250ms per call, keep it off the event loop and cap how many run at once
+password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_CONCURRENCY,
+    thread_name_prefix="password-hash"
+)
+# verified principals by access token, each entry lives until the token's exp
+principal_cache = TTLCache(settings.PRINCIPAL_CACHE_MAXSIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
 
 def get_hashed_password(password: str) -> str:
     return pwd_context.hash(password)
 
+async def run_password_hashing(func: Callable[..., Any], *args) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+
+def password_needs_rehash(hash_password: str) -> bool:
+    try:
+        return pwd_context.needs_update(hash_password)
+    except ValueError:
+        return False
+
 async def get_user_from_db(username: str, db: AsyncSession) ->  User:
     res = await db.execute(select(User).where(User.username == username))
     user = res.scalar_one_or_none()
@@ -39,11 +59,17 @@ def verify_password(user_password: str, hash_password: str) -> bool:
 
 async def authenticate_user(username: str, password: str, db: AsyncSession) -> User:
     user = await get_user_from_db(username, db)
-    if not verify_password(password, user.hash_password):
+    if not await run_password_hashing(verify_password, password, user.hash_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password"
         )
+    if password_needs_rehash(user.hash_password):
+        # BCRYPT_ROUNDS changed since this hash was made
+        user.hash_password = await run_password_hashing(get_hashed_password, password)
+        await db.commit()
+        # the production session expires objects on commit, callers still read the user's fields
+        await db.refresh(user)
     return user
 
 async def create_access_token(data: dict, expires_time: timedelta | None = None) -> str:
@@ -56,7 +82,15 @@ async def create_access_token(data: dict, expires_time: timedelta | None = None)
     jwt_token = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return jwt_token
 
+def token_expires_at(token: str) -> float | None:
+    # for tokens get_current_user has accepted; an exp passed since then ends the caller's stream at once
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
+    return payload.get('exp')
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Annotated[AsyncSession, Depends(get_async_session)]) -> UserOut:
+    current_user = principal_cache.get(token)
+    if current_user is not None:
+        return current_user
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get('sub')
@@ -65,12 +99,18 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: An
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid Token"
             )
-        user = await get_user_from_db(username, db)
+        user_id = payload.get('uid')
+        email = payload.get('email')
+        if user_id is None or email is None:
+            # tokens issued before the uid/email claims were added
+            user = await get_user_from_db(username, db)
+            user_id, email = user.id, user.email
     except InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid Token"
         )
-    return UserOut(username=user.username, email=user.email)
-
-
+    current_user = UserOut(id=user_id, username=username, email=email)
+    if 'exp' in payload:
+        principal_cache.set(token, current_user, ttl=payload['exp'] - time.time())
+    return current_user
@@ -1,15 +1,51 @@
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession, create_async_engine, AsyncEngine
 
 from app.core.config import settings
 
-engine = create_async_engine(settings.ASYNC_DATABASE_URL)
-sync_engine = create_engine(settings.SYNC_DATABASE_URL)
+# built on first use: the API never needs the psycopg2 engine and the worker never needs asyncpg
+_engine: AsyncEngine | None = None
+_sync_engine = None
+_async_session_maker: async_sessionmaker | None = None
+_sync_session_maker: sessionmaker | None = None
 
-async_session_maker = async_sessionmaker(engine, class_=AsyncSession)
-sync_session_maker = sessionmaker(sync_engine)
+def get_engine() -> AsyncEngine:
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(settings.ASYNC_DATABASE_URL)
+    return _engine
+
+def get_sync_engine():
+    global _sync_engine
+    if _sync_engine is None:
+        _sync_engine = create_engine(settings.SYNC_DATABASE_URL)
+    return _sync_engine
+
+def async_session_maker(**kwargs) -> AsyncSession:
+    global _async_session_maker
+    if _async_session_maker is None:
+        _async_session_maker = async_sessionmaker(get_engine(), class_=AsyncSession)
+    return _async_session_maker(**kwargs)
+
+def sync_session_maker(**kwargs) -> Session:
+    global _sync_session_maker
+    if _sync_session_maker is None:
+        _sync_session_maker = sessionmaker(get_sync_engine())
+    return _sync_session_maker(**kwargs)
+
+def pool_status() -> dict[str, int] | None:
+    if _engine is None or not hasattr(_engine.pool, "checkedout"):
+        return None
+    pool = _engine.pool
+    return {"size": pool.size(), "checked_out": pool.checkedout(), "idle": pool.checkedin(), "overflow": pool.overflow()}
+
+async def dispose_engine() -> None:
+    global _engine, _async_session_maker
+    if _engine is not None:
+        await _engine.dispose()
+        _engine, _async_session_maker = None, None
 
 async def get_async_session():
     async with async_session_maker() as session:
-        yield session
\ No newline at end of file
+        yield session
@@ -1,7 +1,7 @@
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 from typing import List
 
-from sqlalchemy import ForeignKey, DateTime
+from sqlalchemy import ForeignKey, DateTime, Index, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -19,7 +19,12 @@ class User(Base):
 
 class ConversionHistory(Base):
     __tablename__ = "conversion_history"
+    __table_args__ = (
+        # a partitioned table only takes unique constraints that include the partition key
+        UniqueConstraint("buffer_id", "exchange_time", name="uq_conversion_history_buffer_id"),
+    )
 
+    # range-partitioned by month on exchange_time in PostgreSQL, where the primary key is (id, exchange_time)
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     base_currency: Mapped[str]
@@ -32,11 +37,43 @@ class ConversionHistory(Base):
         default=lambda: datetime.now(timezone.utc),
         nullable=False
     )
+    # the write-behind buffer's entry id, a replayed flush skips rows it already wrote
+    buffer_id: Mapped[str | None] = mapped_column(default=None)
 
     user: Mapped["User"] = relationship("User", back_populates="history")
 
+Index(
+    "ix_conversion_history_user_time_id",
+    ConversionHistory.user_id,
+    ConversionHistory.exchange_time.desc(),
+    ConversionHistory.id
+)
+
+class ConversionHistoryArchive(Base):
+    __tablename__ = "conversion_history_archive"
+
+    # months moved out of conversion_history by archive_conversion_history, ids are kept
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    user_id: Mapped[int]
+    base_currency: Mapped[str]
+    target_currency: Mapped[str]
+    amount: Mapped[float]
+    converted_amount: Mapped[float]
+    rate: Mapped[float]
+    exchange_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+Index(
+    "ix_conversion_history_archive_user_time",
+    ConversionHistoryArchive.user_id,
+    ConversionHistoryArchive.exchange_time.desc(),
+    ConversionHistoryArchive.id
+)
+
 class CurrencyRate(Base):
     __tablename__ = "currency_rates"
+    __table_args__ = (
+        UniqueConstraint("base_currency", "target_currency", name="uq_currency_rates_base_target"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     base_currency: Mapped[str]
@@ -46,4 +83,28 @@ class CurrencyRate(Base):
         DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc),
         nullable=False
-    )
\ No newline at end of file
+    )
+
+class RateSnapshot(Base):
+    __tablename__ = "rate_snapshots"
+
+    # append-only, range-partitioned by day on taken_at in PostgreSQL
+    base_currency: Mapped[str] = mapped_column(primary_key=True)
+    target_currency: Mapped[str] = mapped_column(primary_key=True)
+    taken_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+    rate: Mapped[float]
+
+class ConversionRollup(Base):
+    __tablename__ = "conversion_rollups"
+
+    # one row per user, pair and UTC day, kept up to date in the transaction that inserts the history
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    base_currency: Mapped[str] = mapped_column(primary_key=True)
+    target_currency: Mapped[str] = mapped_column(primary_key=True)
+    day: Mapped[date] = mapped_column(primary_key=True)
+    conversions: Mapped[int]
+    amount_total: Mapped[float]
+    converted_total: Mapped[float]
+    rate_total: Mapped[float]
+    rate_min: Mapped[float]
+    rate_max: Mapped[float]
@@ -0,0 +1,51 @@
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+def create_daily_partition(session: Session, table: str, day: date) -> None:
+    # partitions only exist in PostgreSQL, other dialects use the plain table
+    if session.get_bind().dialect.name != "postgresql":
+        return
+    session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {table}_p{day:%Y%m%d} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{day} 00:00:00+00') TO ('{day + timedelta(days=1)} 00:00:00+00')"
+    ))
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def monthly_partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def create_monthly_partition(session: Session, table: str, month: date) -> None:
+    if session.get_bind().dialect.name != "postgresql":
+        return
+    session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {monthly_partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month} 00:00:00+00') TO ('{add_months(month, 1)} 00:00:00+00')"
+    ))
+
+
+def monthly_partitions(session: Session, table: str) -> dict[str, date]:
+    rows = session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:table AS regclass)"
+    ), {"table": table})
+    # partitions are named {table}_pYYYYMM, see monthly_partition_name
+    return {
+        name: datetime.strptime(name.rsplit("_p", 1)[1], "%Y%m").date()
+        for name, in rows
+    }
+
+
+def hot_history_start(hot_months: int, now: datetime | None = None) -> datetime:
+    # rows from this instant on are never archived, older ones may be
+    now = now or datetime.now(timezone.utc)
+    month = add_months(date(now.year, now.month, 1), -hot_months)
+    return datetime(month.year, month.month, 1, tzinfo=timezone.utc)
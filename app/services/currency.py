@@ -1,76 +1,263 @@
 from http.client import HTTPException
-from typing import List
+from typing import List, AsyncIterator
 from io import StringIO
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import date, datetime, timezone
+import binascii
+import zlib
+import asyncio
 import csv
 import json
 
 from fastapi import status, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, or_, and_, union_all, column, null
 from fastapi.responses import StreamingResponse
 
 from app.core.redis import get_redis
-from app.db.models import ConversionHistory
-from app.api.schemas.currency import DefinitelyCurrencyIn, DefinitelyCurrencyOut, CurrencyListOut, AmountExchange, AmountExchangeOut
-from app.core.security import get_user_from_db
-from app.api.schemas.users import UserOut
+from app.core.cache import hash_field_get_or_load, hash_get_or_load, record_lookup, Cached, FETCHED_AT_FIELD
+from app.core.quota import acquire_upstream_quota, UpstreamQuotaExhausted
+from app.core.rate_store import (read_rate, read_rate_table, read_rates, upstream_rates_key, upstream_pairs_key,
+                                 legacy_pair_key, legacy_rates_key)
+from app.db.database import async_session_maker
+from app.db.models import ConversionHistory, ConversionHistoryArchive, RateSnapshot
+from app.db.partitions import hot_history_start
+from app.api.schemas.currency import DefinitelyCurrencyIn, DefinitelyCurrencyOut, CurrencyListOut, AmountExchange, AmountExchangeOut, AmountExchangeBatchIn, RateAtOut
+from app.api.schemas.currency import PortfolioValueIn, HistoryStatsOut
 from app.api.schemas.currency import CurrencyHistory
-from app.utils.external_api import get_exchange_rate, get_supported_currencies
+from app.utils.external_api import get_exchange_rate, get_supported_currencies, check_upstream_breaker
+from app.core.config import settings
+from app.services.history_writer import save_history, pending_history
+from app.services.rollups import history_stats_query
+from app.services.rates import (matrix_rate, conversion_rates, conversion_rates_body, list_body,
+                                rate_matrix_fetched_at, rate_vector, convert_amounts, BASE_CURRENCY)
+from app.core.responses import dumps_json
 
+MAX_RATE_PAIRS = 100
+
+
+def check_upstream_fallback():
+    if not settings.UPSTREAM_FALLBACK:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="unsupported-code"
+        )
 
 async def definitely_currency(current_currency: DefinitelyCurrencyIn) -> DefinitelyCurrencyOut:
     curr_from = current_currency.currency_from.upper()
     curr_to = current_currency.currency_to.upper()
-    redis = await get_redis()
-    key = f"{curr_from}->{curr_to}"
-    cached = await redis.get(key)
-    if cached:
-        con_rate = float(cached)
-    else:
-        response = await get_exchange_rate(currency_from=curr_from, currency_to=curr_to)
-        con_rate = float(response['conversion_rate'])
-        await redis.set(key, con_rate, ex=3600)
+    cached = matrix_rate(curr_from, curr_to)
+    record_lookup("matrix", cached is not None)
+    if cached is None:
+        cached = await read_rate(await get_redis(), curr_from, curr_to)
+        record_lookup("warm", cached is not None)
+    if cached is None:
+        check_upstream_fallback()
+        cached = await upstream_rate_or_cross(curr_from, curr_to)
     return DefinitelyCurrencyOut(
         currency_from=curr_from,
         currency_to=curr_to,
-        conversion_rate=con_rate
+        conversion_rate=cached.value,
+        as_of=cached.as_of
     )
 
+async def upstream_exchange_rate(curr_from: str, curr_to: str) -> Cached:
+    redis = await get_redis()
+
+    async def fetch_rate() -> float:
+        if settings.LEGACY_RATE_KEYS:
+            legacy = await redis.get(legacy_pair_key(curr_from, curr_to))
+            if legacy:
+                return float(legacy)
+        check_upstream_breaker("pair")
+        await acquire_upstream_quota(redis)
+        response = await get_exchange_rate(currency_from=curr_from, currency_to=curr_to)
+        return float(response['conversion_rate'])
+
+    return await hash_field_get_or_load(redis, upstream_pairs_key(curr_from), curr_to, fetch_rate)
+
+async def upstream_rate_or_cross(curr_from: str, curr_to: str) -> Cached:
+    try:
+        return await upstream_exchange_rate(curr_from, curr_to)
+    except UpstreamQuotaExhausted:
+        cached = await cached_cross_rate(curr_from, curr_to)
+        record_lookup("cross", cached is not None)
+        if cached is None:
+            raise
+        return cached
+
+async def cached_cross_rate(curr_from: str, curr_to: str) -> Cached | None:
+    # both legs against the base currency, from whatever other requests left in Redis
+    legs = await read_rates(await get_redis(), [
+        (BASE_CURRENCY, currency) for currency in (curr_from, curr_to) if currency != BASE_CURRENCY
+    ])
+    if not legs or None in legs.values():
+        return None
+    rate_from = legs[(BASE_CURRENCY, curr_from)].value if curr_from != BASE_CURRENCY else 1.0
+    rate_to = legs[(BASE_CURRENCY, curr_to)].value if curr_to != BASE_CURRENCY else 1.0
+    fetched_at = [leg.fetched_at for leg in legs.values()]
+    return Cached(rate_to / rate_from, None if None in fetched_at else min(fetched_at))
+
+def parse_pairs(pairs: str) -> list[tuple[str, str]]:
+    parsed = []
+    for pair in pairs.split(","):
+        pair = pair.strip().upper()
+        if len(pair) != 6 or not pair.isalpha():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid currency pair: {pair}"
+            )
+        parsed.append((pair[:3], pair[3:]))
+    if len(parsed) > MAX_RATE_PAIRS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_RATE_PAIRS} pairs per request"
+        )
+    return parsed
+
+async def pair_rates(pairs: str) -> List[DefinitelyCurrencyOut]:
+    parsed = parse_pairs(pairs)
+    rates = {pair: matrix_rate(*pair) for pair in parsed}
+    missing = [pair for pair, cached in rates.items() if cached is None]
+    record_lookup("matrix", not missing)
+    if missing:
+        # every pair the matrix lacks is looked up in a single pipelined round trip
+        rates.update(await read_rates(await get_redis(), missing))
+        missing = [pair for pair in missing if rates[pair] is None]
+        record_lookup("warm", not missing)
+    if missing:
+        check_upstream_fallback()
+        fetched = await asyncio.gather(*(upstream_rate_or_cross(*pair) for pair in missing))
+        rates.update(zip(missing, fetched))
+    return [
+        DefinitelyCurrencyOut(
+            currency_from=curr_from,
+            currency_to=curr_to,
+            conversion_rate=rates[(curr_from, curr_to)].value,
+            as_of=rates[(curr_from, curr_to)].as_of
+        )
+        for curr_from, curr_to in parsed
+    ]
+
 async def list_currencies(currency_from: str) -> CurrencyListOut:
     curr_from = currency_from.upper()
+    cached = await resolve_conversion_rates(curr_from)
+    return CurrencyListOut(
+        currency_from=curr_from,
+        conversion_rates=cached.value,
+        as_of=cached.as_of
+    )
+
+async def list_currencies_body(currency_from: str) -> bytes:
+    curr_from = currency_from.upper()
+    body = conversion_rates_body(curr_from)
+    if body is not None:
+        record_lookup("matrix", True)
+        return body
+    return list_body(curr_from, await resolve_conversion_rates(curr_from))
+
+async def resolve_conversion_rates(curr_from: str) -> Cached:
+    conv_rates = conversion_rates(curr_from)
+    record_lookup("matrix", conv_rates is not None)
+    if conv_rates is not None:
+        return Cached(conv_rates, rate_matrix_fetched_at())
+    cached = await read_rate_table(await get_redis(), curr_from)
+    record_lookup("warm", cached is not None)
+    if cached is None:
+        check_upstream_fallback()
+        try:
+            cached = await upstream_conversion_rates(curr_from)
+        except UpstreamQuotaExhausted:
+            cached = await cached_cross_table(curr_from)
+            record_lookup("cross", cached is not None)
+            if cached is None:
+                raise
+    return cached
+
+async def cached_cross_table(curr_from: str) -> Cached | None:
+    redis = await get_redis()
+    cached = await read_rate_table(redis, BASE_CURRENCY)
+    if cached is None:
+        # the table an earlier /list request fetched from the upstream
+        row = await redis.hgetall(upstream_rates_key(BASE_CURRENCY))
+        fetched_at = row.pop(FETCHED_AT_FIELD, None)
+        if not row:
+            return None
+        cached = Cached({target: float(rate) for target, rate in row.items()}, fetched_at and float(fetched_at))
+    base_rate = 1.0 if curr_from == BASE_CURRENCY else cached.value.get(curr_from)
+    if not base_rate:
+        return None
+    return Cached({target: rate / base_rate for target, rate in cached.value.items()}, cached.fetched_at)
+
+async def upstream_conversion_rates(curr_from: str) -> Cached:
     redis = await get_redis()
-    key = f"{curr_from}->conversion_rates"
-    cached = await redis.get(key)
-    if cached:
-        conv_rates = json.loads(cached)
-    else:
+
+    async def fetch_rates() -> dict:
+        if settings.LEGACY_RATE_KEYS:
+            legacy = await redis.get(legacy_rates_key(curr_from))
+            if legacy:
+                return json.loads(legacy)
+        check_upstream_breaker("latest")
+        await acquire_upstream_quota(redis)
         rates = await get_supported_currencies(curr_from)
-        conv_rates = rates["conversion_rates"]
-        await redis.set(key, json.dumps(conv_rates), ex=3600)
-    return CurrencyListOut(
+        return rates["conversion_rates"]
+
+    return await hash_get_or_load(redis, upstream_rates_key(curr_from), fetch_rates)
+
+async def snapshot_rate(db: AsyncSession, currency: str, ts: datetime) -> tuple[float, datetime] | None:
+    # nearest snapshot at or before ts: a backward seek on the (base, target, taken_at) primary key
+    res = await db.execute(
+        select(RateSnapshot.rate, RateSnapshot.taken_at)
+        .where(
+            RateSnapshot.base_currency == BASE_CURRENCY,
+            RateSnapshot.target_currency == currency,
+            RateSnapshot.taken_at <= ts
+        )
+        .order_by(RateSnapshot.taken_at.desc())
+        .limit(1)
+    )
+    return res.one_or_none()
+
+async def rate_at(db: AsyncSession, currency_from: str, currency_to: str, ts: datetime) -> RateAtOut:
+    curr_from = currency_from.upper()
+    curr_to = currency_to.upper()
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    legs = [
+        await snapshot_rate(db, currency, ts)
+        for currency in (curr_from, curr_to) if currency != BASE_CURRENCY
+    ]
+    if not legs or None in legs:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No rate snapshot at or before this time"
+        )
+    rate_from = legs[0].rate if curr_from != BASE_CURRENCY else 1.0
+    rate_to = legs[-1].rate if curr_to != BASE_CURRENCY else 1.0
+    return RateAtOut(
         currency_from=curr_from,
-        conversion_rates=conv_rates
+        currency_to=curr_to,
+        conversion_rate=rate_to / rate_from,
+        snapshot_time=min(leg.taken_at for leg in legs)
     )
 
 async def amount_exchange(
     exchange: AmountExchange,
-    current_user: UserOut,
+    user_id: int,
     db: AsyncSession
 ) -> AmountExchangeOut:
     defi_curr = DefinitelyCurrencyIn(currency_from=exchange.currency_from, currency_to=exchange.currency_to)
     data = await definitely_currency(defi_curr)
-    user =  await get_user_from_db(current_user.username, db)
     conv_amount = float(data.conversion_rate) * int(exchange.amount)
-    history = ConversionHistory(
-        base_currency=data.currency_from,
-        target_currency=data.currency_to,
-        amount=exchange.amount,
-        converted_amount=conv_amount,
-        rate=data.conversion_rate,
-        user=user
-    )
-    db.add(history)
-    await db.commit()
+    await save_history(db, [{
+        "user_id": user_id,
+        "base_currency": data.currency_from,
+        "target_currency": data.currency_to,
+        "amount": exchange.amount,
+        "converted_amount": conv_amount,
+        "rate": data.conversion_rate,
+        "exchange_time": datetime.now(timezone.utc)
+    }])
     response_data = AmountExchangeOut(
         currency_from=data.currency_from,
         currency_to=data.currency_to,
@@ -78,49 +265,286 @@ async def amount_exchange(
     )
     return response_data
 
-async def history_of_user(db: AsyncSession, curr_user: UserOut) -> List[CurrencyHistory]:
-    user = await get_user_from_db(curr_user.username, db)
-    res = await db.execute(
-        select(ConversionHistory).where(ConversionHistory.user_id == user.id).order_by(
-        ConversionHistory.exchange_time.desc())
-    )
-    list_of_history = []
-    for x in res.scalars().all():
-        ex_time = x.exchange_time.strftime("%d.%m.%Y %H:%M")
-        curr_history = CurrencyHistory(
-            base_currency=x.base_currency,
-            target_currency=x.target_currency,
-            rate=x.rate,
-            amount=x.amount,
-            converted_amount=x.converted_amount,
-            exchange_time=ex_time
+async def amount_exchange_batch(
+    batch: AmountExchangeBatchIn,
+    user_id: int,
+    db: AsyncSession
+) -> List[AmountExchangeOut]:
+    pairs = {(x.currency_from.upper(), x.currency_to.upper()) for x in batch.items}
+    rates = await asyncio.gather(*(
+        definitely_currency(DefinitelyCurrencyIn(currency_from=curr_from, currency_to=curr_to))
+        for curr_from, curr_to in pairs
+    ))
+    rate_by_pair = {(r.currency_from, r.currency_to): r.conversion_rate for r in rates}
+    exchange_time = datetime.now(timezone.utc)
+    history_rows = []
+    response_data = []
+    for x in batch.items:
+        curr_from, curr_to = x.currency_from.upper(), x.currency_to.upper()
+        con_rate = rate_by_pair[(curr_from, curr_to)]
+        conv_amount = float(con_rate) * int(x.amount)
+        history_rows.append({
+            "user_id": user_id,
+            "base_currency": curr_from,
+            "target_currency": curr_to,
+            "amount": x.amount,
+            "converted_amount": conv_amount,
+            "rate": con_rate,
+            "exchange_time": exchange_time
+        })
+        response_data.append(AmountExchangeOut(
+            currency_from=curr_from,
+            currency_to=curr_to,
+            converted_amount=conv_amount
+        ))
+    await save_history(db, history_rows)
+    return response_data
+
+def portfolio_value_body(portfolio: PortfolioValueIn) -> bytes:
+    index, _ = rate_vector()
+    if not index:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Rates are not loaded yet"
+        )
+    curr_to = portfolio.currency_to.upper()
+    try:
+        values, total = convert_amounts(
+            [position.currency.upper() for position in portfolio.positions],
+            [position.amount for position in portfolio.positions],
+            curr_to
         )
-        list_of_history.append(curr_history)
-    return list_of_history
-
-async def export_history(format: str, db: AsyncSession, curr_user: UserOut):
-    if format == "csv":
-        history = await history_of_user(db, curr_user)
-        file = StringIO()
-        writer = csv.writer(file)
-
-        writer.writerow(["Currency From", "Currency To", "Rate", "Amount", "Converted amount", "Exchange Time"])
-
-        for r in history:
-            writer.writerow([
-                r.base_currency,
-                r.target_currency,
-                r.rate,
-                r.amount,
-                r.converted_amount,
-                r.exchange_time
-            ])
-
-        file.seek(0)
-        return StreamingResponse(file, media_type="text/csv", headers={"Content-Disposition": "attachment; filename=conversion_history.csv"})
-    else:
+    except KeyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"unsupported-code: {e.args[0]}"
+        )
+    body = {"currency_to": curr_to, "total": total, "values": values}
+    as_of = Cached(total, rate_matrix_fetched_at()).as_of
+    if as_of is not None:
+        body["as_of"] = as_of.isoformat()
+    # thousands of floats, serialized once without a second pass through the response model
+    return dumps_json(body)
+
+HISTORY_PAGE_SIZE = 50
+
+def encode_history_cursor(exchange_time: datetime, history_id: int | None, buffer_id: str | None) -> str:
+    return urlsafe_b64encode(f"{exchange_time.isoformat()}|{history_id or 0}|{buffer_id or ''}".encode()).decode()
+
+def decode_history_cursor(cursor: str) -> tuple[datetime, int, str | None]:
+    try:
+        # cursors issued before buffer_id was added have two parts
+        exchange_time, history_id, *buffer_id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if len(buffer_id) > 1:
+            raise ValueError(cursor)
+        return datetime.fromisoformat(exchange_time), int(history_id), buffer_id[0] if buffer_id else None
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+def history_tables(date_from: datetime | None = None) -> list:
+    tables = [ConversionHistory.__table__]
+    # archived months all end before the hot window, a period inside it never touches the archive
+    hot_start = hot_history_start(settings.HISTORY_HOT_MONTHS)
+    if date_from is None or utc_naive(date_from) < utc_naive(hot_start):
+        tables.append(ConversionHistoryArchive.__table__)
+    return tables
+
+def history_query(
+    user_id: int,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    currency_from: str | None = None,
+    currency_to: str | None = None,
+    after: tuple[datetime, int, str | None] | None = None
+):
+    selects = []
+    for table in history_tables(date_from):
+        c = table.c
+        # archived rows no longer need their buffer id, they sort like rows written directly
+        buffer_id = c.buffer_id if "buffer_id" in c else null()
+        stmt = select(
+            c.id, c.base_currency, c.target_currency, c.rate, c.amount, c.converted_amount, c.exchange_time,
+            buffer_id.label("buffer_id")
+        ).where(c.user_id == user_id)
+        # bounds on exchange_time let PostgreSQL skip the monthly partitions outside the period
+        if date_from is not None:
+            stmt = stmt.where(c.exchange_time >= date_from)
+        if date_to is not None:
+            stmt = stmt.where(c.exchange_time <= date_to)
+        if currency_from:
+            stmt = stmt.where(c.base_currency == currency_from.upper())
+        if currency_to:
+            stmt = stmt.where(c.target_currency == currency_to.upper())
+        if after is not None:
+            after_time, after_id, after_buffer_id = after
+            # ties on exchange_time: buffered rows by buffer_id, then rows written directly by id
+            if after_buffer_id is not None:
+                same_time = or_(buffer_id.is_(None), buffer_id > after_buffer_id)
+            else:
+                same_time = and_(buffer_id.is_(None), c.id > after_id)
+            # the plain upper bound is what partition pruning recognises
+            stmt = stmt.where(c.exchange_time <= after_time, or_(
+                c.exchange_time < after_time,
+                and_(c.exchange_time == after_time, same_time)
+            ))
+        selects.append(stmt)
+    stmt = selects[0] if len(selects) == 1 else union_all(*selects)
+    # ix_conversion_history_user_time_id (user_id, exchange_time DESC, id) serves the range and the time
+    # order; the buffer_id tiebreak only sorts rows of one timestamp, usually a single batch
+    return stmt.order_by(column("exchange_time").desc(), column("buffer_id").asc().nulls_last(), column("id"))
+
+def history_row(row) -> CurrencyHistory:
+    return CurrencyHistory.model_construct(
+        base_currency=row.base_currency,
+        target_currency=row.target_currency,
+        rate=row.rate,
+        amount=row.amount,
+        converted_amount=row.converted_amount,
+        exchange_time=row.exchange_time.strftime("%d.%m.%Y %H:%M")
+    )
+
+async def history_page(
+    db: AsyncSession,
+    user_id: int,
+    limit: int = HISTORY_PAGE_SIZE,
+    cursor: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    currency_from: str | None = None,
+    currency_to: str | None = None
+) -> tuple[List[CurrencyHistory], str | None]:
+    after = decode_history_cursor(cursor) if cursor else None
+    stmt = history_query(user_id, date_from, date_to, currency_from, currency_to, after)
+    # read before the database, so a row flushed in between shows up twice rather than not at all
+    pending = await pending_history(user_id)
+    res = await db.execute(stmt.limit(limit + 1))
+    rows = res.all()
+    pending = filter_pending_history(pending, rows, date_from, date_to, currency_from, currency_to, after)
+    # the same order as history_query, so a row keeps its place on the pages when the flusher writes it
+    rows = sorted([*pending, *rows], key=history_tiebreak)
+    rows = sorted(rows, key=lambda row: utc_naive(row.exchange_time), reverse=True)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_history_cursor(rows[-1].exchange_time, rows[-1].id, rows[-1].buffer_id)
+    return [history_row(row) for row in rows], next_cursor
+
+def utc_naive(value: datetime) -> datetime:
+    # SQLite hands the timestamps back naive, they are stored in UTC
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+def history_tiebreak(row) -> tuple:
+    return (0, row.buffer_id, 0) if row.buffer_id is not None else (1, "", row.id)
+
+def after_history_cursor(row, after: tuple[datetime, int, str | None]) -> bool:
+    after_time, after_id, after_buffer_id = after
+    exchange_time = utc_naive(row.exchange_time)
+    if exchange_time != utc_naive(after_time):
+        return exchange_time < utc_naive(after_time)
+    return history_tiebreak(row) > ((0, after_buffer_id, 0) if after_buffer_id is not None else (1, "", after_id))
+
+def filter_pending_history(
+    pending: list,
+    rows: list,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    currency_from: str | None = None,
+    currency_to: str | None = None,
+    after: tuple[datetime, int, str | None] | None = None
+) -> list:
+    flushed = {row.buffer_id for row in rows if row.buffer_id is not None}
+    return [
+        row for row in pending
+        if row.buffer_id not in flushed
+        and (after is None or after_history_cursor(row, after))
+        and (date_from is None or utc_naive(row.exchange_time) >= utc_naive(date_from))
+        and (date_to is None or utc_naive(row.exchange_time) <= utc_naive(date_to))
+        and (not currency_from or row.base_currency == currency_from.upper())
+        and (not currency_to or row.target_currency == currency_to.upper())
+    ]
+
+async def history_of_user(db: AsyncSession, user_id: int) -> List[CurrencyHistory]:
+    pending = await pending_history(user_id)
+    rows = (await db.execute(history_query(user_id))).all()
+    return [history_row(row) for row in [*filter_pending_history(pending, rows), *rows]]
+
+async def history_stats(
+    db: AsyncSession,
+    user_id: int,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    per_day: bool = True
+) -> List[HistoryStatsOut]:
+    # reads only the rollups, whose size depends on pairs and days, not on the number of conversions
+    res = await db.execute(history_stats_query(user_id, date_from, date_to, per_day))
+    return [HistoryStatsOut.model_validate(row, from_attributes=True) for row in res.all()]
+
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+CSV_HEADER = ["Currency From", "Currency To", "Rate", "Amount", "Converted amount", "Exchange Time"]
+
+def csv_chunk(rows, header: bool = False) -> str:
+    file = StringIO()
+    writer = csv.writer(file)
+    if header:
+        writer.writerow(CSV_HEADER)
+    writer.writerows(
+        (r.base_currency, r.target_currency, r.rate, r.amount, r.converted_amount,
+         r.exchange_time.strftime("%d.%m.%Y %H:%M"))
+        for r in rows
+    )
+    return file.getvalue()
+
+def ndjson_chunk(rows, header: bool = False) -> str:
+    return "".join(
+        json.dumps({
+            "base_currency": r.base_currency,
+            "target_currency": r.target_currency,
+            "rate": r.rate,
+            "amount": r.amount,
+            "converted_amount": r.converted_amount,
+            "exchange_time": r.exchange_time.strftime("%d.%m.%Y %H:%M")
+        }) + "\n"
+        for r in rows
+    )
+
+async def stream_history(user_id: int, format: str) -> AsyncIterator[str]:
+    write_chunk = csv_chunk if format == "csv" else ndjson_chunk
+    # the request session is closed once the endpoint returns, so the stream needs its own
+    async with async_session_maker() as session:
+        result = await session.stream(history_query(user_id).execution_options(yield_per=EXPORT_CHUNK_ROWS))
+        header = True
+        async for rows in result.partitions():
+            yield write_chunk(rows, header)
+            header = False
+        if header:
+            yield write_chunk([], header)
+
+async def gzip_stream(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+async def export_history(format: str, user_id: int, compress: bool = False):
+    if format not in EXPORT_FORMATS:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid format for download"
         )
-
+    media_type, extension = EXPORT_FORMATS[format]
+    content = stream_history(user_id, format)
+    filename = f"conversion_history.{extension}"
+    if compress:
+        content = gzip_stream(content)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(content, media_type=media_type, headers={"Content-Disposition": f"attachment; filename={filename}"})
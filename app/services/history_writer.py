@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime
+
+from redis.exceptions import RedisError, ResponseError
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.db.database import async_session_maker
+from app.db.models import ConversionHistory
+from app.services.rollups import add_to_rollups
+
+logger = logging.getLogger(__name__)
+
+HISTORY_STREAM_KEY = "history:stream"
+HISTORY_GROUP = "history-writers"
+HISTORY_DEAD_LETTER_KEY = "history:dead"
+
+
+def pending_history_key(user_id: int) -> str:
+    return f"history:pending:{user_id}"
+
+
+def consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def dump_history_row(row: dict) -> str:
+    return json.dumps({**row, "exchange_time": row["exchange_time"].isoformat()})
+
+
+def load_history_row(data: str) -> dict:
+    row = json.loads(data)
+    row["exchange_time"] = datetime.fromisoformat(row["exchange_time"])
+    return row
+
+
+async def save_history(db: AsyncSession, rows: list[dict]) -> None:
+    if settings.HISTORY_WRITE_BEHIND and await enqueue_history(rows):
+        return
+    await db.execute(insert(ConversionHistory), rows)
+    await add_to_rollups(db, rows)
+    await db.commit()
+
+
+async def enqueue_history(rows: list[dict]) -> bool:
+    try:
+        redis = await get_redis()
+        # back-pressure: once the flusher falls behind, requests pay for their own commit again
+        if await redis.xlen(HISTORY_STREAM_KEY) + len(rows) > settings.HISTORY_BUFFER_MAX:
+            logger.warning("History buffer is full, writing to the database directly")
+            return False
+        pipe = redis.pipeline(transaction=True)
+        # the index keeps the rows of one batch, which share an exchange_time, in order on /history
+        batch_id = uuid.uuid4().hex
+        for index, row in enumerate(rows):
+            row_id = f"{batch_id}-{index:05d}"
+            data = dump_history_row(row)
+            pipe.xadd(HISTORY_STREAM_KEY, {"id": row_id, "user_id": row["user_id"], "row": data})
+            # a per-user copy, so /history can show rows the flusher has not written yet
+            pipe.hset(pending_history_key(row["user_id"]), row_id, data)
+        await pipe.execute()
+    except RedisError:
+        logger.exception("Failed to buffer history rows, writing to the database directly")
+        return False
+    return True
+
+
+async def pending_history(user_id: int) -> list[ConversionHistory]:
+    if not settings.HISTORY_WRITE_BEHIND:
+        return []
+    try:
+        pending = await (await get_redis()).hgetall(pending_history_key(user_id))
+    except RedisError:
+        logger.warning("Unflushed history is unavailable, Redis did not answer")
+        return []
+    return [ConversionHistory(**load_history_row(data), buffer_id=row_id) for row_id, data in pending.items()]
+
+
+async def insert_buffered_history(session: AsyncSession, rows: list[dict]) -> list[dict]:
+    dialect_insert = postgresql_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    stmt = dialect_insert(ConversionHistory).values(rows)
+    # a replayed batch finds its rows already written and leaves them, and their rollups, alone
+    stmt = stmt.on_conflict_do_nothing(
+        index_elements=[ConversionHistory.buffer_id, ConversionHistory.exchange_time]
+    ).returning(
+        ConversionHistory.user_id, ConversionHistory.base_currency, ConversionHistory.target_currency,
+        ConversionHistory.amount, ConversionHistory.converted_amount, ConversionHistory.rate,
+        ConversionHistory.exchange_time
+    )
+    return [dict(row._mapping) for row in await session.execute(stmt)]
+
+
+async def flush_history(redis, entries: list[tuple[str, dict]]) -> int:
+    if not entries:
+        return 0
+    rows = [{**load_history_row(fields["row"]), "buffer_id": fields["id"]} for _, fields in entries]
+    async with async_session_maker() as session:
+        inserted = await insert_buffered_history(session, rows)
+        await add_to_rollups(session, inserted)
+        await session.commit()
+    await remove_history_entries(redis, entries)
+    return len(entries)
+
+
+async def remove_history_entries(redis, entries: list[tuple[str, dict]], dead_letter: bool = False) -> None:
+    pipe = redis.pipeline(transaction=True)
+    entry_ids = [entry_id for entry_id, _ in entries]
+    for _, fields in entries:
+        if dead_letter:
+            pipe.xadd(HISTORY_DEAD_LETTER_KEY, fields)
+        pipe.hdel(pending_history_key(fields["user_id"]), fields["id"])
+    pipe.xack(HISTORY_STREAM_KEY, HISTORY_GROUP, *entry_ids)
+    pipe.xdel(HISTORY_STREAM_KEY, *entry_ids)
+    await pipe.execute()
+
+
+async def dead_letter_history(redis, entries: list[tuple[str, dict]]) -> list[tuple[str, dict]]:
+    # a batch that fails on every replay is set aside, so it stops holding up the stream and /history
+    pending = await redis.xpending_range(
+        HISTORY_STREAM_KEY, HISTORY_GROUP, min=entries[0][0], max=entries[-1][0], count=len(entries)
+    )
+    deliveries = {entry["message_id"]: entry["times_delivered"] for entry in pending}
+    dead = [entry for entry in entries if deliveries.get(entry[0], 0) > settings.HISTORY_MAX_DELIVERIES]
+    if not dead:
+        return entries
+    await remove_history_entries(redis, dead, dead_letter=True)
+    logger.error("Moved %d history rows to %s after %d failed flushes",
+                 len(dead), HISTORY_DEAD_LETTER_KEY, settings.HISTORY_MAX_DELIVERIES)
+    return [entry for entry in entries if entry not in dead]
+
+
+async def read_history_batch(redis, consumer: str) -> list[tuple[str, dict]]:
+    # entries left unacknowledged by a worker that died, or by a failed flush, come first
+    _, entries, *_ = await redis.xautoclaim(
+        HISTORY_STREAM_KEY, HISTORY_GROUP, consumer,
+        min_idle_time=settings.HISTORY_CLAIM_IDLE_MS, count=settings.HISTORY_FLUSH_SIZE
+    )
+    if entries:
+        entries = await dead_letter_history(redis, entries)
+    if entries:
+        return entries
+    streams = await redis.xreadgroup(
+        HISTORY_GROUP, consumer, {HISTORY_STREAM_KEY: ">"}, count=settings.HISTORY_FLUSH_SIZE
+    )
+    return streams[0][1] if streams else []
+
+
+async def create_history_group(redis) -> None:
+    try:
+        await redis.xgroup_create(HISTORY_STREAM_KEY, HISTORY_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def flush_history_periodically() -> None:
+    consumer = consumer_name()
+    group_ready = False
+    while True:
+        flushed = 0
+        try:
+            redis = await get_redis()
+            if not group_ready:
+                await create_history_group(redis)
+                group_ready = True
+            flushed = await flush_history(redis, await read_history_batch(redis, consumer))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Failed to flush buffered history")
+        # a full batch means there is a backlog, keep draining without waiting
+        if flushed < settings.HISTORY_FLUSH_SIZE:
+            await asyncio.sleep(settings.HISTORY_FLUSH_INTERVAL)
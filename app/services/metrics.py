@@ -0,0 +1,22 @@
+import logging
+
+from redis.exceptions import RedisError
+
+from app.core.metrics import render_metrics, REFRESH_METRICS_KEY
+from app.core.quota import quota_status
+from app.core.redis import get_redis
+from app.db.database import pool_status
+
+logger = logging.getLogger(__name__)
+
+
+async def collect_metrics() -> str:
+    # refresh timings come from the Celery worker, a separate process, so they travel through Redis
+    try:
+        redis = await get_redis()
+        refresh = await redis.hgetall(REFRESH_METRICS_KEY)
+        quota = await quota_status(redis)
+    except RedisError:
+        logger.warning("Rates refresh and quota metrics are unavailable, Redis did not answer")
+        refresh, quota = {}, None
+    return render_metrics(pool_status(), refresh, quota)
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from typing import AsyncIterator
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+
+from app.core.cache import Cached
+from app.core.config import settings
+from app.core.responses import dumps_json
+from app.core.security import get_current_user, token_expires_at
+from app.db.database import async_session_maker
+from app.services.currency import parse_pairs
+from app.services.rates import (cross_rate, conversion_rates, rate_matrix_fetched_at, watch_rate_matrix,
+                                unwatch_rate_matrix)
+
+MAX_STREAM_BASES = 10
+# browsers cannot set headers on a WebSocket, the token rides in the subprotocol list as ["bearer", <JWT>]
+WS_AUTH_SUBPROTOCOL = "bearer"
+
+
+class RateSubscription:
+    def __init__(self, pairs: list[tuple[str, str]], bases: list[str]):
+        self.pairs = pairs
+        self.bases = bases
+        # several snapshots loaded before the client reads collapse into one delta
+        self.changed = asyncio.Event()
+        self.sent: dict[str, float] = {}
+
+    def current_rates(self) -> dict[str, float]:
+        rates = {}
+        for base in self.bases:
+            for target, rate in (conversion_rates(base) or {}).items():
+                if target != base:
+                    rates[base + target] = rate
+        for currency_from, currency_to in self.pairs:
+            rate = cross_rate(currency_from, currency_to)
+            if rate is not None:
+                rates[currency_from + currency_to] = rate
+        return rates
+
+    def delta(self) -> dict[str, float]:
+        rates = self.current_rates()
+        changed = {pair: rate for pair, rate in rates.items() if self.sent.get(pair) != rate}
+        self.sent = rates
+        return changed
+
+
+def parse_bases(bases: str | None) -> list[str]:
+    parsed = [base.strip().upper() for base in bases.split(",")] if bases else []
+    if any(len(base) != 3 or not base.isalpha() for base in parsed):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid base currency"
+        )
+    if len(parsed) > MAX_STREAM_BASES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_STREAM_BASES} bases per stream"
+        )
+    return parsed
+
+
+def rate_subscription(pairs: str | None, bases: str | None) -> RateSubscription:
+    if not pairs and not bases:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Subscribe to at least one pair or base"
+        )
+    return RateSubscription(parse_pairs(pairs) if pairs else [], parse_bases(bases))
+
+
+def rates_message(rates: dict[str, float]) -> dict:
+    message = {"rates": rates}
+    as_of = Cached(rates, rate_matrix_fetched_at()).as_of
+    if as_of is not None:
+        message["as_of"] = as_of.isoformat()
+    return message
+
+
+async def rate_updates(subscription: RateSubscription, expires_at: float | None = None) -> AsyncIterator[dict | None]:
+    # the worker's rates listener reloads the snapshot once per published update and wakes every stream;
+    # None means nothing changed for STREAM_KEEPALIVE_SECONDS, so the transport can check the client is there.
+    # The stream ends when the token it was opened with expires
+    watch_rate_matrix(subscription.changed)
+    try:
+        yield rates_message(subscription.delta())
+        while True:
+            timeout = settings.STREAM_KEEPALIVE_SECONDS
+            if expires_at is not None:
+                if expires_at <= time.time():
+                    return
+                timeout = min(timeout, expires_at - time.time())
+            try:
+                await asyncio.wait_for(subscription.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                if expires_at is None or expires_at > time.time():
+                    yield None
+                continue
+            subscription.changed.clear()
+            delta = subscription.delta()
+            if delta:
+                yield rates_message(delta)
+    finally:
+        unwatch_rate_matrix(subscription.changed)
+
+
+async def sse_rate_stream(subscription: RateSubscription, expires_at: float | None = None) -> AsyncIterator[bytes]:
+    async for message in rate_updates(subscription, expires_at):
+        if message is None:
+            yield b": keepalive\n\n"
+        else:
+            yield b"event: rates\ndata: " + dumps_json(message) + b"\n\n"
+    # tells the client to get a new token rather than reconnect with the expired one
+    yield b"event: expired\ndata: {}\n\n"
+
+
+def rate_event_stream(token: str, pairs: str | None, bases: str | None) -> StreamingResponse:
+    return StreamingResponse(
+        sse_rate_stream(rate_subscription(pairs, bases), token_expires_at(token)),
+        media_type="text/event-stream",
+        # proxies must pass every event through as soon as it is written
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def websocket_token(websocket: WebSocket) -> str:
+    # the token stays out of the URL, and so out of access logs
+    protocols = [protocol.strip() for protocol in websocket.headers.get("sec-websocket-protocol", "").split(",")]
+    if len(protocols) != 2 or protocols[0] != WS_AUTH_SUBPROTOCOL:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Missing token"
+        )
+    return protocols[1]
+
+
+async def websocket_rate_stream(websocket: WebSocket, pairs: str | None, bases: str | None) -> None:
+    try:
+        token = websocket_token(websocket)
+        async with async_session_maker() as db:
+            await get_current_user(token, db)
+        subscription = rate_subscription(pairs, bases)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+    await websocket.accept(subprotocol=WS_AUTH_SUBPROTOCOL)
+    try:
+        async for message in rate_updates(subscription, token_expires_at(token)):
+            await websocket.send_json({"type": "keepalive"} if message is None else {"type": "rates", **message})
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Token expired")
+    except WebSocketDisconnect:
+        pass
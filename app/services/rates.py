@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import math
+from array import array
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import local_cache, Cached
+from app.core.config import settings
+from app.core.responses import dumps_json
+from app.core.redis import get_redis
+from app.db.database import async_session_maker
+from app.db.models import CurrencyRate
+
+try:
+    import numpy
+except ImportError:
+    # optional, without it portfolios are valued one position at a time over an array('d')
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+BASE_CURRENCY = "USD"
+
+# USD-based snapshot of CurrencyRate: target currency -> units per 1 USD
+_usd_rates: dict[str, float] = {}
+_updated_at: datetime | None = None
+# conversion_rates rows already computed from the current snapshot
+_rows: dict[str, dict[str, float]] = {}
+# /currency/list bodies for those rows, serialized once per snapshot
+_list_bodies: dict[str, bytes] = {}
+# the snapshot as a currency -> position index and a contiguous vector of USD rates
+_rate_vector: tuple[dict[str, int], "numpy.ndarray | array"] | None = None
+# one event per open rate stream, set whenever a new snapshot replaces the current one
+_snapshot_events: set[asyncio.Event] = set()
+
+
+def set_rate_matrix(usd_rates: dict[str, float], updated_at: datetime | None = None) -> None:
+    global _usd_rates, _updated_at, _rows, _list_bodies, _rate_vector
+    rates = dict(usd_rates)
+    if rates:
+        rates.setdefault(BASE_CURRENCY, 1.0)
+    _usd_rates, _updated_at, _rows, _list_bodies, _rate_vector = rates, updated_at, {}, {}, None
+    for event in _snapshot_events:
+        event.set()
+
+
+def watch_rate_matrix(event: asyncio.Event) -> None:
+    _snapshot_events.add(event)
+
+
+def unwatch_rate_matrix(event: asyncio.Event) -> None:
+    _snapshot_events.discard(event)
+
+
+def rate_matrix_updated_at() -> datetime | None:
+    return _updated_at
+
+
+def rate_matrix_fetched_at() -> float | None:
+    if _updated_at is None:
+        return None
+    # SQLite hands the timestamps back naive, they are stored in UTC
+    updated_at = _updated_at if _updated_at.tzinfo else _updated_at.replace(tzinfo=timezone.utc)
+    return updated_at.timestamp()
+
+
+def matrix_rate(currency_from: str, currency_to: str) -> Cached | None:
+    rate = cross_rate(currency_from, currency_to)
+    return Cached(rate, rate_matrix_fetched_at()) if rate is not None else None
+
+
+def cross_rate(currency_from: str, currency_to: str) -> float | None:
+    rates = _usd_rates
+    rate_from = rates.get(currency_from)
+    rate_to = rates.get(currency_to)
+    if not rate_from or rate_to is None:
+        return None
+    return rate_to / rate_from
+
+
+def conversion_rates(currency_from: str) -> dict[str, float] | None:
+    row = _rows.get(currency_from)
+    if row is not None:
+        return row
+    rates = _usd_rates
+    rate_from = rates.get(currency_from)
+    if not rate_from:
+        return None
+    row = {target: rate / rate_from for target, rate in rates.items()}
+    _rows[currency_from] = row
+    return row
+
+
+def conversion_rates_body(currency_from: str) -> bytes | None:
+    body = _list_bodies.get(currency_from)
+    if body is not None:
+        return body
+    row = conversion_rates(currency_from)
+    if row is None:
+        return None
+    body = list_body(currency_from, Cached(row, rate_matrix_fetched_at()))
+    _list_bodies[currency_from] = body
+    return body
+
+
+def rate_vector() -> tuple[dict[str, int], "numpy.ndarray | array"]:
+    global _rate_vector
+    if _rate_vector is None:
+        rates = {code: rate for code, rate in _usd_rates.items() if rate}
+        index = {code: position for position, code in enumerate(rates)}
+        values = numpy.fromiter(rates.values(), dtype=float) if numpy is not None else array("d", rates.values())
+        _rate_vector = index, values
+    return _rate_vector
+
+
+def convert_amounts(currencies: list[str], amounts: list[float], currency_to: str) -> tuple[list[float], float]:
+    # a KeyError names the first currency outside the snapshot
+    index, usd_rates = rate_vector()
+    rate_to = usd_rates[index[currency_to]]
+    positions = [index[currency] for currency in currencies]
+    if numpy is not None:
+        values = numpy.asarray(amounts, dtype=float) * rate_to / usd_rates[positions]
+        return values.tolist(), float(values.sum())
+    values = [amount * rate_to / usd_rates[position] for amount, position in zip(amounts, positions)]
+    return values, math.fsum(values)
+
+
+def list_body(currency_from: str, rates: Cached) -> bytes:
+    body = {"currency_from": currency_from, "conversion_rates": rates.value}
+    if rates.as_of is not None:
+        body["as_of"] = rates.as_of.isoformat()
+    return dumps_json(body)
+
+
+async def load_rate_matrix(db: AsyncSession) -> int:
+    res = await db.execute(
+        select(CurrencyRate.target_currency, CurrencyRate.rate, CurrencyRate.updated_at)
+        .where(CurrencyRate.base_currency == BASE_CURRENCY)
+    )
+    usd_rates = {}
+    updated_at = None
+    for target_currency, rate, rate_updated_at in res.all():
+        usd_rates[target_currency] = rate
+        if updated_at is None or rate_updated_at > updated_at:
+            updated_at = rate_updated_at
+    set_rate_matrix(usd_rates, updated_at)
+    return len(usd_rates)
+
+
+async def refresh_rate_matrix() -> None:
+    async with async_session_maker() as session:
+        await load_rate_matrix(session)
+
+
+async def refresh_rate_matrix_periodically() -> None:
+    while True:
+        try:
+            await refresh_rate_matrix()
+        except Exception:
+            logger.exception("Failed to refresh the rate matrix")
+        await asyncio.sleep(settings.RATE_MATRIX_REFRESH_SECONDS)
+
+
+async def handle_rates_update(message: dict) -> None:
+    if message.get("type") != "message":
+        return
+    local_cache.clear()
+    await refresh_rate_matrix()
+
+
+async def listen_for_rate_updates() -> None:
+    while True:
+        try:
+            redis = await get_redis()
+            pubsub = redis.pubsub()
+            await pubsub.subscribe(settings.RATES_CHANNEL)
+            try:
+                async for message in pubsub.listen():
+                    await handle_rates_update(message)
+            finally:
+                await pubsub.aclose()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Rate update subscription failed, reconnecting")
+            await asyncio.sleep(1)
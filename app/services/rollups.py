@@ -0,0 +1,90 @@
+from datetime import date, datetime, timezone
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import ConversionRollup
+
+
+def rollup_day(exchange_time: datetime) -> date:
+    if exchange_time.tzinfo is not None:
+        exchange_time = exchange_time.astimezone(timezone.utc)
+    return exchange_time.date()
+
+
+def rollup_rows(history_rows: list[dict]) -> list[dict]:
+    rollups = {}
+    for row in history_rows:
+        key = (row["user_id"], row["base_currency"], row["target_currency"], rollup_day(row["exchange_time"]))
+        rollup = rollups.get(key)
+        if rollup is None:
+            user_id, base_currency, target_currency, day = key
+            rollups[key] = {
+                "user_id": user_id, "base_currency": base_currency, "target_currency": target_currency, "day": day,
+                "conversions": 1, "amount_total": row["amount"], "converted_total": row["converted_amount"],
+                "rate_total": row["rate"], "rate_min": row["rate"], "rate_max": row["rate"]
+            }
+            continue
+        rollup["conversions"] += 1
+        rollup["amount_total"] += row["amount"]
+        rollup["converted_total"] += row["converted_amount"]
+        rollup["rate_total"] += row["rate"]
+        rollup["rate_min"] = min(rollup["rate_min"], row["rate"])
+        rollup["rate_max"] = max(rollup["rate_max"], row["rate"])
+    # every transaction locks rollup rows in key order, so concurrent upserts never deadlock
+    return [rollups[key] for key in sorted(rollups)]
+
+
+async def add_to_rollups(session: AsyncSession, history_rows: list[dict]) -> None:
+    rows = rollup_rows(history_rows)
+    if not rows:
+        return
+    postgresql = session.get_bind().dialect.name == "postgresql"
+    dialect_insert = postgresql_insert if postgresql else sqlite_insert
+    # SQLite spells LEAST/GREATEST as the two-argument min/max
+    least, greatest = (func.least, func.greatest) if postgresql else (func.min, func.max)
+    stmt = dialect_insert(ConversionRollup).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            ConversionRollup.user_id, ConversionRollup.base_currency,
+            ConversionRollup.target_currency, ConversionRollup.day
+        ],
+        set_={
+            "conversions": ConversionRollup.conversions + stmt.excluded.conversions,
+            "amount_total": ConversionRollup.amount_total + stmt.excluded.amount_total,
+            "converted_total": ConversionRollup.converted_total + stmt.excluded.converted_total,
+            "rate_total": ConversionRollup.rate_total + stmt.excluded.rate_total,
+            "rate_min": least(ConversionRollup.rate_min, stmt.excluded.rate_min),
+            "rate_max": greatest(ConversionRollup.rate_max, stmt.excluded.rate_max),
+        }
+    )
+    await session.execute(stmt)
+
+
+def history_stats_query(
+    user_id: int,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    per_day: bool = True
+):
+    conversions = func.sum(ConversionRollup.conversions)
+    group = [ConversionRollup.base_currency, ConversionRollup.target_currency]
+    if per_day:
+        group.append(ConversionRollup.day)
+    stmt = select(
+        *group,
+        conversions.label("conversions"),
+        func.sum(ConversionRollup.amount_total).label("amount_total"),
+        func.sum(ConversionRollup.converted_total).label("converted_total"),
+        (func.sum(ConversionRollup.rate_total) / conversions).label("avg_rate"),
+        func.min(ConversionRollup.rate_min).label("min_rate"),
+        func.max(ConversionRollup.rate_max).label("max_rate")
+    ).where(ConversionRollup.user_id == user_id)
+    if date_from is not None:
+        stmt = stmt.where(ConversionRollup.day >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(ConversionRollup.day <= date_to)
+    # the primary key (user_id, base, target, day) serves both the filter and the grouping
+    return stmt.group_by(*group).order_by(*group)
@@ -2,7 +2,7 @@ from fastapi import HTTPException, status
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.security import get_hashed_password
+from app.core.security import get_hashed_password, run_password_hashing
 from app.db.models import User
 from app.api.schemas.users import UserIn
 
@@ -25,7 +25,7 @@ async def check_email(email: str, db: AsyncSession):
 async def register_user_in_db(user_data: UserIn, db: AsyncSession) -> None:
     await check_username(user_data.username, db)
     await check_email(user_data.email, db)
-    hashed_password = get_hashed_password(user_data.password)
+    hashed_password = await run_password_hashing(get_hashed_password, user_data.password)
     user = User(username=user_data.username, hash_password=hashed_password, email=user_data.email)
     db.add(user)
     await db.commit()
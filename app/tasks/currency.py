@@ -1,44 +1,174 @@
-from datetime import datetime, timezone
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
 
-from sqlalchemy import select
-from requests.exceptions import RequestException
+import httpx
+from fastapi import HTTPException
 
-from app.utils.external_api import sync_supported_currencies
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from redis.exceptions import RedisError
+
+from app.utils.external_api import create_http_client, get_supported_currencies
 from app.celery_app import celery_app
+from app.core.config import settings
+from app.core.redis import get_sync_redis
+from app.core.quota import acquire_upstream_quota_sync, UpstreamQuotaExhausted
+from app.core.rate_store import write_rate_tables, migrate_legacy_rate_keys
+from app.core.metrics import REFRESH_METRICS_KEY
 from app.db.database import sync_session_maker
-from app.db.models import CurrencyRate
+from app.db.models import CurrencyRate, RateSnapshot
+from app.db.partitions import create_daily_partition
+from app.services.rates import BASE_CURRENCY
+
+logger = logging.getLogger(__name__)
 
 
 @celery_app.task(
     name="update_currency_rates",
     bind=True,
-    autoretry_for=(RequestException, Exception),
+    autoretry_for=(httpx.HTTPError, HTTPException),
     retry_backoff=True,
     retry_kwargs={"max_retries": 5}
 )
 def update_currency_rates(self):
-    base_currency = "USD"
-    data = sync_supported_currencies(base_currency)
-    conversion_rates = data["conversion_rates"]
+    try:
+        acquire_upstream_quota_sync(get_sync_redis(), len(settings.REFRESH_BASE_CURRENCIES))
+    except UpstreamQuotaExhausted:
+        # retrying would not refill the bucket any sooner, the next scheduled run tries again
+        logger.warning("Upstream quota exhausted, keeping the current rates")
+        return None
+    timings = {}
+    started = time.perf_counter()
+    fetched = asyncio.run(fetch_rates(settings.REFRESH_BASE_CURRENCIES))
+    timings["fetch"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rates = transform_rates(fetched)
+    timings["transform"] = time.perf_counter() - started
+
+    # a database failure retries only the persist task, the rates are not fetched again
+    persist_currency_rates.delay(rates, datetime.now(timezone.utc).isoformat())
+    logger.info("Fetched rates for %d bases: %s", len(rates), format_timings(timings))
+    record_refresh_metrics(timings)
+    return timings
+
+
+@celery_app.task(
+    name="persist_currency_rates",
+    autoretry_for=(SQLAlchemyError,),
+    retry_backoff=True,
+    retry_kwargs={"max_retries": 5}
+)
+def persist_currency_rates(rates: dict[str, dict[str, float]], update_time: str):
+    update_time = datetime.fromisoformat(update_time)
+    timings = {}
+    started = time.perf_counter()
     with sync_session_maker() as session:
-        stmt = select(CurrencyRate).where(CurrencyRate.base_currency == base_currency)
-        res = session.execute(stmt)
-        existing_rates = {rate.target_currency: rate for rate in res.scalars().all()}
-        update_time = datetime.now(timezone.utc)
-
-        for target_currency, rate in conversion_rates.items():
-            if target_currency == base_currency:
-                continue
-            if target_currency in existing_rates:
-                existing_rates[target_currency].rate = rate
-                existing_rates[target_currency].updated_at = update_time
-            else:
-                session.add(CurrencyRate(
-                    base_currency=base_currency,
-                    target_currency=target_currency,
-                    rate=rate,
-                    updated_at=update_time
-                ))
+        for base_currency, conversion_rates in rates.items():
+            upsert_currency_rates(session, base_currency, conversion_rates, update_time)
+            append_rate_snapshot(session, base_currency, conversion_rates, update_time)
         session.commit()
+    timings["persist"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if BASE_CURRENCY in rates:
+        warm_rate_cache({**rates[BASE_CURRENCY], BASE_CURRENCY: 1.0}, update_time)
+        publish_rates_update(BASE_CURRENCY, update_time)
+    timings["publish"] = time.perf_counter() - started
+    logger.info("Persisted rates for %d bases: %s", len(rates), format_timings(timings))
+    record_refresh_metrics({**timings, "finished_at": time.time()})
+    return timings
+
+
+async def fetch_rates(base_currencies: list[str]) -> dict[str, dict]:
+    # one pooled client per run: the worker starts a fresh event loop for every task
+    async with create_http_client() as client:
+        responses = await asyncio.gather(
+            *(get_supported_currencies(base_currency, client) for base_currency in base_currencies)
+        )
+    return dict(zip(base_currencies, responses))
+
+
+def transform_rates(fetched: dict[str, dict]) -> dict[str, dict[str, float]]:
+    return {
+        base_currency: {
+            target_currency: float(rate)
+            for target_currency, rate in data["conversion_rates"].items()
+            if target_currency != base_currency
+        }
+        for base_currency, data in fetched.items()
+    }
+
+
+def record_refresh_metrics(values: dict[str, float]) -> None:
+    try:
+        get_sync_redis().hset(REFRESH_METRICS_KEY, mapping=values)
+    except RedisError:
+        logger.exception("Failed to record the refresh metrics")
+
+
+def format_timings(timings: dict[str, float]) -> str:
+    return ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings.items())
+
+
+def upsert_currency_rates(session: Session, base_currency: str, conversion_rates: dict, update_time: datetime) -> None:
+    rows = [
+        {"base_currency": base_currency, "target_currency": target_currency, "rate": rate, "updated_at": update_time}
+        for target_currency, rate in conversion_rates.items()
+        if target_currency != base_currency
+    ]
+    if not rows:
+        return
+    dialect_insert = postgresql_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    stmt = dialect_insert(CurrencyRate).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CurrencyRate.base_currency, CurrencyRate.target_currency],
+        set_={"rate": stmt.excluded.rate, "updated_at": stmt.excluded.updated_at}
+    )
+    session.execute(stmt)
+
+
+def append_rate_snapshot(session: Session, base_currency: str, conversion_rates: dict, update_time: datetime) -> None:
+    rows = [
+        {"base_currency": base_currency, "target_currency": target_currency, "rate": rate, "taken_at": update_time}
+        for target_currency, rate in conversion_rates.items()
+        if target_currency != base_currency
+    ]
+    if not rows:
+        return
+    # keep a day ahead so a refresh right after midnight never lacks its partition
+    for day in (update_time.date(), update_time.date() + timedelta(days=1)):
+        create_daily_partition(session, RateSnapshot.__tablename__, day)
+    session.execute(insert(RateSnapshot), rows)
+
+
+def warm_rate_cache(conversion_rates: dict, update_time: datetime) -> None:
+    try:
+        write_rate_tables(
+            get_sync_redis(), conversion_rates, int(update_time.timestamp() * 1_000_000), settings.RATES_CACHE_TTL
+        )
+    except RedisError:
+        # rates are already committed, readers fall back to the database snapshot and the upstream API
+        logger.exception("Failed to warm the rate cache")
+
+
+def publish_rates_update(base_currency: str, update_time: datetime) -> None:
+    message = json.dumps({"base_currency": base_currency, "updated_at": update_time.isoformat()})
+    try:
+        get_sync_redis().publish(settings.RATES_CHANNEL, message)
+    except RedisError:
+        # API workers still pick the new rates up on their periodic refresh
+        logger.exception("Failed to publish the rates update")
 
 
+@celery_app.task(name="migrate_legacy_rate_keys")
+def migrate_legacy_rate_cache() -> int:
+    migrated = migrate_legacy_rate_keys(get_sync_redis())
+    logger.info("Moved %d legacy rate keys to hashes", migrated)
+    return migrated
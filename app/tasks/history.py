@@ -0,0 +1,47 @@
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from app.celery_app import celery_app
+from app.core.config import settings
+from app.db.database import sync_session_maker
+from app.db.models import ConversionHistory, ConversionHistoryArchive
+from app.db.partitions import add_months, create_monthly_partition, monthly_partitions, hot_history_start
+
+logger = logging.getLogger(__name__)
+
+HISTORY_COLUMNS = "id, user_id, base_currency, target_currency, amount, converted_amount, rate, exchange_time"
+
+
+@celery_app.task(name="archive_conversion_history")
+def archive_conversion_history() -> list[str]:
+    history = ConversionHistory.__tablename__
+    archived = []
+    with sync_session_maker() as session:
+        if session.get_bind().dialect.name != "postgresql":
+            return archived
+        # inserts from the API never wait for a partition: the next months always exist
+        today = datetime.now(timezone.utc).date()
+        for months in range(settings.HISTORY_PARTITIONS_AHEAD + 1):
+            create_monthly_partition(session, history, add_months(today.replace(day=1), months))
+        session.commit()
+
+        hot_start = hot_history_start(settings.HISTORY_HOT_MONTHS).date()
+        for name, month in sorted(monthly_partitions(session, history).items(), key=lambda item: item[1]):
+            if add_months(month, 1) > hot_start:
+                break
+            # one month per transaction, readers see its rows either in the partition or in the archive.
+            # The copy only locks the partition against writes; DETACH takes an ACCESS EXCLUSIVE lock on
+            # the parent, so it runs last and blocks API inserts and reads just until the commit
+            session.execute(text(f"LOCK TABLE {name} IN SHARE MODE"))
+            session.execute(text(
+                f"INSERT INTO {ConversionHistoryArchive.__tablename__} ({HISTORY_COLUMNS}) "
+                f"SELECT {HISTORY_COLUMNS} FROM {name}"
+            ))
+            session.execute(text(f"ALTER TABLE {history} DETACH PARTITION {name}"))
+            session.execute(text(f"DROP TABLE {name}"))
+            session.commit()
+            archived.append(name)
+    logger.info("Archived %d history partitions: %s", len(archived), ", ".join(archived) or "none")
+    return archived
@@ -1,15 +1,79 @@
+from contextlib import contextmanager
+from importlib.util import find_spec
+
 import httpx
-import requests
 from fastapi import HTTPException, status
 
 from app.core.config import settings
+from app.core.metrics import upstream_timer, upstream_errors
+from app.core.circuit_breaker import CircuitBreaker
 
 API_KEY = settings.API_KEY
 BASE_URL = f"https://v6.exchangerate-api.com/v6/{API_KEY}"
 
+_client: httpx.AsyncClient | None = None
+upstream_breaker = CircuitBreaker(settings.UPSTREAM_FAILURE_THRESHOLD, settings.UPSTREAM_RESET_SECONDS)
+
+def create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+        # HTTP/2 needs the optional h2 package, fall back to HTTP/1.1 without it
+        http2=settings.HTTP2 and find_spec("h2") is not None
+    )
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def upstream_unavailable(endpoint: str) -> HTTPException:
+    upstream_errors.inc(endpoint=endpoint, reason="circuit-open")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="upstream-unavailable"
+    )
+
+def check_upstream_breaker(endpoint: str) -> None:
+    # callers that spend quota before the call fail here first, an open circuit costs no tokens
+    if not upstream_breaker.would_allow():
+        raise upstream_unavailable(endpoint)
+
+@contextmanager
+def upstream_call(endpoint: str):
+    if not upstream_breaker.allow():
+        raise upstream_unavailable(endpoint)
+    try:
+        with upstream_timer(endpoint):
+            yield
+    except HTTPException:
+        # an error result such as unsupported-code still means the API is up
+        upstream_breaker.record_success()
+        raise
+    except Exception:
+        upstream_breaker.record_failure()
+        raise
+    except BaseException:
+        # a client disconnect or shutdown cancelled the call, that says nothing about the upstream
+        upstream_breaker.release_trial()
+        raise
+    upstream_breaker.record_success()
+
 async def get_exchange_rate(currency_from: str = "USD", currency_to: str = "RUB"):
-    async with httpx.AsyncClient() as client:
-        try:
+    client = get_http_client()
+    try:
+        with upstream_call("pair"):
             response = await client.get(f"{BASE_URL}/pair/{currency_from}/{currency_to}")
             data = response.json()
             if data['result'] == 'error':
@@ -17,26 +81,27 @@ async def get_exchange_rate(currency_from: str = "USD", currency_to: str = "RUB"
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=data["error-type"]
                 )
-            conversion_rates = data["conversion_rate"]
-            return {
-                "currency_from": currency_from,
-                "currency_to": currency_to,
-                "conversion_rate": conversion_rates
-            }
-        except httpx.RequestError as e:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Network error: {e}"
-            )
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"HTTP error: {e}"
-            )
+        conversion_rates = data["conversion_rate"]
+        return {
+            "currency_from": currency_from,
+            "currency_to": currency_to,
+            "conversion_rate": conversion_rates
+        }
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Network error: {e}"
+        )
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"HTTP error: {e}"
+        )
 
-async def get_supported_currencies(currency_from: str = "USD"):
-    async with httpx.AsyncClient() as client:
-        try:
+async def get_supported_currencies(currency_from: str = "USD", client: httpx.AsyncClient | None = None):
+    client = client or get_http_client()
+    try:
+        with upstream_call("latest"):
             response = await client.get(f"{BASE_URL}/latest/{currency_from}")
             data = response.json()
             if data['result'] == 'error':
@@ -44,31 +109,6 @@ async def get_supported_currencies(currency_from: str = "USD"):
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=data["error-type"]
                 )
-            conversion_rates = data['conversion_rates']
-            return {
-                "currency_from": currency_from,
-                "conversion_rates": conversion_rates
-            }
-        except httpx.RequestError as e:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Network error: {e}"
-            )
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"HTTP error: {e}"
-            )
-
-def sync_supported_currencies(currency_from: str = "USD"):
-    try:
-        response = requests.get(f"{BASE_URL}/latest/{currency_from}")
-        data = response.json()
-        if data['result'] == 'error':
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=data["error-type"]
-            )
         conversion_rates = data['conversion_rates']
         return {
             "currency_from": currency_from,
@@ -83,4 +123,4 @@ def sync_supported_currencies(currency_from: str = "USD"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"HTTP error: {e}"
-        )
\ No newline at end of file
+        )
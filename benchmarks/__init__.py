@@ -0,0 +1,15 @@
+import os
+
+# app.core.config requires these; benchmarks run against local stand-ins only
+for name, value in {
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_USER": "bench",
+    "DB_PASS": "bench",
+    "DB_NAME": "bench",
+    "API_KEY": "bench",
+    "SECRET_KEY": "bench-secret-key",
+    "ALGORITHM": "HS256",
+    "REDIS_URL": "redis://localhost:6379/0",
+}.items():
+    os.environ.setdefault(name, value)
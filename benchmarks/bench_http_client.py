@@ -0,0 +1,55 @@
+"""Per-call httpx clients vs the shared pooled client against a local upstream.
+
+    python -m benchmarks.bench_http_client --requests 2000 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from benchmarks import fake_upstream
+from app.utils import external_api
+
+
+async def per_call_client(currency_from: str, currency_to: str):
+    # what get_exchange_rate did before the shared client
+    async with httpx.AsyncClient() as client:
+        response = await client.get(f"{external_api.BASE_URL}/pair/{currency_from}/{currency_to}")
+        return response.json()
+
+
+async def run(fetch, requests: int, concurrency: int) -> dict:
+    samples = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await fetch("EUR", "JPY")
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    return {"requests_per_sec": round(requests / elapsed, 1), **fake_upstream.latency_summary(samples)}
+
+
+async def main(args):
+    with fake_upstream.serve_fake_upstream(args.latency) as base_url:
+        external_api.BASE_URL = base_url
+        results = {
+            "per_call_client": await run(per_call_client, args.requests, args.concurrency),
+            "pooled_client": await run(external_api.get_exchange_rate, args.requests, args.concurrency),
+        }
+        await external_api.close_http_client()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="upstream latency in seconds")
+    asyncio.run(main(parser.parse_args()))
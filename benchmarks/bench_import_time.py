@@ -0,0 +1,68 @@
+"""Cold import time of each process entry point, from ``python -X importtime``.
+
+Each module is imported in a fresh interpreter, so nothing is shared between
+runs. With --max-ms the script exits non-zero when an entry point gets slower.
+
+    python -m benchmarks.bench_import_time --runs 5
+    python -m benchmarks.bench_import_time --max-ms main=1500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import benchmarks  # noqa: F401  sets the env the app settings require
+
+ENTRY_POINTS = ["main", "app.celery_app", "app.tasks.currency"]
+
+
+def import_time(module: str) -> tuple[float, dict[str, float]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=os.environ, check=True
+    )
+    total_us = 0
+    packages: dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line.replace("import time:", "").split("|"))
+        if not self_us.isdigit():
+            continue
+        top_level = name.split(".")[0]
+        packages[top_level] = packages.get(top_level, 0) + int(self_us) / 1000
+        if name == module:
+            total_us = int(cumulative_us)
+    return total_us / 1000, packages
+
+
+def measure(module: str, runs: int) -> dict:
+    totals, packages = [], {}
+    for _ in range(runs):
+        total, packages = import_time(module)
+        totals.append(total)
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:8]
+    return {
+        "median_ms": round(statistics.median(totals), 1),
+        "min_ms": round(min(totals), 1),
+        "heaviest_packages_ms": {name: round(ms, 1) for name, ms in heaviest},
+    }
+
+
+def main(args):
+    limits = dict(limit.split("=") for limit in args.max_ms)
+    results = {module: measure(module, args.runs) for module in args.modules or ENTRY_POINTS}
+    print(json.dumps(results, indent=2))
+    slow = [module for module, limit in limits.items() if results.get(module, {}).get("median_ms", 0) > float(limit)]
+    if slow:
+        sys.exit(f"import time over budget: {', '.join(slow)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", nargs="*", default=[], metavar="MODULE=MS")
+    main(parser.parse_args())
@@ -0,0 +1,62 @@
+"""Requests/sec on one core for /currency/list: pydantic model vs pre-serialized body.
+
+The model path is the endpoint as it was before the raw response, mounted on a
+side route of the same app.
+
+    python -m benchmarks.bench_list_response --requests 3000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import string
+import time
+
+from fastapi import Depends
+
+from main import app
+from app.api.schemas.currency import CurrencyListOut
+from app.core.security import get_current_user
+from app.services.currency import list_currencies
+from app.services.rates import set_rate_matrix
+from benchmarks.local_app import local_app
+
+
+async def list_currencies_model(currency_from: str) -> CurrencyListOut:
+    return await list_currencies(currency_from)
+
+
+async def requests_per_sec(client, url: str, requests: int) -> dict:
+    for _ in range(50):
+        (await client.get(url, params={"currency_from": "EUR"})).raise_for_status()
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(url, params={"currency_from": "EUR"})
+        response.raise_for_status()
+    elapsed = time.perf_counter() - started
+    return {"requests": requests, "requests_per_sec": round(requests / elapsed), "bytes": len(response.content)}
+
+
+def full_rate_table(currencies: int) -> dict[str, float]:
+    # as many codes as the upstream API really returns, the fake upstream only knows a handful
+    codes = ["EUR"] + ["".join(code) for code in itertools.islice(itertools.product(string.ascii_uppercase, repeat=3), currencies)]
+    return {code: random.uniform(0.001, 20000) for code in codes}
+
+
+async def main(args):
+    app.add_api_route(
+        "/bench/list-model", list_currencies_model, methods=["GET"], dependencies=[Depends(get_current_user)]
+    )
+    async with local_app() as (client, _):
+        set_rate_matrix(full_rate_table(args.currencies))
+        model = await requests_per_sec(client, "/bench/list-model", args.requests)
+        raw = await requests_per_sec(client, "/currency/list", args.requests)
+    print(json.dumps({"pydantic_model": model, "pre_serialized": raw}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--currencies", type=int, default=160)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,63 @@
+"""p99 of /currency/definitely while a burst of logins hashes passwords.
+
+Compares bcrypt run inline on the event loop with the bounded executor.
+
+    python -m benchmarks.bench_login_storm --logins 20 --rate-requests 400
+"""
+import argparse
+import asyncio
+import json
+import time
+from unittest.mock import patch
+
+from benchmarks.fake_upstream import latency_summary
+from benchmarks.local_app import local_app, BENCH_USER, BENCH_PASSWORD
+
+
+async def run_inline(func, *args):
+    return func(*args)
+
+
+async def login_storm(client, logins: int, rate_requests: int, interval: float) -> dict:
+    samples = []
+
+    async def login(delay: float):
+        await asyncio.sleep(delay)
+        response = await client.post("/auth/login", data={"username": BENCH_USER, "password": BENCH_PASSWORD})
+        response.raise_for_status()
+
+    async def rate_lookup(scheduled: float):
+        response = await client.post("/currency/definitely", json={"currency_from": "EUR", "currency_to": "JPY"})
+        response.raise_for_status()
+        # measured from the scheduled arrival, so time spent queued behind a blocked loop counts
+        samples.append(time.perf_counter() - scheduled)
+
+    async def rate_lookups():
+        started = time.perf_counter()
+        tasks = []
+        for i in range(rate_requests):
+            scheduled = started + i * interval
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            tasks.append(asyncio.create_task(rate_lookup(scheduled)))
+        await asyncio.gather(*tasks)
+
+    started = time.perf_counter()
+    duration = rate_requests * interval
+    await asyncio.gather(rate_lookups(), *(login(i * duration / logins) for i in range(logins)))
+    return {"elapsed_sec": round(time.perf_counter() - started, 3), **latency_summary(samples)}
+
+
+async def main(args):
+    async with local_app() as (client, _):
+        with patch("app.core.security.run_password_hashing", run_inline):
+            inline = await login_storm(client, args.logins, args.rate_requests, args.interval)
+        offloaded = await login_storm(client, args.logins, args.rate_requests, args.interval)
+    print(json.dumps({"bcrypt_on_event_loop": inline, "bcrypt_in_executor": offloaded}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--rate-requests", type=int, default=400)
+    parser.add_argument("--interval", type=float, default=0.02, help="seconds between rate requests")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,98 @@
+"""Valuing a 10k-position portfolio: /currency/portfolio/value against one /currency/amount call per position.
+
+The valuation core is also timed on its own, against a per-position loop over
+the rate matrix. It is vectorized with numpy when installed, and falls back to
+array('d') otherwise; the report says which one ran.
+
+    python -m benchmarks.bench_portfolio --positions 10000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from app.core.config import settings
+from app.services import rates
+from app.services.rates import convert_amounts, cross_rate, set_rate_matrix
+from benchmarks.bench_list_response import full_rate_table
+from benchmarks.local_app import local_app
+
+
+def random_portfolio(codes: list[str], positions: int) -> list[dict]:
+    return [{"currency": random.choice(codes), "amount": round(random.uniform(1, 100000), 2)} for _ in range(positions)]
+
+
+def time_best(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def core_timings(portfolio: list[dict], repeat: int) -> dict:
+    currencies = [position["currency"] for position in portfolio]
+    amounts = [position["amount"] for position in portfolio]
+    convert_amounts(currencies, amounts, "EUR")
+
+    def per_position():
+        return sum(amount * cross_rate(currency, "EUR") for currency, amount in zip(currencies, amounts))
+
+    return {
+        "backend": "numpy" if rates.numpy is not None else "array",
+        "rate_vector_ms": round(time_best(lambda: convert_amounts(currencies, amounts, "EUR"), repeat) * 1000, 3),
+        "per_position_loop_ms": round(time_best(per_position, repeat) * 1000, 3),
+    }
+
+
+async def endpoint_timings(client, portfolio: list[dict], repeat: int, amount_calls: int) -> dict:
+    payload = {"currency_to": "EUR", "positions": portfolio}
+    (await client.post("/currency/portfolio/value", json=payload)).raise_for_status()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = await client.post("/currency/portfolio/value", json=payload)
+        response.raise_for_status()
+        samples.append(time.perf_counter() - started)
+    response_bytes = len(response.content)
+
+    # /amount writes a history row per call, so only a sample is timed and scaled up
+    started = time.perf_counter()
+    for position in portfolio[:amount_calls]:
+        response = await client.post("/currency/amount", json={
+            "currency_from": position["currency"], "currency_to": "EUR", "amount": position["amount"]
+        })
+        response.raise_for_status()
+    per_call = (time.perf_counter() - started) / amount_calls
+    return {
+        "portfolio_value_ms": round(min(samples) * 1000, 2),
+        "amount_per_position_estimated_ms": round(per_call * len(portfolio) * 1000, 2),
+        "response_bytes": response_bytes,
+    }
+
+
+async def main(args):
+    settings.UPSTREAM_FALLBACK = False
+    random.seed(args.seed)
+    async with local_app() as (client, _):
+        table = full_rate_table(args.currencies)
+        set_rate_matrix(table)
+        portfolio = random_portfolio(list(table), args.positions)
+        report = {
+            "positions": args.positions,
+            "core": core_timings(portfolio, args.repeat),
+            "endpoint": await endpoint_timings(client, portfolio, args.repeat, args.amount_calls),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--positions", type=int, default=10000)
+    parser.add_argument("--currencies", type=int, default=160)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--amount-calls", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,72 @@
+import asyncio
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from statistics import quantiles
+
+import uvicorn
+from fastapi import FastAPI
+
+RATES = {"USD": 1.0, "EUR": 0.9013, "GBP": 0.7679, "JPY": 144.52, "RUB": 79.5123, "CNY": 7.1834}
+
+
+def create_fake_upstream(latency: float = 0.0) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/v6/{api_key}/pair/{currency_from}/{currency_to}")
+    async def pair(api_key: str, currency_from: str, currency_to: str):
+        await asyncio.sleep(latency)
+        if currency_from not in RATES or currency_to not in RATES:
+            return {"result": "error", "error-type": "unsupported-code"}
+        return {
+            "result": "success",
+            "base_code": currency_from,
+            "target_code": currency_to,
+            "conversion_rate": RATES[currency_to] / RATES[currency_from]
+        }
+
+    @app.get("/v6/{api_key}/latest/{currency_from}")
+    async def latest(api_key: str, currency_from: str):
+        await asyncio.sleep(latency)
+        if currency_from not in RATES:
+            return {"result": "error", "error-type": "unsupported-code"}
+        base = RATES[currency_from]
+        return {
+            "result": "success",
+            "base_code": currency_from,
+            "conversion_rates": {code: rate / base for code, rate in RATES.items()}
+        }
+
+    return app
+
+
+@contextmanager
+def serve_fake_upstream(latency: float = 0.0):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        create_fake_upstream(latency), host="127.0.0.1", port=port, log_level="warning"
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}/v6/bench"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def latency_summary(samples: list[float]) -> dict:
+    # inclusive: the default method extrapolates past the largest sample on small runs
+    cuts = quantiles(samples, n=100, method="inclusive")
+    return {
+        "count": len(samples),
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
@@ -0,0 +1,62 @@
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from unittest.mock import patch
+
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from main import app
+from app.core.security import create_access_token, get_hashed_password
+from app.db.database import get_async_session
+from app.db.models import Base, User, CurrencyRate
+from app.services.rates import set_rate_matrix
+from benchmarks.fake_upstream import RATES
+
+BENCH_USER = "bench_user"
+BENCH_PASSWORD = "bench_password"
+
+
+@asynccontextmanager
+async def local_app(database_url: str | None = None):
+    """The API wired to a local database, with one user and the USD snapshot loaded."""
+    tmp_dir = None
+    if database_url is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        database_url = f"sqlite+aiosqlite:///{os.path.join(tmp_dir.name, 'bench.db')}"
+    engine = create_async_engine(database_url, poolclass=NullPool)
+    session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def get_bench_session():
+        async with session_maker() as session:
+            yield session
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with session_maker() as session:
+        user = User(username=BENCH_USER, email="bench@example.com", hash_password=get_hashed_password(BENCH_PASSWORD))
+        session.add(user)
+        session.add_all(
+            CurrencyRate(base_currency="USD", target_currency=code, rate=rate)
+            for code, rate in RATES.items() if code != "USD"
+        )
+        await session.commit()
+        token = await create_access_token({"sub": user.username, "uid": user.id, "email": user.email})
+    set_rate_matrix({code: rate for code, rate in RATES.items()})
+
+    app.dependency_overrides[get_async_session] = get_bench_session
+    # streaming exports open their own session instead of using the dependency
+    export_sessions = patch("app.services.currency.async_session_maker", session_maker)
+    export_sessions.start()
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+            client.headers["Authorization"] = f"Bearer {token}"
+            yield client, session_maker
+    finally:
+        export_sessions.stop()
+        app.dependency_overrides.pop(get_async_session, None)
+        await engine.dispose()
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
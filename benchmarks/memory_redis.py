@@ -0,0 +1,96 @@
+import time
+
+from app.core.quota import run_token_bucket
+
+
+class MemoryPipeline:
+    def __init__(self, redis: "MemoryRedis"):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((getattr(self.redis, name), args, kwargs))
+            return self
+        return command
+
+    async def execute(self):
+        commands, self.commands = self.commands, []
+        return [await method(*args, **kwargs) for method, args, kwargs in commands]
+
+
+class MemoryRedis:
+    """In-process stand-in for the async Redis commands the API uses, with expiry."""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    def _live(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    async def get(self, key):
+        return self._live(key)
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and self._live(key) is not None:
+            return None
+        self.data[key] = str(value)
+        self.expires.pop(key, None)
+        if ex or px:
+            self.expires[key] = time.monotonic() + (ex if ex else px / 1000)
+        return True
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    unlink = delete
+
+    async def expire(self, key, seconds, nx=False):
+        if self._live(key) is None or (nx and key in self.expires):
+            return False
+        self.expires[key] = time.monotonic() + seconds
+        return True
+
+    async def hget(self, key, field):
+        return (self._live(key) or {}).get(field)
+
+    async def hmget(self, key, fields):
+        row = self._live(key) or {}
+        return [row.get(field) for field in fields]
+
+    async def hgetall(self, key):
+        return dict(self._live(key) or {})
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        values = dict(mapping or {})
+        if field is not None:
+            values[field] = value
+        row = self._live(key)
+        if row is None:
+            row = self.data[key] = {}
+        row.update({name: str(item) for name, item in values.items()})
+        return len(values)
+
+    async def eval(self, script, numkeys, bucket_key, usage_key, *args):
+        # only the upstream quota script is run against Redis, see TOKEN_BUCKET_SCRIPT
+        bucket = self._live(bucket_key)
+        usage = self._live(usage_key)
+        if bucket is None:
+            bucket = self.data[bucket_key] = {}
+        if usage is None:
+            usage = self.data[usage_key] = {}
+        return run_token_bucket(bucket, usage, *args)
+
+    async def publish(self, channel, message):
+        return 0
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    async def aclose(self):
+        self.data.clear()
@@ -1,13 +1,63 @@
-from fastapi import FastAPI
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 import uvicorn
 
 from app.api.endpoints.users import users_router
-from app.api.endpoints.currency import currency_router
+from app.api.endpoints.currency import currency_router, currency_ws_router
+from app.api.endpoints.metrics import metrics_router
+from app.core.metrics import http_request_duration
+from app.services.rates import refresh_rate_matrix_periodically, listen_for_rate_updates
+from app.services.history_writer import flush_history_periodically
+from app.core.config import settings
+from app.utils.external_api import get_http_client, close_http_client
+from app.core.redis import close_redis
+from app.db.database import dispose_engine
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_http_client()
+    rate_matrix_refresher = asyncio.create_task(refresh_rate_matrix_periodically())
+    rate_update_listener = asyncio.create_task(listen_for_rate_updates())
+    history_flusher = None
+    if settings.HISTORY_WRITE_BEHIND:
+        history_flusher = asyncio.create_task(flush_history_periodically())
+    yield
+    if history_flusher is not None:
+        history_flusher.cancel()
+    rate_update_listener.cancel()
+    rate_matrix_refresher.cancel()
+    await close_http_client()
+    await close_redis()
+    await dispose_engine()
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # the route template, not the raw path, keeps the label set bounded
+        route = request.scope.get("route")
+        http_request_duration.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=status_code
+        )
 
 app.include_router(users_router)
 app.include_router(currency_router)
+app.include_router(currency_ws_router)
+app.include_router(metrics_router)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host='127.0.0.1', port=8000)
\ No newline at end of file
+    uvicorn.run(app, host='127.0.0.1', port=8000)
@@ -1,10 +1,19 @@
 from unittest.mock import patch
+import asyncio
 import csv
+from datetime import date
 from io import StringIO
 
+import pytest
+from fastapi import HTTPException, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
 
-from app.api.schemas.currency import DefinitelyCurrencyIn, DefinitelyCurrencyOut, CurrencyHistory
+from main import app
+
+from app.api.schemas.currency import DefinitelyCurrencyIn, DefinitelyCurrencyOut, CurrencyHistory, HistoryStatsOut
+from app.services.rates import set_rate_matrix
+from app.core.security import create_access_token
 
 url_services_for_patch = "app.api.endpoints.currency."
 
@@ -28,17 +37,11 @@ async def test_get_definitely_currency(client):
         }
 
 async def test_get_list_currencies(client):
-    mock_data = {
-        "currency_from": "USD",
-        "conversion_rates": {
-		"USD": 1,
-		"RUB": 79.512,
-		"EUR": 0.9013,
-		"GBP": 0.7679, }
-    }
-    with patch(f"{url_services_for_patch}list_currencies", return_value=mock_data):
+    mock_body = b'{"currency_from":"USD","conversion_rates":{"USD":1,"RUB":79.512,"EUR":0.9013,"GBP":0.7679}}'
+    with patch(f"{url_services_for_patch}list_currencies_body", return_value=mock_body):
         result = await client.get("/currency/list", params={"currency_from": "USD"})
         assert result.status_code == 200
+        assert result.headers["content-type"] == "application/json"
         result_json = result.json()
         assert result_json == {
             "currency_from": "USD",
@@ -49,6 +52,33 @@ async def test_get_list_currencies(client):
                 "GBP": 0.7679, }
         }
 
+async def test_get_pair_rates(client):
+    mock_data = [
+        DefinitelyCurrencyOut(currency_from="EUR", currency_to="USD", conversion_rate=1.08),
+        DefinitelyCurrencyOut(currency_from="GBP", currency_to="JPY", conversion_rate=199.4)
+    ]
+    with patch(f"{url_services_for_patch}pair_rates", return_value=mock_data) as mock:
+        result = await client.get("/currency/rates", params={"pairs": "EURUSD,GBPJPY"})
+        assert result.status_code == 200
+        assert result.json() == [
+            {"currency_from": "EUR", "currency_to": "USD", "conversion_rate": 1.08},
+            {"currency_from": "GBP", "currency_to": "JPY", "conversion_rate": 199.4}
+        ]
+        mock.assert_called_once_with("EURUSD,GBPJPY")
+
+async def test_get_rate_at(client):
+    mock_data = {
+        "currency_from": "EUR",
+        "currency_to": "JPY",
+        "conversion_rate": 157.6,
+        "snapshot_time": "2025-06-24T14:00:00Z"
+    }
+    with patch(f"{url_services_for_patch}rate_at", return_value=mock_data) as mock:
+        result = await client.get("/currency/rate-at", params={"from": "EUR", "to": "JPY", "ts": "2025-06-24T14:30:00"})
+        assert result.status_code == 200
+        assert result.json()["conversion_rate"] == 157.6
+        assert mock.call_args.args[1:3] == ("EUR", "JPY")
+
 async def test_get_amount_exchange(client):
     mock_data = {
         "currency_from": "USD",
@@ -70,6 +100,23 @@ async def test_get_amount_exchange(client):
             "converted_amount": 795.12
         }
 
+async def test_get_amount_exchange_batch(client):
+    mock_data = [
+        {"currency_from": "USD", "currency_to": "RUB", "converted_amount": 795.12},
+        {"currency_from": "EUR", "currency_to": "RUB", "converted_amount": 898.12},
+    ]
+    with patch(f"{url_services_for_patch}amount_exchange_batch", return_value=mock_data) as mock:
+        result = await client.post("/currency/amount/batch", json={"items": [
+            {"currency_from": "USD", "currency_to": "RUB", "amount": 10.0},
+            {"currency_from": "EUR", "currency_to": "RUB", "amount": 10.0},
+        ]})
+        assert result.status_code == 200
+        assert result.json() == mock_data
+        assert len(mock.call_args.args[0].items) == 2
+
+    result = await client.post("/currency/amount/batch", json={"items": []})
+    assert result.status_code == 422
+
 async def test_get_history_exchange(client):
     mock_data = [
         {
@@ -89,9 +136,12 @@ async def test_get_history_exchange(client):
             "exchange_time": "23.06.2025 16:40"
         }
     ]
-    with patch(f"{url_services_for_patch}history_of_user", return_value=mock_data):
-        result = await client.get("/currency/history")
+    with patch(f"{url_services_for_patch}history_page", return_value=(mock_data, "next-page")) as mock:
+        result = await client.get("/currency/history", params={"limit": 2, "currency_to": "RUB"})
         assert result.status_code == 200
+        assert result.headers["X-Next-Cursor"] == "next-page"
+        assert mock.call_args.args[2] == 2
+        assert mock.call_args.args[7] == "RUB"
         result_json = result.json()
         assert result_json == [
         {
@@ -146,4 +196,63 @@ async def test_get_history_export(client):
     with patch(f"{url_services_for_patch}export_history", return_value=mock_response) as mock:
         result = await client.get("/currency/history/export", params={"format": "csv"})
         assert result.status_code == 200
-        assert result.headers["Content-Disposition"] == "attachment; filename=conversion_history.csv"
\ No newline at end of file
+        assert result.headers["Content-Disposition"] == "attachment; filename=conversion_history.csv"
+async def test_get_portfolio_value(client):
+    set_rate_matrix({"EUR": 0.9, "RUB": 81.0})
+    data = {"currency_to": "rub", "positions": [{"currency": "EUR", "amount": 9}, {"currency": "usd", "amount": 2}]}
+    result = await client.post("/currency/portfolio/value", json=data)
+    assert result.status_code == 200
+    result_json = result.json()
+    assert result_json["currency_to"] == "RUB"
+    assert result_json["values"] == [810.0, 162.0]
+    assert result_json["total"] == 972.0
+
+    data["positions"].append({"currency": "XYZ", "amount": 1})
+    result = await client.post("/currency/portfolio/value", json=data)
+    assert result.status_code == 400
+    assert result.json()["detail"] == "unsupported-code: XYZ"
+
+async def test_get_history_stats(client):
+    mock_stats = [HistoryStatsOut(
+        base_currency="EUR", target_currency="RUB", conversions=2, amount_total=40,
+        converted_total=3610, avg_rate=90.0, min_rate=89.5, max_rate=90.5
+    )]
+    with patch(f"{url_services_for_patch}history_stats", return_value=mock_stats) as mock_history_stats:
+        result = await client.get("/currency/history/stats", params={"per_day": "false", "date_from": "2025-06-01"})
+    assert result.status_code == 200
+    assert result.json() == [{
+        "base_currency": "EUR", "target_currency": "RUB", "conversions": 2, "amount_total": 40.0,
+        "converted_total": 3610.0, "avg_rate": 90.0, "min_rate": 89.5, "max_rate": 90.5
+    }]
+    assert mock_history_stats.call_args.args[2:] == (date(2025, 6, 1), None, False)
+
+async def test_get_rate_stream_without_subscription(client):
+    token = await create_access_token({"sub": "test_user"})
+    result = await client.get("/currency/stream", headers={"Authorization": f"Bearer {token}"})
+    assert result.status_code == 400
+
+@patch("app.services.rate_stream.async_session_maker")
+@patch("app.services.rate_stream.get_current_user")
+def test_rate_stream_websocket(mock_get_current_user, mock_async_session_maker):
+    set_rate_matrix({"EUR": 0.9, "RUB": 81.0})
+    token = asyncio.run(create_access_token({"sub": "test_user"}))
+    # токен передаётся в Sec-WebSocket-Protocol, а не в URL
+    with TestClient(app).websocket_connect(
+        "/currency/stream/ws?pairs=EURRUB", subprotocols=["bearer", token]
+    ) as websocket:
+        assert websocket.accepted_subprotocol == "bearer"
+        message = websocket.receive_json()
+    assert message["type"] == "rates"
+    assert message["rates"] == {"EURRUB": pytest.approx(90.0)}
+    assert mock_get_current_user.call_args.args[0] == token
+
+@patch("app.services.rate_stream.async_session_maker")
+@patch("app.services.rate_stream.get_current_user", side_effect=HTTPException(status_code=401, detail="Invalid token"))
+def test_rate_stream_websocket_unauthorized(mock_get_current_user, mock_async_session_maker):
+    for subprotocols in (["bearer", "bad"], None):
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            with TestClient(app).websocket_connect(
+                "/currency/stream/ws?pairs=EURRUB", subprotocols=subprotocols
+            ) as websocket:
+                websocket.receive_json()
+        assert exc_info.value.code == 1008
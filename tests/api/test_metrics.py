@@ -0,0 +1,21 @@
+from unittest.mock import patch, AsyncMock
+
+from tests.mocks.redis import setup_redis_mock
+
+
+@patch("app.services.metrics.get_redis", new_callable=AsyncMock)
+async def test_get_metrics(mock_redis_client, client):
+    setup_redis_mock(mock_redis_client, {
+        "metrics:rates_refresh": {"fetch": "0.4"},
+        "quota:exchangerate-api:usage": {"api:granted": "3"}
+    })
+    with patch("app.api.endpoints.currency.get_cache_stats", return_value={}):
+        await client.get("/currency/cache/stats")
+
+    result = await client.get("/metrics")
+    assert result.status_code == 200
+    assert result.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/currency/cache/stats",status="200"}' in result.text
+    assert 'rates_refresh_stage_seconds{stage="fetch"} 0.4' in result.text
+    assert 'upstream_quota_requests_total{consumer="api",result="granted"} 3' in result.text
+    assert "upstream_quota_tokens " in result.text
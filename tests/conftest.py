@@ -9,10 +9,13 @@ from unittest.mock import AsyncMock, patch
 
 from main import app
 from app.api.schemas.users import UserOut
-from app.core.security import get_current_user
+from app.core.security import get_current_user, principal_cache
 from app.db.database import get_async_session
 from app.db.models import Base, User, ConversionHistory, CurrencyRate
 from app.core import redis as redis_module
+from app.services.rates import set_rate_matrix
+from app.core.cache import local_cache, cache_stats, revalidation_backoff
+from app.utils.external_api import upstream_breaker
 
 
 TEST_DATABASE_URL = "sqlite+aiosqlite:///./tests/test.db"
@@ -102,4 +105,23 @@ def mock_redis_client():
     with patch("app.core.redis.get_redis", new_callable=AsyncMock, return_value=mock_client):
         redis_module._redis = None
         yield mock_client
-        redis_module._redis = None
\ No newline at end of file
+        redis_module._redis = None
+
+@pytest.fixture(autouse=True)
+def reset_rate_matrix():
+    set_rate_matrix({})
+    yield
+    set_rate_matrix({})
+
+@pytest.fixture(autouse=True)
+def clear_local_cache():
+    local_cache.clear()
+    cache_stats.clear()
+    principal_cache.clear()
+    revalidation_backoff.clear()
+    upstream_breaker.record_success()
+    yield
+    local_cache.clear()
+    cache_stats.clear()
+    principal_cache.clear()
+    revalidation_backoff.clear()
@@ -0,0 +1,108 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.cache import single_flight, hash_field_get_or_load, jittered_ttl, TTLCache, revalidation_backoff
+
+from tests.mocks.redis import setup_redis_mock
+
+
+def test_jittered_ttl():
+    with patch("app.core.cache.settings.CACHE_TTL_JITTER", 0.1):
+        ttls = {jittered_ttl(3600) for _ in range(200)}
+    assert min(ttls) >= 3600
+    assert max(ttls) <= 3960
+    assert len(ttls) > 1
+
+async def test_single_flight_coalesces_concurrent_calls():
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return 42
+
+    results = await asyncio.gather(*(single_flight("USD->RUB", load) for _ in range(50)))
+    assert results == [42] * 50
+    assert calls == 1
+
+    assert await single_flight("USD->RUB", load) == 42
+    assert calls == 2
+
+def test_ttl_cache_expiry_and_lru():
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, timer=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    now[0] = 11
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+async def test_hash_field_get_or_load():
+    fake_redis = setup_redis_mock(AsyncMock(), {"rates:upstream:EUR:pairs": {"USD": "1.08"}})
+    load = AsyncMock(return_value=89.5)
+
+    assert await hash_field_get_or_load(fake_redis, "rates:upstream:EUR:pairs", "USD", load) == (1.08, None)
+    with patch("app.core.cache.jittered_ttl", return_value=3600), \
+            patch("app.core.cache.max_jittered_ttl", return_value=3960):
+        cached = await hash_field_get_or_load(fake_redis, "rates:upstream:EUR:pairs", "RUB", load)
+    assert cached.value == 89.5
+    rate, fetched_at, expires_at = fake_redis.store["rates:upstream:EUR:pairs"]["RUB"].split("|")
+    assert (rate, float(fetched_at)) == ("89.5", cached.fetched_at)
+    assert float(expires_at) == pytest.approx(cached.fetched_at + 3600, abs=1)
+    fake_redis.expire.assert_called_once_with("rates:upstream:EUR:pairs", 3960)
+    load.assert_called_once()
+
+async def test_hash_field_past_its_deadline_is_a_miss():
+    # поля одного хэша истекают каждое в свой срок
+    now = time.time()
+    fake_redis = setup_redis_mock(AsyncMock(), {"rates:upstream:EUR:pairs": {
+        "USD": f"1.08|{now - 100}|{now + 3500}", "RUB": f"88.0|{now - 4000}|{now - 400}"
+    }})
+    load = AsyncMock(return_value=89.5)
+
+    assert (await hash_field_get_or_load(fake_redis, "rates:upstream:EUR:pairs", "USD", load)).value == 1.08
+    assert (await hash_field_get_or_load(fake_redis, "rates:upstream:EUR:pairs", "RUB", load)).value == 89.5
+    load.assert_called_once()
+
+async def test_stale_value_served_while_revalidating():
+    fetched_at = time.time() - 3000
+    fake_redis = setup_redis_mock(AsyncMock(), {"rates:upstream:EUR:pairs": {"RUB": f"88.0|{fetched_at}"}})
+    load = AsyncMock(return_value=89.5)
+
+    with patch("app.core.cache.settings.CACHE_SOFT_TTL", 600):
+        cached = await hash_field_get_or_load(fake_redis, "rates:upstream:EUR:pairs", "RUB", load)
+        assert cached == (88.0, fetched_at)
+        await asyncio.sleep(0.01)
+        load.assert_called_once()
+
+        cached = await hash_field_get_or_load(fake_redis, "rates:upstream:EUR:pairs", "RUB", load)
+    assert cached.value == 89.5
+    assert not cached.is_stale()
+    assert fake_redis.store["rates:upstream:EUR:pairs"]["RUB"].startswith("89.5|")
+
+async def test_failed_revalidation_keeps_stale_value():
+    fetched_at = time.time() - 3000
+    fake_redis = setup_redis_mock(AsyncMock(), {"rates:upstream:EUR:pairs": {"RUB": f"88.0|{fetched_at}"}})
+    load = AsyncMock(side_effect=HTTPException(status_code=503, detail="upstream-unavailable"))
+
+    for _ in range(3):
+        cached = await hash_field_get_or_load(fake_redis, "rates:upstream:EUR:pairs", "RUB", load)
+        assert cached == (88.0, fetched_at)
+        await asyncio.sleep(0.01)
+    # после неудачи ключ не обновляется повторно, пока не пройдёт пауза
+    assert load.call_count == 1
+    assert "lock:rates:upstream:EUR:pairs:RUB" not in fake_redis.store
+
+    revalidation_backoff.clear()
+    await hash_field_get_or_load(fake_redis, "rates:upstream:EUR:pairs", "RUB", load)
+    await asyncio.sleep(0.01)
+    assert load.call_count == 2
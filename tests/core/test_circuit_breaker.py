@@ -0,0 +1,29 @@
+from app.core.circuit_breaker import CircuitBreaker
+
+
+def test_circuit_breaker_opens_and_recovers():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30, timer=lambda: now[0])
+
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    now[0] = 31
+    assert breaker.state == "half-open"
+    assert breaker.would_allow()
+    assert breaker.allow()
+    assert not breaker.would_allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] = 62
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
@@ -0,0 +1,55 @@
+import pytest
+from fastapi import HTTPException
+
+from app.core.cache import record_lookup
+from app.core.metrics import Histogram, Counter, upstream_timer, upstream_errors, render_metrics
+
+
+def test_histogram_render():
+    histogram = Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, route="/a")
+    histogram.observe(0.5, route="/a")
+    histogram.observe(3, route="/a")
+
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 3.55',
+        'latency_seconds_count{route="/a"} 3',
+    ]
+
+def test_counter_escapes_labels():
+    counter = Counter("errors_total", "Errors.", ("reason",))
+    counter.inc(reason='bad "quote"')
+    counter.inc(2, reason='bad "quote"')
+    assert counter.render()[-1] == 'errors_total{reason="bad \\"quote\\""} 3'
+
+def test_upstream_timer_counts_errors():
+    with pytest.raises(HTTPException):
+        with upstream_timer("pair"):
+            raise HTTPException(status_code=400, detail="quota-reached")
+    with pytest.raises(TimeoutError):
+        with upstream_timer("pair"):
+            raise TimeoutError()
+
+    assert upstream_errors._values[("pair", "quota-reached")] >= 1
+    assert upstream_errors._values[("pair", "TimeoutError")] >= 1
+
+def test_render_metrics():
+    record_lookup("matrix", True)
+    record_lookup("matrix", True)
+    record_lookup("matrix", False)
+
+    text = render_metrics(
+        {"size": 5, "checked_out": 2, "idle": 3, "overflow": 0},
+        {"fetch": "0.25", "persist": "0.125", "finished_at": "1750845120.0"}
+    )
+    assert 'cache_lookups_total{tier="matrix",result="hit"} 2' in text
+    assert 'cache_hit_ratio{tier="matrix"} 0.6666666666666666' in text
+    assert 'db_pool_connections{state="checked_out"} 2' in text
+    assert 'rates_refresh_stage_seconds{stage="fetch"} 0.25' in text
+    assert "rates_refresh_last_success_timestamp_seconds 1750845120" in text
+    assert text.endswith("\n")
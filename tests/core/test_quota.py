@@ -0,0 +1,36 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from app.core.quota import acquire_upstream_quota, quota_status, UpstreamQuotaExhausted
+from tests.mocks.redis import setup_redis_mock
+
+
+@patch("app.core.quota.settings.UPSTREAM_QUOTA_RESERVE", 2)
+@patch("app.core.quota.settings.UPSTREAM_QUOTA_BURST", 5)
+@patch("app.core.quota.settings.UPSTREAM_QUOTA_PER_DAY", 86400)
+async def test_upstream_quota_keeps_reserve_for_worker():
+    redis = setup_redis_mock(MagicMock(), {})
+    with patch("app.core.quota.time.time", return_value=1000.0):
+        for _ in range(3):
+            await acquire_upstream_quota(redis)
+        with pytest.raises(UpstreamQuotaExhausted):
+            await acquire_upstream_quota(redis)
+        # the refresh task may spend the reserve
+        await acquire_upstream_quota(redis, cost=2, consumer="worker")
+        with pytest.raises(UpstreamQuotaExhausted):
+            await acquire_upstream_quota(redis, consumer="worker")
+        status = await quota_status(redis)
+    assert status == {"tokens": 0, "usage": {"api:granted": 3, "api:denied": 1, "worker:granted": 2, "worker:denied": 1}}
+
+    # one token per second comes back
+    with patch("app.core.quota.time.time", return_value=1003.0):
+        await acquire_upstream_quota(redis)
+        assert (await quota_status(redis))["tokens"] == 2
+
+
+async def test_upstream_quota_lets_requests_through_without_redis():
+    redis = setup_redis_mock(MagicMock(), {})
+    redis.eval.side_effect = ConnectionError()
+    await acquire_upstream_quota(redis)
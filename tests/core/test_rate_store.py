@@ -0,0 +1,63 @@
+from unittest.mock import AsyncMock, MagicMock, call, patch
+
+from app.core.rate_store import (write_rate_tables, read_rate, read_rate_table, migrate_legacy_rate_keys,
+                                 RATES_VERSION_KEY)
+
+from tests.mocks.redis import setup_redis_mock
+
+
+def test_write_rate_tables_flips_version_and_drops_old_one():
+    redis = MagicMock()
+    redis.get.return_value = "1"
+    batch, flip = MagicMock(), MagicMock()
+    redis.pipeline.side_effect = [batch, flip]
+
+    write_rate_tables(redis, {"USD": 1.0, "EUR": 0.5}, 2, 7200)
+
+    assert redis.pipeline.call_args_list == [call(transaction=False), call(transaction=True)]
+    batch.hset.assert_any_call("rates:v2:USD", mapping={"USD": 1.0, "EUR": 0.5})
+    batch.hset.assert_any_call("rates:v2:EUR", mapping={"USD": 2.0, "EUR": 1.0})
+    batch.expire.assert_any_call("rates:v2:EUR", 7200)
+    batch.execute.assert_called_once()
+    flip.set.assert_called_once_with(RATES_VERSION_KEY, 2, ex=7200)
+    flip.unlink.assert_called_once_with("rates:v1:USD", "rates:v1:EUR")
+    flip.execute.assert_called_once()
+
+async def test_read_rate_follows_version_pointer():
+    fake_redis = setup_redis_mock(AsyncMock(), {
+        RATES_VERSION_KEY: "2",
+        "rates:v1:EUR": {"RUB": "80.0"},
+        "rates:v2:EUR": {"RUB": "90.0", "USD": "1.1"},
+    })
+
+    assert await read_rate(fake_redis, "EUR", "RUB") == (90.0, 0.000002)
+    assert await read_rate(fake_redis, "EUR", "JPY") is None
+    assert (await read_rate_table(fake_redis, "EUR")).value == {"RUB": 90.0, "USD": 1.1}
+    assert await read_rate_table(fake_redis, "GBP") is None
+    assert fake_redis.get.call_count == 1
+
+async def test_read_rate_without_warm_cache():
+    fake_redis = setup_redis_mock(AsyncMock(), {})
+
+    assert await read_rate(fake_redis, "EUR", "RUB") is None
+    fake_redis.hget.assert_not_called()
+
+def test_migrate_legacy_rate_keys():
+    redis = MagicMock()
+    legacy = {"EUR->RUB": "89.5", "USD->conversion_rates": '{"RUB": 79.5}', "lock:EUR->GBP": "token"}
+    redis.scan_iter.return_value = list(legacy)
+    redis.get.side_effect = legacy.get
+    redis.ttl.return_value = 1200
+    redis.exists.return_value = 0
+    pipes = [MagicMock(), MagicMock()]
+    redis.pipeline.side_effect = pipes
+
+    with patch("app.core.rate_store.time.time", return_value=1000.0), \
+            patch("app.core.rate_store.max_jittered_ttl", return_value=3960):
+        assert migrate_legacy_rate_keys(redis) == 2
+
+    pipes[0].hsetnx.assert_called_once_with("rates:upstream:EUR:pairs", "RUB", "89.5||2200.0")
+    pipes[0].expire.assert_called_once_with("rates:upstream:EUR:pairs", 3960)
+    pipes[0].delete.assert_called_once_with("EUR->RUB")
+    pipes[1].hset.assert_called_once_with("rates:upstream:USD", mapping={"RUB": 79.5})
+    pipes[1].delete.assert_called_once_with("USD->conversion_rates")
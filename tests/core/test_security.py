@@ -1,13 +1,18 @@
 import jwt
 import pytest
 from fastapi import HTTPException
-from unittest.mock import patch
+from unittest.mock import patch, AsyncMock
 
 from app.db.models import User
 from app.api.schemas.users import UserOut
+from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
 from app.core.security import (get_hashed_password, verify_password, SECRET_KEY, ALGORITHM,
-                               create_access_token, get_user_from_db, authenticate_user, get_current_user
+                               create_access_token, get_user_from_db, authenticate_user, get_current_user,
+                               pwd_context
 )
+from tests.conftest import test_engine
 
 def test_get_hashed_password():
     password = "test_password123"
@@ -42,6 +47,30 @@ async def test_authenticate_user(override_get_async_session):
         assert exc_info.value.status_code == 401
         assert exc_info.value.detail == "Invalid username or password"
 
+async def test_authenticate_user_rehashes_on_cost_change(override_get_async_session):
+    user = await get_user_from_db("test_user", override_get_async_session)
+    user.hash_password = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("secret")
+    await override_get_async_session.commit()
+
+    result = await authenticate_user("test_user", "secret", override_get_async_session)
+    assert result.hash_password.startswith(f"$2b${pwd_context.to_dict()['bcrypt__rounds']}$")
+    assert verify_password("secret", result.hash_password)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await authenticate_user("test_user", "wrong", override_get_async_session)
+    assert exc_info.value.status_code == 401
+
+async def test_authenticate_user_rehash_with_expire_on_commit(override_get_async_session):
+    user = await get_user_from_db("test_user", override_get_async_session)
+    user.hash_password = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("secret")
+    await override_get_async_session.commit()
+
+    # как в проде: async_sessionmaker по умолчанию сбрасывает объекты после commit
+    session_maker = async_sessionmaker(test_engine, class_=AsyncSession)
+    async with session_maker() as db:
+        result = await authenticate_user("test_user", "secret", db)
+        assert (result.id, result.username, result.email) == (1, "test_user", "testuser@test.com")
+
 async def test_create_access_token():
     token = await create_access_token(data={"sub": "test_user"})
     token_decode = jwt.decode(token, key=SECRET_KEY, algorithms=[ALGORITHM])
@@ -53,6 +82,7 @@ async def test_get_current_user_valid_token(override_get_async_session):
     token = await create_access_token(data={"sub": "test_user"})
     result = await get_current_user(token, override_get_async_session)
     assert isinstance(result, UserOut)
+    assert result.id == 1
     assert result.username == "test_user"
     assert result.email == "testuser@test.com"
 
@@ -65,4 +95,15 @@ async def test_get_current_user_invalid_token(override_get_async_session):
     with pytest.raises(HTTPException) as exc_info:
         await get_current_user(token="Invalid_token", db=override_get_async_session)
     assert exc_info.value.status_code == 401
-    assert exc_info.value.detail == "Invalid Token"
\ No newline at end of file
+    assert exc_info.value.detail == "Invalid Token"
+
+async def test_get_current_user_from_claims():
+    token = await create_access_token(data={"sub": "test_user", "uid": 7, "email": "claims@test.com"})
+    db = AsyncMock()
+    result = await get_current_user(token, db)
+    assert result == UserOut(id=7, username="test_user", email="claims@test.com")
+    db.execute.assert_not_called()
+
+    with patch("app.core.security.jwt.decode") as mock_decode:
+        assert await get_current_user(token, db) is result
+        mock_decode.assert_not_called()
@@ -1,9 +1,12 @@
+import asyncio
+
 import respx
 from httpx import Response, RequestError
 from fastapi import HTTPException
 import pytest
 
-from app.utils.external_api import get_exchange_rate, get_supported_currencies
+from app.utils.external_api import (get_exchange_rate, get_supported_currencies, get_http_client, close_http_client,
+                                   upstream_breaker, upstream_call)
 from app.core.config import settings
 
 API_KEY = settings.API_KEY
@@ -48,6 +51,31 @@ async def test_get_exchange_rate_errors(side_effect, mock_response, expected_det
     assert exc_info.value.status_code == 400
     assert exc_info.value.detail == expected_details
 
+@respx.mock
+async def test_circuit_breaker_stops_upstream_calls():
+    route = respx.get(f"{BASE_URL}/pair/USD/RUB").mock(side_effect=RequestError("Connection time out"))
+    for _ in range(upstream_breaker.failure_threshold):
+        with pytest.raises(HTTPException) as exc_info:
+            await get_exchange_rate("USD", "RUB")
+        assert exc_info.value.status_code == 400
+
+    with pytest.raises(HTTPException) as exc_info:
+        await get_exchange_rate("USD", "RUB")
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.detail == "upstream-unavailable"
+    assert route.call_count == upstream_breaker.failure_threshold
+
+@respx.mock
+async def test_api_errors_keep_circuit_closed():
+    respx.get(f"{BASE_URL}/pair/ZXC/QWE").mock(
+        return_value=Response(200, json={"result": "error", "error-type": "unsupported-code"})
+    )
+    for _ in range(upstream_breaker.failure_threshold + 1):
+        with pytest.raises(HTTPException) as exc_info:
+            await get_exchange_rate("ZXC", "QWE")
+        assert exc_info.value.detail == "unsupported-code"
+    assert upstream_breaker.state == "closed"
+
 @respx.mock
 async def test_get_supported_currencies_success():
     fake_response = {
@@ -100,4 +128,23 @@ async def test_get_supported_errors(side_effect, mock_response, expected_details
             await get_supported_currencies("QWE")
 
     assert exc_info.value.status_code ==  400
-    assert exc_info.value.detail == expected_details
\ No newline at end of file
+    assert exc_info.value.detail == expected_details
+
+async def test_http_client_is_shared():
+    client = get_http_client()
+    assert get_http_client() is client
+    await close_http_client()
+    assert client.is_closed
+    assert get_http_client() is not client
+    await close_http_client()
+
+def test_cancelled_upstream_call_is_not_a_failure():
+    for _ in range(upstream_breaker.failure_threshold):
+        upstream_breaker.record_failure()
+    upstream_breaker.opened_at -= upstream_breaker.reset_timeout
+    # клиент отключился во время пробного запроса: цепь остаётся полуоткрытой
+    with pytest.raises(asyncio.CancelledError):
+        with upstream_call("latest"):
+            raise asyncio.CancelledError()
+    assert upstream_breaker.state == "half-open"
+    assert upstream_breaker.allow()
@@ -1,4 +1,29 @@
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock
+
+from app.core.quota import run_token_bucket
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+    async def execute(self):
+        commands, self.commands = self.commands, []
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+
+def token_bucket_eval(store: dict):
+    def eval_script(script, numkeys, bucket_key, usage_key, *args):
+        return run_token_bucket(store.setdefault(bucket_key, {}), store.setdefault(usage_key, {}), *args)
+    return eval_script
+
 
 def setup_redis_mock(mock_redis_client, key_values: dict):
     store = key_values.copy()
@@ -6,14 +31,66 @@ def setup_redis_mock(mock_redis_client, key_values: dict):
     async def get_side_effect(key):
         return store.get(key, None)
 
-    async def set_side_effect(key: str, value, *args, **kwargs):
+    async def set_side_effect(key: str, value, *args, nx: bool = False, **kwargs):
+        if nx and key in store:
+            return None
         store[key] = value
         return True
 
+    async def delete_side_effect(*keys):
+        return sum(store.pop(key, None) is not None for key in keys)
+
+    async def hget_side_effect(key, field):
+        return store.get(key, {}).get(field)
+
+    async def hgetall_side_effect(key):
+        return dict(store.get(key, {}))
+
+    async def hmget_side_effect(key, fields):
+        return [store.get(key, {}).get(field) for field in fields]
+
+    async def hset_side_effect(key, field=None, value=None, mapping=None):
+        values = dict(mapping or {})
+        if field is not None:
+            values[field] = value
+        store.setdefault(key, {}).update({k: str(v) for k, v in values.items()})
+        return len(values)
+
+    async def expire_side_effect(key, *args, **kwargs):
+        return key in store
+
+    async def hdel_side_effect(key, *fields):
+        return sum(store.get(key, {}).pop(field, None) is not None for field in fields)
+
+    async def xadd_side_effect(key, fields, *args, **kwargs):
+        entries = store.setdefault(key, [])
+        entry_id = f"{len(entries) + 1}-0"
+        entries.append((entry_id, {name: str(value) for name, value in fields.items()}))
+        return entry_id
+
+    async def xlen_side_effect(key):
+        return len(store.get(key, []))
+
+    eval_script = token_bucket_eval(store)
+
+    async def eval_side_effect(*args):
+        return eval_script(*args)
+
     fake_redis = AsyncMock()
     fake_redis.get.side_effect = get_side_effect
     fake_redis.set.side_effect = set_side_effect
+    fake_redis.delete.side_effect = delete_side_effect
+    fake_redis.hget.side_effect = hget_side_effect
+    fake_redis.hgetall.side_effect = hgetall_side_effect
+    fake_redis.hmget.side_effect = hmget_side_effect
+    fake_redis.hset.side_effect = hset_side_effect
+    fake_redis.expire.side_effect = expire_side_effect
+    fake_redis.eval.side_effect = eval_side_effect
+    fake_redis.hdel.side_effect = hdel_side_effect
+    fake_redis.xadd.side_effect = xadd_side_effect
+    fake_redis.xlen.side_effect = xlen_side_effect
+    fake_redis.pipeline = MagicMock(side_effect=lambda *args, **kwargs: FakePipeline(fake_redis))
+    fake_redis.store = store
 
     mock_redis_client.return_value = fake_redis
     return fake_redis
-
@@ -1,13 +1,29 @@
 from io import StringIO
+from datetime import date, datetime, timezone
+import asyncio
 import csv
+import gzip
+import json
+import time
 
+import pytest
+from fastapi import HTTPException
 from unittest.mock import AsyncMock, patch
 from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 
-from app.api.schemas.currency import AmountExchange, DefinitelyCurrencyOut, CurrencyHistory
-from app.services.currency import definitely_currency, list_currencies, amount_exchange, export_history, history_of_user
+from app.api.schemas.currency import AmountExchange, DefinitelyCurrencyOut, AmountExchangeBatchIn
+from app.db.models import ConversionHistory, ConversionHistoryArchive, RateSnapshot
+from app.services.currency import (definitely_currency, list_currencies, amount_exchange, amount_exchange_batch,
+                                   export_history, history_of_user, history_page, rate_at, pair_rates,
+                                   history_stats, history_tables)
+from app.services.rates import set_rate_matrix
+from app.services.rollups import rollup_rows
+from app.utils.external_api import upstream_breaker
 from app.api.schemas.currency import DefinitelyCurrencyIn
 
+from tests.conftest import test_async_session_maker as session_maker_for_tests
+from app.core.cache import encode_rate
 from tests.mocks.redis import setup_redis_mock
 
 @patch("app.services.currency.get_redis", new_callable=AsyncMock)
@@ -28,6 +44,30 @@ async def test_definitely_currency(mock_get_exchange_rate, mock_redis_client):
     assert result2.conversion_rate == 89.5003
     assert mock_get_exchange_rate.call_count == 1
 
+@patch("app.services.currency.get_redis", new_callable=AsyncMock)
+@patch("app.services.currency.get_exchange_rate", new_callable=AsyncMock)
+async def test_definitely_currency_concurrent_misses(mock_get_exchange_rate, mock_redis_client):
+    setup_redis_mock(mock_redis_client, {})
+
+    async def slow_exchange_rate(**kwargs):
+        await asyncio.sleep(0.01)
+        return {"conversion_rate": 89.5003}
+
+    mock_get_exchange_rate.side_effect = slow_exchange_rate
+    data = DefinitelyCurrencyIn(currency_from="EUR", currency_to="RUB")
+    results = await asyncio.gather(*(definitely_currency(data) for _ in range(20)))
+    assert {r.conversion_rate for r in results} == {89.5003}
+    assert mock_get_exchange_rate.call_count == 1
+
+@patch("app.services.currency.get_redis", new_callable=AsyncMock)
+@patch("app.services.currency.get_exchange_rate", new_callable=AsyncMock)
+async def test_definitely_currency_from_warm_cache(mock_get_exchange_rate, mock_redis_client):
+    setup_redis_mock(mock_redis_client, {"rates:version": "7", "rates:v7:EUR": {"RUB": "89.5"}})
+
+    result = await definitely_currency(DefinitelyCurrencyIn(currency_from="eur", currency_to="rub"))
+    assert result.conversion_rate == 89.5
+    mock_get_exchange_rate.assert_not_called()
+
 @patch("app.services.currency.get_redis", new_callable=AsyncMock)
 @patch("app.services.currency.get_supported_currencies", new_callable=AsyncMock)
 async def test_list_currencies(mock_get_supported_currencies, mock_redis_client):
@@ -45,6 +85,78 @@ async def test_list_currencies(mock_get_supported_currencies, mock_redis_client)
     assert "conversion_rates" in result2.model_dump()
     assert mock_get_supported_currencies.call_count == 1
 
+@patch("app.services.currency.get_redis", new_callable=AsyncMock)
+@patch("app.services.currency.get_supported_currencies", new_callable=AsyncMock)
+async def test_list_currencies_stored_as_hash(mock_get_supported_currencies, mock_redis_client):
+    fake_redis = setup_redis_mock(mock_redis_client, {"GBP->conversion_rates": '{"JPY": 199.4}'})
+    mock_get_supported_currencies.return_value = {"currency_from": "EUR", "conversion_rates": {"RUB": 89.5}}
+
+    result = await list_currencies(currency_from="EUR")
+    assert result.conversion_rates == {"RUB": 89.5}
+    assert fake_redis.store["rates:upstream:EUR"].keys() == {"RUB", "@fetched_at"}
+    assert fake_redis.store["rates:upstream:EUR"]["RUB"] == "89.5"
+    assert result.as_of is not None
+
+    # ключи старого формата читаются, пока не истекут
+    result = await list_currencies(currency_from="GBP")
+    assert result.conversion_rates == {"JPY": 199.4}
+    assert fake_redis.store["rates:upstream:GBP"]["JPY"] == "199.4"
+    assert mock_get_supported_currencies.call_count == 1
+
+@patch("app.services.currency.get_redis", new_callable=AsyncMock)
+@patch("app.services.currency.get_exchange_rate", new_callable=AsyncMock)
+async def test_pair_rates(mock_get_exchange_rate, mock_redis_client):
+    set_rate_matrix({"EUR": 0.9})
+    fake_redis = setup_redis_mock(mock_redis_client, {
+        "rates:version": "7",
+        "rates:v7:GBP": {"JPY": "199.4"},
+        "rates:upstream:CHF": {"SEK": "11.9"},
+    })
+    mock_get_exchange_rate.return_value = {"conversion_rate": 0.0061}
+
+    result = await pair_rates("EURUSD, gbpjpy,CHFSEK,JPYCHF,EURUSD")
+    assert [(r.currency_from, r.currency_to) for r in result] == [
+        ("EUR", "USD"), ("GBP", "JPY"), ("CHF", "SEK"), ("JPY", "CHF"), ("EUR", "USD")
+    ]
+    assert [r.conversion_rate for r in result] == [pytest.approx(1 / 0.9), 199.4, 11.9, 0.0061, pytest.approx(1 / 0.9)]
+    assert fake_redis.pipeline.call_count == 2
+    mock_get_exchange_rate.assert_called_once_with(currency_from="JPY", currency_to="CHF")
+    assert fake_redis.store["rates:upstream:JPY:pairs"]["CHF"].startswith("0.0061|")
+
+@pytest.mark.parametrize("pairs", ["EURUS", "EUR-USD", "", ",".join(["EURUSD"] * 101)])
+async def test_pair_rates_invalid(pairs):
+    with pytest.raises(HTTPException) as exc_info:
+        await pair_rates(pairs)
+    assert exc_info.value.status_code == 400
+
+async def test_rate_at(override_get_async_session):
+    session = override_get_async_session
+    for taken_at, eur, jpy in [
+        (datetime(2025, 6, 24, 13, 0), 0.90, 144.0),
+        (datetime(2025, 6, 24, 14, 0), 0.92, 145.0),
+        (datetime(2025, 6, 24, 15, 0), 0.95, 146.0),
+    ]:
+        session.add_all([
+            RateSnapshot(base_currency="USD", target_currency="EUR", rate=eur, taken_at=taken_at),
+            RateSnapshot(base_currency="USD", target_currency="JPY", rate=jpy, taken_at=taken_at),
+        ])
+    await session.commit()
+
+    result = await rate_at(session, "eur", "jpy", datetime(2025, 6, 24, 14, 30))
+    assert result.currency_from == "EUR"
+    assert result.conversion_rate == pytest.approx(145.0 / 0.92)
+    assert result.snapshot_time.replace(tzinfo=None) == datetime(2025, 6, 24, 14, 0)
+
+    result = await rate_at(session, "USD", "EUR", datetime(2025, 6, 24, 15, 0))
+    assert result.conversion_rate == 0.95
+
+    result = await rate_at(session, "JPY", "USD", datetime(2025, 6, 25))
+    assert result.conversion_rate == pytest.approx(1 / 146.0)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await rate_at(session, "EUR", "JPY", datetime(2025, 6, 24, 12, 59))
+    assert exc_info.value.status_code == 404
+
 @patch("app.services.currency.definitely_currency", new_callable=AsyncMock)
 async def test_amount_exchange(mock_definitely_currency, create_test_db, override_get_current_user, override_get_async_session):
     current_user = override_get_current_user
@@ -54,15 +166,45 @@ async def test_amount_exchange(mock_definitely_currency, create_test_db, overrid
         conversion_rate=89.5
     )
     exchange = AmountExchange(currency_from="EUR", currency_to="RUB", amount=10)
-    result = await amount_exchange(exchange, current_user, override_get_async_session)
+    result = await amount_exchange(exchange, current_user.id, override_get_async_session)
     assert result.currency_from == "EUR"
     assert result.currency_to == "RUB"
     assert result.converted_amount == 10 * 89.5
     assert mock_definitely_currency.call_count == 1
 
+@patch("app.services.currency.definitely_currency", new_callable=AsyncMock)
+async def test_amount_exchange_batch(mock_definitely_currency, override_get_current_user, override_get_async_session):
+    rates = {("EUR", "RUB"): 89.5, ("USD", "RUB"): 79.5}
+
+    async def definitely_currency_side_effect(current_currency):
+        pair = (current_currency.currency_from, current_currency.currency_to)
+        return DefinitelyCurrencyOut(currency_from=pair[0], currency_to=pair[1], conversion_rate=rates[pair])
+
+    mock_definitely_currency.side_effect = definitely_currency_side_effect
+    batch = AmountExchangeBatchIn(items=[
+        AmountExchange(currency_from="EUR", currency_to="RUB", amount=10),
+        AmountExchange(currency_from="usd", currency_to="rub", amount=20),
+        AmountExchange(currency_from="EUR", currency_to="RUB", amount=30),
+    ])
+    result = await amount_exchange_batch(batch, override_get_current_user.id, override_get_async_session)
+    assert [(r.currency_from, r.currency_to, r.converted_amount) for r in result] == [
+        ("EUR", "RUB", 10 * 89.5),
+        ("USD", "RUB", 20 * 79.5),
+        ("EUR", "RUB", 30 * 89.5),
+    ]
+    assert mock_definitely_currency.call_count == 2
+
+    res = await override_get_async_session.execute(
+        select(ConversionHistory.base_currency, ConversionHistory.amount, ConversionHistory.exchange_time)
+        .where(ConversionHistory.exchange_time > datetime(2025, 7, 1))
+    )
+    rows = res.all()
+    assert sorted((r.base_currency, r.amount) for r in rows) == [("EUR", 10), ("EUR", 30), ("USD", 20)]
+    assert len({r.exchange_time for r in rows}) == 1
+
 async def test_history_exchange(create_test_db, override_get_current_user, override_get_async_session):
     async with override_get_async_session as session:
-        result = await history_of_user(session, override_get_current_user)
+        result = await history_of_user(session, override_get_current_user.id)
     assert len(result) == 2
     history1, history2 = result
     assert history1.base_currency == "EUR"
@@ -79,28 +221,46 @@ async def test_history_exchange(create_test_db, override_get_current_user, overr
     assert history2.rate == 79.5
     assert history2.exchange_time == "23.06.2025 16:40"
 
-@patch("app.services.currency.history_of_user")
-async def test_history_export(mock_history_of_user, create_test_db, override_get_current_user, override_get_async_session):
-    mock_history_of_user.return_value = [
-        CurrencyHistory(
-            base_currency="EUR",
-            target_currency="RUB",
-            rate=89.8,
-            amount=100,
-            converted_amount=8980,
-            exchange_time="24.06.2025 11:40"
-        ),
-        CurrencyHistory(base_currency="USD",
-            target_currency="RUB",
-            amount=10,
-            converted_amount=795,
-            rate=79.5,
-            exchange_time="23.06.2025 16:40",
-        )
+async def test_history_page(override_get_current_user, override_get_async_session):
+    session = override_get_async_session
+    session.add_all([
+        ConversionHistory(user_id=1, base_currency="USD", target_currency="EUR", amount=1, converted_amount=0.9,
+                          rate=0.9, exchange_time=datetime(2025, 6, 24, 11, 40, 0)),
+        ConversionHistory(user_id=1, base_currency="GBP", target_currency="RUB", amount=1, converted_amount=100,
+                          rate=100, exchange_time=datetime(2025, 6, 25, 8, 0, 0)),
+    ])
+    await session.commit()
+
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = await history_page(session, override_get_current_user.id, limit=2, cursor=cursor)
+        assert len(page) <= 2
+        seen.extend((h.base_currency, h.target_currency, h.exchange_time) for h in page)
+        if cursor is None:
+            break
+    assert seen == [
+        ("GBP", "RUB", "25.06.2025 08:00"),
+        ("EUR", "RUB", "24.06.2025 11:40"),
+        ("USD", "EUR", "24.06.2025 11:40"),
+        ("USD", "RUB", "23.06.2025 16:40"),
     ]
 
-    result = await export_history(format="csv", db=override_get_async_session, curr_user=override_get_current_user)
+    page, cursor = await history_page(
+        session, override_get_current_user.id, currency_to="rub", date_from=datetime(2025, 6, 24)
+    )
+    assert [(h.base_currency, h.target_currency) for h in page] == [("GBP", "RUB"), ("EUR", "RUB")]
+    assert cursor is None
+
+    with pytest.raises(HTTPException) as exc_info:
+        await history_page(session, override_get_current_user.id, cursor="not-a-cursor")
+    assert exc_info.value.status_code == 400
+
+@patch("app.services.currency.async_session_maker", session_maker_for_tests)
+async def test_history_export(create_test_db, override_get_current_user):
+    result = await export_history(format="csv", user_id=override_get_current_user.id)
     assert isinstance(result, StreamingResponse)
+    assert result.headers["Content-Disposition"] == "attachment; filename=conversion_history.csv"
 
     data = []
     async for ch in result.body_iterator:
@@ -110,4 +270,116 @@ async def test_history_export(mock_history_of_user, create_test_db, override_get
     rows = list(csv_data)
     assert rows[0] == ["Currency From", "Currency To", "Rate", "Amount", "Converted amount", "Exchange Time"]
     assert rows[1] == ["EUR", "RUB", "89.8", "100.0", "8980.0", "24.06.2025 11:40"]
-    assert rows[2] == ["USD", "RUB", "79.5", "10.0", "795.0", "23.06.2025 16:40"]
\ No newline at end of file
+    assert rows[2] == ["USD", "RUB", "79.5", "10.0", "795.0", "23.06.2025 16:40"]
+
+@patch("app.services.currency.async_session_maker", session_maker_for_tests)
+@patch("app.services.currency.EXPORT_CHUNK_ROWS", 1)
+async def test_history_export_ndjson_gzip(override_get_current_user):
+    result = await export_history("ndjson", override_get_current_user.id, compress=True)
+    assert result.media_type == "application/gzip"
+    assert result.headers["Content-Disposition"] == "attachment; filename=conversion_history.ndjson.gz"
+
+    chunks = [ch async for ch in result.body_iterator]
+    lines = gzip.decompress(b"".join(chunks)).decode().splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"base_currency": "EUR", "target_currency": "RUB", "rate": 89.8, "amount": 100.0,
+         "converted_amount": 8980.0, "exchange_time": "24.06.2025 11:40"},
+        {"base_currency": "USD", "target_currency": "RUB", "rate": 79.5, "amount": 10.0,
+         "converted_amount": 795.0, "exchange_time": "23.06.2025 16:40"},
+    ]
+
+async def test_history_export_invalid_format(override_get_current_user):
+    with pytest.raises(HTTPException) as exc_info:
+        await export_history("xlsx", override_get_current_user.id)
+    assert exc_info.value.status_code == 403
+
+@patch("app.services.currency.get_redis", new_callable=AsyncMock)
+@patch("app.services.currency.get_exchange_rate", new_callable=AsyncMock)
+async def test_definitely_currency_quota_exhausted(mock_get_exchange_rate, mock_redis_client):
+    # квота исчерпана: курс считается через USD из того, что уже есть в Redis
+    fetched_at = time.time()
+    setup_redis_mock(mock_redis_client, {
+        "quota:exchangerate-api": {"tokens": "0", "ts": str(fetched_at)},
+        "rates:upstream:USD:pairs": {"EUR": encode_rate(0.9, fetched_at), "JPY": encode_rate(144.0, fetched_at)}
+    })
+
+    result = await definitely_currency(DefinitelyCurrencyIn(currency_from="EUR", currency_to="JPY"))
+    assert result.conversion_rate == pytest.approx(160.0)
+    with pytest.raises(HTTPException) as exc:
+        await definitely_currency(DefinitelyCurrencyIn(currency_from="EUR", currency_to="GBP"))
+    assert exc.value.status_code == 503
+    mock_get_exchange_rate.assert_not_called()
+
+@patch("app.services.currency.get_redis", new_callable=AsyncMock)
+@patch("app.services.currency.get_exchange_rate", new_callable=AsyncMock)
+async def test_definitely_currency_circuit_open_spends_no_quota(mock_get_exchange_rate, mock_redis_client):
+    fake_redis = setup_redis_mock(mock_redis_client, {})
+    for _ in range(upstream_breaker.failure_threshold):
+        upstream_breaker.record_failure()
+
+    with pytest.raises(HTTPException) as exc:
+        await definitely_currency(DefinitelyCurrencyIn(currency_from="EUR", currency_to="GBP"))
+    assert exc.value.status_code == 503
+    assert "quota:exchangerate-api:usage" not in fake_redis.store
+    mock_get_exchange_rate.assert_not_called()
+
+def test_rollup_rows_sorted_by_key():
+    # порядок строк не зависит от порядка в запросе: одинаковый порядок блокировок в PostgreSQL
+    row = {"user_id": 1, "amount": 1.0, "converted_amount": 1.0, "rate": 1.0}
+    rows = rollup_rows([
+        {**row, "base_currency": "USD", "target_currency": "RUB", "exchange_time": datetime(2025, 6, 24)},
+        {**row, "base_currency": "EUR", "target_currency": "RUB", "exchange_time": datetime(2025, 6, 25)},
+        {**row, "base_currency": "EUR", "target_currency": "RUB", "exchange_time": datetime(2025, 6, 24)},
+    ])
+    assert [(r["base_currency"], r["day"]) for r in rows] == [
+        ("EUR", date(2025, 6, 24)), ("EUR", date(2025, 6, 25)), ("USD", date(2025, 6, 24))
+    ]
+
+@patch("app.services.currency.definitely_currency", new_callable=AsyncMock)
+async def test_history_stats(mock_definitely_currency, override_get_current_user, override_get_async_session):
+    rates = {("EUR", "RUB"): 89.5, ("USD", "RUB"): 79.5}
+
+    async def definitely_currency_side_effect(current_currency):
+        pair = (current_currency.currency_from, current_currency.currency_to)
+        return DefinitelyCurrencyOut(currency_from=pair[0], currency_to=pair[1], conversion_rate=rates[pair])
+
+    mock_definitely_currency.side_effect = definitely_currency_side_effect
+    session = override_get_async_session
+    batch = AmountExchangeBatchIn(items=[
+        AmountExchange(currency_from="EUR", currency_to="RUB", amount=10),
+        AmountExchange(currency_from="USD", currency_to="RUB", amount=20),
+    ])
+    await amount_exchange_batch(batch, override_get_current_user.id, session)
+    rates[("EUR", "RUB")] = 90.5
+    await amount_exchange(AmountExchange(currency_from="EUR", currency_to="RUB", amount=30), override_get_current_user.id, session)
+
+    # статистика считается только по агрегатам, строки из conftest в них не попали
+    stats = await history_stats(session, override_get_current_user.id, per_day=False)
+    assert [(s.base_currency, s.target_currency, s.conversions, s.amount_total) for s in stats] == [
+        ("EUR", "RUB", 2, 40), ("USD", "RUB", 1, 20)
+    ]
+    assert stats[0].day is None
+    assert stats[0].avg_rate == pytest.approx(90.0)
+    assert (stats[0].min_rate, stats[0].max_rate) == (89.5, 90.5)
+    assert stats[0].converted_total == pytest.approx(10 * 89.5 + 30 * 90.5)
+
+    stats = await history_stats(session, override_get_current_user.id)
+    assert {s.day for s in stats} == {datetime.now(timezone.utc).date()}
+    assert await history_stats(session, override_get_current_user.id, date_to=date(2025, 1, 1)) == []
+
+async def test_history_page_reads_archive(override_get_current_user, override_get_async_session):
+    session = override_get_async_session
+    session.add(ConversionHistoryArchive(id=100, user_id=1, base_currency="GBP", target_currency="RUB", amount=1,
+                                         converted_amount=100, rate=100, exchange_time=datetime(2020, 1, 1, 8, 0)))
+    await session.commit()
+
+    page, cursor = await history_page(session, override_get_current_user.id, limit=2)
+    assert [h.base_currency for h in page] == ["EUR", "USD"]
+    page, cursor = await history_page(session, override_get_current_user.id, limit=2, cursor=cursor)
+    assert [(h.base_currency, h.exchange_time) for h in page] == [("GBP", "01.01.2020 08:00")]
+    assert cursor is None
+
+    # период целиком в горячих секциях, архив не читается
+    assert history_tables(datetime.now(timezone.utc)) == [ConversionHistory.__table__]
+    page, _ = await history_page(session, override_get_current_user.id, date_from=datetime.now(timezone.utc))
+    assert page == []
@@ -0,0 +1,82 @@
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import select, func
+
+from app.api.schemas.currency import AmountExchange, DefinitelyCurrencyOut
+from app.db.models import ConversionHistory, ConversionRollup
+from app.services.currency import amount_exchange, history_page
+from app.services.history_writer import flush_history, read_history_batch
+from tests.conftest import test_async_session_maker as session_maker_for_tests
+from tests.mocks.redis import setup_redis_mock
+
+
+async def count_history(session) -> int:
+    return (await session.execute(select(func.count()).select_from(ConversionHistory))).scalar_one()
+
+@patch("app.services.history_writer.async_session_maker", session_maker_for_tests)
+@patch("app.services.history_writer.settings.HISTORY_WRITE_BEHIND", True)
+@patch("app.services.history_writer.get_redis", new_callable=AsyncMock)
+@patch("app.services.currency.definitely_currency", new_callable=AsyncMock)
+async def test_amount_exchange_write_behind(mock_definitely_currency, mock_redis_client, override_get_async_session):
+    fake_redis = setup_redis_mock(mock_redis_client, {})
+    mock_definitely_currency.return_value = DefinitelyCurrencyOut(currency_from="GBP", currency_to="RUB", conversion_rate=100)
+    session = override_get_async_session
+
+    await amount_exchange(AmountExchange(currency_from="GBP", currency_to="RUB", amount=3), 1, session)
+    assert await count_history(session) == 2
+
+    # ещё не записанная в базу операция уже видна в истории
+    page, _ = await history_page(session, 1)
+    assert [(h.base_currency, h.amount) for h in page] == [("GBP", 3), ("EUR", 100), ("USD", 10)]
+    page, _ = await history_page(session, 1, currency_from="USD")
+    assert [h.base_currency for h in page] == ["USD"]
+    # limit ограничивает страницу и вместе с незаписанными строками, курсор ведёт дальше
+    page, cursor = await history_page(session, 1, limit=1)
+    assert [h.base_currency for h in page] == ["GBP"]
+    page, cursor = await history_page(session, 1, limit=1, cursor=cursor)
+    assert [h.base_currency for h in page] == ["EUR"]
+    page, cursor = await history_page(session, 1, limit=1, cursor=cursor)
+    assert [h.base_currency for h in page] == ["USD"] and cursor is None
+
+    entries = list(fake_redis.store["history:stream"])
+    assert await flush_history(fake_redis, entries) == 1
+    assert fake_redis.store["history:pending:1"] == {}
+    assert await count_history(session) == 3
+    rollup = (await session.execute(select(ConversionRollup))).scalar_one()
+    assert (rollup.base_currency, rollup.conversions, rollup.amount_total) == ("GBP", 1, 3)
+
+    # повторная доставка той же пачки (упал XACK) не дублирует строки и агрегаты
+    assert await flush_history(fake_redis, entries) == 1
+    assert await count_history(session) == 3
+    session.expire_all()
+    rollup = (await session.execute(select(ConversionRollup))).scalar_one()
+    assert rollup.conversions == 1
+    page, _ = await history_page(session, 1)
+    assert [(h.base_currency, h.amount) for h in page] == [("GBP", 3), ("EUR", 100), ("USD", 10)]
+
+@patch("app.services.history_writer.settings.HISTORY_BUFFER_MAX", 0)
+@patch("app.services.history_writer.settings.HISTORY_WRITE_BEHIND", True)
+@patch("app.services.history_writer.get_redis", new_callable=AsyncMock)
+@patch("app.services.currency.definitely_currency", new_callable=AsyncMock)
+async def test_amount_exchange_write_behind_buffer_full(mock_definitely_currency, mock_redis_client,
+                                                        override_get_async_session):
+    fake_redis = setup_redis_mock(mock_redis_client, {})
+    mock_definitely_currency.return_value = DefinitelyCurrencyOut(currency_from="GBP", currency_to="RUB", conversion_rate=100)
+
+    await amount_exchange(AmountExchange(currency_from="GBP", currency_to="RUB", amount=3), 1, override_get_async_session)
+    assert await count_history(override_get_async_session) == 3
+    assert "history:stream" not in fake_redis.store
+
+@patch("app.services.history_writer.settings.HISTORY_MAX_DELIVERIES", 5)
+async def test_read_history_batch_dead_letters_failing_entries():
+    fake_redis = setup_redis_mock(AsyncMock(), {"history:pending:1": {"a": "{}", "b": "{}"}})
+    entries = [("1-0", {"id": "a", "user_id": "1", "row": "{}"}), ("2-0", {"id": "b", "user_id": "1", "row": "{}"})]
+    fake_redis.xautoclaim.return_value = ["0-0", entries, []]
+    fake_redis.xpending_range.return_value = [
+        {"message_id": "1-0", "times_delivered": 6}, {"message_id": "2-0", "times_delivered": 2}
+    ]
+
+    assert await read_history_batch(fake_redis, "worker") == entries[1:]
+    assert fake_redis.store["history:dead"] == [("1-0", entries[0][1])]
+    assert fake_redis.store["history:pending:1"] == {"b": "{}"}
+    fake_redis.xack.assert_awaited_once_with("history:stream", "history-writers", "1-0")
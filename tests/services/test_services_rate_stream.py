@@ -0,0 +1,55 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
+from fastapi import HTTPException
+
+from app.services import rates
+from app.services.rate_stream import rate_subscription, rate_updates, sse_rate_stream
+from app.services.rates import set_rate_matrix
+
+
+async def test_rate_updates_sends_deltas():
+    set_rate_matrix({"EUR": 0.9, "RUB": 81.0, "JPY": 150.0})
+    updates = rate_updates(rate_subscription("eurrub", "JPY"))
+
+    first = await anext(updates)
+    assert first["rates"] == {
+        "EURRUB": pytest.approx(90.0),
+        "JPYUSD": pytest.approx(1 / 150),
+        "JPYEUR": pytest.approx(0.9 / 150),
+        "JPYRUB": pytest.approx(81.0 / 150),
+    }
+
+    # новый снимок: приходят только изменившиеся курсы
+    set_rate_matrix({"EUR": 0.9, "RUB": 81.0, "JPY": 160.0})
+    delta = await anext(updates)
+    assert set(delta["rates"]) == {"JPYUSD", "JPYEUR", "JPYRUB"}
+
+    await updates.aclose()
+    assert not rates._snapshot_events
+
+@patch("app.services.rate_stream.settings.STREAM_KEEPALIVE_SECONDS", 0.01)
+async def test_sse_rate_stream_keepalive():
+    set_rate_matrix({"EUR": 0.9})
+    events = sse_rate_stream(rate_subscription("EURUSD", None))
+    assert (await anext(events)).startswith(b"event: rates\ndata: {")
+    assert await anext(events) == b": keepalive\n\n"
+    await events.aclose()
+
+async def test_rate_stream_ends_when_token_expires():
+    set_rate_matrix({"EUR": 0.9})
+    events = sse_rate_stream(rate_subscription("EURUSD", None), time.time() + 0.05)
+    assert (await anext(events)).startswith(b"event: rates\n")
+    # по истечении токена поток закрывается, клиент получает expired
+    assert await asyncio.wait_for(anext(events), 1) == b"event: expired\ndata: {}\n\n"
+    with pytest.raises(StopAsyncIteration):
+        await anext(events)
+    assert not rates._snapshot_events
+
+@pytest.mark.parametrize("pairs, bases", [(None, None), ("EURUSD", "EURO"), (None, ",".join(["EUR"] * 11))])
+def test_rate_subscription_invalid(pairs, bases):
+    with pytest.raises(HTTPException) as exc_info:
+        rate_subscription(pairs, bases)
+    assert exc_info.value.status_code == 400
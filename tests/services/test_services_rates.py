@@ -0,0 +1,104 @@
+from datetime import datetime, timezone
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.schemas.currency import DefinitelyCurrencyIn
+from app.services.currency import definitely_currency, list_currencies, list_currencies_body
+from app.core.cache import local_cache
+from app.services.rates import (load_rate_matrix, set_rate_matrix, cross_rate, conversion_rates,
+                                rate_matrix_updated_at, handle_rates_update, convert_amounts)
+
+from tests.mocks.redis import setup_redis_mock
+
+
+async def test_load_rate_matrix(override_get_async_session):
+    loaded = await load_rate_matrix(override_get_async_session)
+    assert loaded == 2
+    assert rate_matrix_updated_at() == datetime(2025, 6, 25, 9, 52, 0)
+    assert cross_rate("USD", "RUB") == 79.51
+    assert cross_rate("EUR", "RUB") == pytest.approx(79.51 / 0.93)
+    assert cross_rate("RUB", "USD") == pytest.approx(1 / 79.51)
+    assert cross_rate("EUR", "EUR") == 1.0
+    assert cross_rate("EUR", "GBP") is None
+
+def test_conversion_rates():
+    set_rate_matrix({"EUR": 0.9, "RUB": 81.0})
+    rows = conversion_rates("EUR")
+    assert rows["USD"] == pytest.approx(1 / 0.9)
+    assert rows["RUB"] == pytest.approx(90.0)
+    assert rows["EUR"] == 1.0
+    assert conversion_rates("EUR") is rows
+    assert conversion_rates("GBP") is None
+
+def test_convert_amounts():
+    set_rate_matrix({"EUR": 0.9, "RUB": 81.0})
+    values, total = convert_amounts(["EUR", "USD", "RUB", "EUR"], [9, 1, 81, 0.9], "RUB")
+    assert values == pytest.approx([810.0, 81.0, 81.0, 81.0])
+    assert total == pytest.approx(1053.0)
+    with pytest.raises(KeyError):
+        convert_amounts(["EUR", "GBP"], [1, 1], "RUB")
+
+@patch("app.services.currency.get_exchange_rate", new_callable=AsyncMock)
+@patch("app.services.currency.get_supported_currencies", new_callable=AsyncMock)
+async def test_rates_answered_from_matrix(mock_get_supported_currencies, mock_get_exchange_rate):
+    set_rate_matrix({"EUR": 0.9, "RUB": 81.0})
+
+    result = await definitely_currency(DefinitelyCurrencyIn(currency_from="eur", currency_to="rub"))
+    assert result.currency_from == "EUR"
+    assert result.conversion_rate == pytest.approx(90.0)
+    assert result.as_of is None
+
+    set_rate_matrix({"EUR": 0.9, "RUB": 81.0}, datetime(2025, 6, 25, 9, 0, 0))
+    result = await definitely_currency(DefinitelyCurrencyIn(currency_from="eur", currency_to="rub"))
+    assert result.as_of == datetime(2025, 6, 25, 9, 0, 0, tzinfo=timezone.utc)
+
+    result = await list_currencies("USD")
+    assert result.conversion_rates == {"USD": 1.0, "EUR": 0.9, "RUB": 81.0}
+
+    mock_get_exchange_rate.assert_not_called()
+    mock_get_supported_currencies.assert_not_called()
+
+@patch("app.services.currency.get_redis", new_callable=AsyncMock)
+@patch("app.services.currency.get_supported_currencies", new_callable=AsyncMock)
+async def test_list_currencies_body(mock_get_supported_currencies, mock_redis_client):
+    setup_redis_mock(mock_redis_client, {})
+    mock_get_supported_currencies.return_value = {"conversion_rates": {"USD": 0.0067, "JPY": 1.0}}
+    set_rate_matrix({"EUR": 0.9, "RUB": 81.0})
+
+    body = await list_currencies_body("eur")
+    assert json.loads(body) == (await list_currencies("EUR")).model_dump(exclude_none=True)
+    assert await list_currencies_body("EUR") is body
+
+    body = json.loads(await list_currencies_body("JPY"))
+    assert body.pop("as_of")
+    assert body == {"currency_from": "JPY", "conversion_rates": {"USD": 0.0067, "JPY": 1.0}}
+
+    set_rate_matrix({"EUR": 0.95})
+    assert json.loads(await list_currencies_body("EUR"))["conversion_rates"]["USD"] == pytest.approx(1 / 0.95)
+
+@patch("app.services.currency.get_redis", new_callable=AsyncMock)
+@patch("app.services.currency.get_exchange_rate", new_callable=AsyncMock)
+async def test_upstream_fallback_disabled(mock_get_exchange_rate, mock_redis_client):
+    setup_redis_mock(mock_redis_client, {})
+    set_rate_matrix({"EUR": 0.9})
+    with patch("app.services.currency.settings.UPSTREAM_FALLBACK", False):
+        with pytest.raises(HTTPException) as exc_info:
+            await definitely_currency(DefinitelyCurrencyIn(currency_from="EUR", currency_to="GBP"))
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "unsupported-code"
+    mock_get_exchange_rate.assert_not_called()
+
+@patch("app.services.rates.refresh_rate_matrix", new_callable=AsyncMock)
+async def test_handle_rates_update(mock_refresh_rate_matrix):
+    local_cache.set("EUR->RUB", 89.5)
+
+    await handle_rates_update({"type": "subscribe", "channel": "currency:rates", "data": 1})
+    assert local_cache.get("EUR->RUB") == 89.5
+    mock_refresh_rate_matrix.assert_not_called()
+
+    await handle_rates_update({"type": "message", "channel": "currency:rates", "data": "{}"})
+    assert local_cache.get("EUR->RUB") is None
+    mock_refresh_rate_matrix.assert_called_once()
@@ -1,14 +1,47 @@
 import json
+import time
 from datetime import datetime
-from unittest.mock import patch, Mock
+from unittest.mock import patch, AsyncMock
 
-from app.db.models import CurrencyRate
-from app.tasks.currency import update_currency_rates
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import SQLAlchemyError
 
-@patch("app.tasks.currency.sync_supported_currencies", new_callable=Mock)
-@patch("app.tasks.currency.sync_session_maker")
-def test_update_currency_rates(mock_sync_session_maker, mock_sync_supported_currencies):
-    mock_sync_supported_currencies.return_value = {
+from app.db.models import Base, CurrencyRate, RateSnapshot
+from app.celery_app import celery_app
+from app.tasks.currency import update_currency_rates, persist_currency_rates
+from tests.mocks.redis import token_bucket_eval
+
+
+@pytest.fixture
+def sync_session_maker_for_tests():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session_maker = sessionmaker(engine)
+    with session_maker() as session:
+        session.add(CurrencyRate(
+            base_currency="USD",
+            target_currency="EUR",
+            rate=0.9,
+            updated_at=datetime(2025, 6, 15, 9, 0, 0)
+        ))
+        session.commit()
+    yield session_maker
+    engine.dispose()
+
+@pytest.fixture
+def eager_celery():
+    celery_app.conf.task_always_eager = True
+    yield
+    celery_app.conf.task_always_eager = False
+
+@patch("app.tasks.currency.get_sync_redis")
+@patch("app.tasks.currency.get_supported_currencies", new_callable=AsyncMock)
+def test_update_currency_rates(mock_get_supported_currencies, mock_get_sync_redis, sync_session_maker_for_tests,
+                               eager_celery):
+    mock_get_sync_redis.return_value.eval.side_effect = token_bucket_eval({})
+    mock_get_supported_currencies.return_value = {
         "currency_from": "USD",
         "conversion_rates": {
             "USD": 1.0,
@@ -17,35 +50,70 @@ def test_update_currency_rates(mock_sync_session_maker, mock_sync_supported_curr
         }
     }
 
-    existing_currency = CurrencyRate(
-        base_currency="USD",
-        target_currency="EUR",
-        rate=0.9,
-        updated_at=datetime(2025, 6, 15, 9, 0, 0)
-    )
+    with patch("app.tasks.currency.sync_session_maker", sync_session_maker_for_tests):
+        timings = update_currency_rates()
+        update_currency_rates()
+    assert set(timings) == {"fetch", "transform"}
+
+    with sync_session_maker_for_tests() as session:
+        rates = session.execute(
+            select(CurrencyRate.target_currency, CurrencyRate.rate, CurrencyRate.updated_at)
+            .order_by(CurrencyRate.target_currency)
+        ).all()
+    assert [(r.target_currency, r.rate) for r in rates] == [("EUR", 0.93), ("RUB", 79.51)]
+    assert rates[0].updated_at == rates[1].updated_at
+    assert rates[0].updated_at > datetime(2025, 6, 15, 9, 0, 0)
+
+    with sync_session_maker_for_tests() as session:
+        snapshots = session.execute(
+            select(RateSnapshot.target_currency, RateSnapshot.taken_at).order_by(RateSnapshot.taken_at)
+        ).all()
+    assert len(snapshots) == 4
+    assert {s.target_currency for s in snapshots} == {"EUR", "RUB"}
+    assert len({s.taken_at for s in snapshots}) == 2
 
-    mock_session = Mock()
+    channel, message = mock_get_sync_redis.return_value.publish.call_args.args
+    assert channel == "currency:rates"
+    assert json.loads(message)["base_currency"] == "USD"
 
-    mock_result = Mock()
-    mock_scalars = Mock()
-    mock_scalars.all.return_value = [existing_currency]
-    mock_result.scalars.return_value = mock_scalars
+@patch("app.tasks.currency.get_sync_redis")
+@patch("app.tasks.currency.persist_currency_rates")
+@patch("app.tasks.currency.get_supported_currencies", new_callable=AsyncMock)
+def test_update_currency_rates_fetches_bases_concurrently(mock_get_supported_currencies, mock_persist_currency_rates,
+                                                          mock_get_sync_redis):
+    async def supported_currencies(base_currency, client):
+        rate = 150 if base_currency == "USD" else 160
+        return {"currency_from": base_currency, "conversion_rates": {base_currency: 1, "JPY": rate}}
 
-    mock_session.execute.return_value = mock_result
+    mock_get_supported_currencies.side_effect = supported_currencies
+    mock_get_sync_redis.return_value.eval.side_effect = token_bucket_eval({})
+    with patch("app.tasks.currency.settings.REFRESH_BASE_CURRENCIES", ["USD", "EUR"]):
+        update_currency_rates()
 
-    mock_sync_session_maker.return_value.__enter__.return_value = mock_session
-    mock_sync_session_maker.return_value.__exit__.return_value = None
+    clients = {call.args[1] for call in mock_get_supported_currencies.call_args_list}
+    assert len(clients) == 1
+    rates, update_time = mock_persist_currency_rates.delay.call_args.args
+    assert rates == {"USD": {"JPY": 150.0}, "EUR": {"JPY": 160.0}}
+    assert datetime.fromisoformat(update_time).tzinfo is not None
+    key, = mock_get_sync_redis.return_value.hset.call_args.args
+    assert key == "metrics:rates_refresh"
+    assert set(mock_get_sync_redis.return_value.hset.call_args.kwargs["mapping"]) == {"fetch", "transform"}
 
-    update_currency_rates()
+@patch("app.tasks.currency.get_sync_redis")
+def test_persist_currency_rates_failure_leaves_cache_alone(mock_get_sync_redis):
+    broken_session_maker = sessionmaker(create_engine("sqlite://"))
 
-    assert existing_currency.rate == 0.93
+    with patch("app.tasks.currency.sync_session_maker", broken_session_maker):
+        with pytest.raises(SQLAlchemyError):
+            persist_currency_rates.run({"USD": {"EUR": 0.93}}, "2025-06-25T10:00:00+00:00")
+    mock_get_sync_redis.assert_not_called()
 
-    added_obj = None
-    for call in mock_session.add.call_args_list:
-        arg = call.args[0]
-        if arg.target_currency == "RUB":
-            added_obj = arg
-            break
+@patch("app.tasks.currency.get_sync_redis")
+@patch("app.tasks.currency.get_supported_currencies", new_callable=AsyncMock)
+def test_update_currency_rates_skips_when_quota_exhausted(mock_get_supported_currencies, mock_get_sync_redis):
+    store = {"quota:exchangerate-api": {"tokens": "0", "ts": str(time.time())}}
+    mock_get_sync_redis.return_value.eval.side_effect = token_bucket_eval(store)
 
-    assert added_obj is not None
-    assert added_obj.rate == 79.51
\ No newline at end of file
+    assert update_currency_rates() is None
+    mock_get_supported_currencies.assert_not_called()
+    assert store["quota:exchangerate-api:usage"] == {"worker:denied": "1"}
@@ -0,0 +1,23 @@
+from datetime import date, datetime, timezone
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.models import Base
+from app.db.partitions import add_months, hot_history_start
+from app.tasks.history import archive_conversion_history
+
+
+def test_add_months():
+    assert add_months(date(2025, 11, 1), 2) == date(2026, 1, 1)
+    assert add_months(date(2025, 1, 1), -1) == date(2024, 12, 1)
+    assert hot_history_start(12, datetime(2026, 10, 18, tzinfo=timezone.utc)) == datetime(2025, 10, 1, tzinfo=timezone.utc)
+
+def test_archive_conversion_history_without_partitions():
+    # в SQLite секций нет, задача ничего не делает
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with patch("app.tasks.history.sync_session_maker", sessionmaker(engine)):
+        assert archive_conversion_history() == []
+    engine.dispose()